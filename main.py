@@ -1,6 +1,10 @@
 if __name__ == "__main__":
 
+    import multiprocessing
     import sys
     from ppl_tools import app
 
+    # needed for the embedding worker processes in a bundled app
+    multiprocessing.freeze_support()
+
     sys.exit(app.run())
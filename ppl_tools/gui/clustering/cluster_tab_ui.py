@@ -1,10 +1,18 @@
+import os
+
 from PySide6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QPushButton,
                                QComboBox, QSpinBox, QProgressBar, QLabel,
                                QGroupBox, QFormLayout, QDoubleSpinBox,
-                               QCheckBox, QStackedWidget, QSizePolicy)
+                               QCheckBox, QStackedWidget, QSizePolicy,
+                               QTableWidget, QHeaderView, QAbstractItemView)
 from PySide6.QtWebEngineWidgets import QWebEngineView
 from PySide6.QtCore import Qt
 
+from ppl_tools.gui.clustering.plot_page import PlotPage
+from ppl_tools.scripts.embedding_pool import DEFAULT_N_WORKERS
+from ppl_tools.scripts.plotting import DEFAULT_POINT_BUDGET
+from ppl_tools.scripts.projection import ProjectionMethod
+
 class ClusterTabUI:
     def setup_ui(self, widget):
         self.main_layout = QVBoxLayout(widget)
@@ -38,6 +46,10 @@ class ClusterTabUI:
 
         self.file_btn = QPushButton("Select CSV File")
         file_layout.addWidget(self.file_btn)
+
+        self.open_session_btn = QPushButton("Open Session")
+        self.open_session_btn.setToolTip("Reopen a saved analysis without embedding or clustering again.")
+        file_layout.addWidget(self.open_session_btn)
         file_column_layout.addRow(file_layout)
 
         self.column_combo = QComboBox()
@@ -92,6 +104,38 @@ class ClusterTabUI:
         clusters_layout.addWidget(self.cluster_spin)
         model_options_layout.addLayout(clusters_layout)
 
+        # Sweep over a range of cluster counts
+        sweep_layout = QHBoxLayout()
+        self.sweep_checkbox = QCheckBox("Try up to:")
+        self.sweep_checkbox.setToolTip(
+            "Fit every number of clusters from the value above up to this one, "
+            "and keep the best by BIC (or silhouette, for the Bayesian model)."
+        )
+        sweep_layout.addWidget(self.sweep_checkbox)
+        self.sweep_max_spin = QSpinBox()
+        self.sweep_max_spin.setRange(2, 100)
+        self.sweep_max_spin.setValue(20)
+        self.sweep_max_spin.setEnabled(False)
+        sweep_layout.addWidget(self.sweep_max_spin)
+        model_options_layout.addLayout(sweep_layout)
+
+        # Previous run to update with new findings
+        previous_run_layout = QHBoxLayout()
+        self.previous_run_label = QLabel("No previous run")
+        self.previous_run_label.setStyleSheet("color: gray;")
+        previous_run_layout.addWidget(self.previous_run_label)
+        self.previous_run_btn = QPushButton("Update Previous Run...")
+        previous_run_layout.addWidget(self.previous_run_btn)
+        model_options_layout.addLayout(previous_run_layout)
+
+        update_mode_layout = QHBoxLayout()
+        update_mode_layout.addWidget(QLabel("Update Mode:"))
+        self.update_mode_combo = QComboBox()
+        self.update_mode_combo.addItems(['assign', 'refit'])
+        self.update_mode_combo.setEnabled(False)
+        update_mode_layout.addWidget(self.update_mode_combo)
+        model_options_layout.addLayout(update_mode_layout)
+
         # Advanced options
         self.advanced_checkbox = QCheckBox("Show Advanced Options")
         model_options_layout.addWidget(self.advanced_checkbox)
@@ -107,10 +151,26 @@ class ClusterTabUI:
         self.model_combo.addItems(['thenlper/gte-large', 'all-MiniLM-L6-v2', 'avsolatorio/GIST-Embedding-v0'])
         advanced_layout.addWidget(self.model_combo)
 
+        # Inference Backend
+        advanced_layout.addWidget(QLabel("Inference Backend:"))
+        self.backend_combo = QComboBox()
+        self.backend_combo.addItems(['torch', 'onnx', 'int8'])
+        advanced_layout.addWidget(self.backend_combo)
+
+        # Embedding Processes
+        advanced_layout.addWidget(QLabel("Embedding Processes:"))
+        self.embedding_workers_spin = QSpinBox()
+        self.embedding_workers_spin.setRange(1, os.cpu_count() or 1)
+        self.embedding_workers_spin.setValue(DEFAULT_N_WORKERS)
+        advanced_layout.addWidget(self.embedding_workers_spin)
+
         # Clustering Model
         advanced_layout.addWidget(QLabel("Clustering Model:"))
         self.cluster_model_combo = QComboBox()
-        self.cluster_model_combo.addItems(['Gaussian Mixture', 'Bayesian Gaussian Mixture'])
+        self.cluster_model_combo.addItems(
+            ['Gaussian Mixture', 'Bayesian Gaussian Mixture', 'Mini-Batch Gaussian Mixture',
+             'Spherical K-Means', 'Graph Communities']
+            )
         advanced_layout.addWidget(self.cluster_model_combo)
 
         # Model-specific options
@@ -148,8 +208,75 @@ class ClusterTabUI:
         bgm_widget.setLayout(bgm_layout)
         self.model_options_stack.addWidget(bgm_widget)
 
+        # Spherical k-means options
+        skm_widget = QWidget()
+        skm_layout = QFormLayout()
+        self.skm_soft_checkbox = QCheckBox("Soft Assignments")
+        skm_layout.addRow(self.skm_soft_checkbox)
+        self.skm_concentration = QDoubleSpinBox()
+        self.skm_concentration.setRange(1, 1000)
+        self.skm_concentration.setDecimals(1)
+        self.skm_concentration.setValue(50)
+        self.skm_concentration.setSingleStep(5)
+        self.skm_concentration.setEnabled(False)
+        skm_layout.addRow("Concentration:", self.skm_concentration)
+        skm_widget.setLayout(skm_layout)
+        self.model_options_stack.addWidget(skm_widget)
+
+        # Graph community detection options
+        graph_widget = QWidget()
+        graph_layout = QFormLayout()
+        self.graph_neighbors_spin = QSpinBox()
+        self.graph_neighbors_spin.setRange(2, 100)
+        self.graph_neighbors_spin.setValue(15)
+        graph_layout.addRow("Neighbors:", self.graph_neighbors_spin)
+        self.graph_resolution_spin = QDoubleSpinBox()
+        self.graph_resolution_spin.setRange(0.05, 10)
+        self.graph_resolution_spin.setDecimals(2)
+        self.graph_resolution_spin.setValue(1.0)
+        self.graph_resolution_spin.setSingleStep(0.1)
+        graph_layout.addRow("Resolution:", self.graph_resolution_spin)
+        self.graph_algorithm_combo = QComboBox()
+        self.graph_algorithm_combo.addItems(['louvain', 'leiden'])
+        graph_layout.addRow("Algorithm:", self.graph_algorithm_combo)
+        graph_widget.setLayout(graph_layout)
+        self.model_options_stack.addWidget(graph_widget)
+
         advanced_layout.addWidget(self.model_options_stack)
 
+        # Dimensionality reduction before clustering
+        advanced_layout.addWidget(QLabel("Dimensionality Reduction:"))
+        self.reduction_combo = QComboBox()
+        self.reduction_combo.addItems(['None', 'Explained Variance', 'Fixed Dimension'])
+        advanced_layout.addWidget(self.reduction_combo)
+        self.reduction_value_spin = QDoubleSpinBox()
+        self.reduction_value_spin.setEnabled(False)
+        advanced_layout.addWidget(self.reduction_value_spin)
+        self.whiten_checkbox = QCheckBox("Whiten")
+        self.whiten_checkbox.setEnabled(False)
+        advanced_layout.addWidget(self.whiten_checkbox)
+
+        # How findings are laid out in the plot
+        advanced_layout.addWidget(QLabel("Plot Layout:"))
+        self.projection_combo = QComboBox()
+        self.projection_combo.addItems([m.value for m in ProjectionMethod])
+        self.projection_combo.setToolTip("'opentsne' is faster on large files, but requires the openTSNE package.")
+        advanced_layout.addWidget(self.projection_combo)
+        advanced_layout.addWidget(QLabel("Plot Point Budget:"))
+        self.point_budget_spin = QSpinBox()
+        self.point_budget_spin.setRange(1000, 1_000_000)
+        self.point_budget_spin.setSingleStep(5000)
+        self.point_budget_spin.setValue(DEFAULT_POINT_BUDGET)
+        self.point_budget_spin.setToolTip("Larger files are plotted with a sample of this many findings; zoom in for more.")
+        advanced_layout.addWidget(self.point_budget_spin)
+
+        # Restarts
+        advanced_layout.addWidget(QLabel("Restarts:"))
+        self.n_init_spin = QSpinBox()
+        self.n_init_spin.setRange(1, 32)
+        self.n_init_spin.setValue(1)
+        advanced_layout.addWidget(self.n_init_spin)
+
         # Max Iterations
         advanced_layout.addWidget(QLabel("Max Iterations:"))
         self.max_iter_spin = QSpinBox()
@@ -216,21 +343,45 @@ class ClusterTabUI:
             QSizePolicy.Policy.Expanding
             )
         self.web_view.setMinimumSize(440, 300)
+        # reports clicks on findings in the plot
+        self.plot_page = PlotPage(self.web_view)
+        self.web_view.setPage(self.plot_page)
         self.web_view.hide()
         results_layout.addWidget(self.web_view)
 
+        # Findings similar to the one clicked in the plot
+        self.similar_label = QLabel("Click a finding in the plot to see the most similar findings.")
+        self.similar_label.setWordWrap(True)
+        self.similar_label.hide()
+        results_layout.addWidget(self.similar_label)
+        self.similar_table = QTableWidget(0, 4)
+        self.similar_table.setHorizontalHeaderLabels(["Similarity", "Cluster", "Participant", "Finding"])
+        self.similar_table.horizontalHeader().setSectionResizeMode(3, QHeaderView.ResizeMode.Stretch)
+        self.similar_table.verticalHeader().setVisible(False)
+        self.similar_table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.similar_table.setWordWrap(True)
+        self.similar_table.setMaximumHeight(200)
+        self.similar_table.hide()
+        results_layout.addWidget(self.similar_table)
+
         self.results_group.setLayout(results_layout)
 
     def setup_export_area(self):
         self.export_group = QGroupBox("Export Options")
         export_layout = QHBoxLayout()
 
-        self.export_csv_btn = QPushButton("Export Clusters to CSV")
+        self.export_csv_btn = QPushButton("Export Clusters")
         export_layout.addWidget(self.export_csv_btn)
 
         self.export_html_btn = QPushButton("Export Graphic to HTML")
         export_layout.addWidget(self.export_html_btn)
 
+        self.save_run_btn = QPushButton("Save Run for Updates")
+        export_layout.addWidget(self.save_run_btn)
+
+        self.save_session_btn = QPushButton("Save Session")
+        export_layout.addWidget(self.save_session_btn)
+
         self.export_group.setLayout(export_layout)
 
         self.export_group.hide()
@@ -4,18 +4,33 @@ from pathlib import Path
 
 from PySide6.QtCore import Qt, QUrl, Slot
 from PySide6.QtStateMachine import QState, QStateMachine
-from PySide6.QtWidgets import QFileDialog, QMessageBox, QWidget
+from PySide6.QtWidgets import QFileDialog, QMessageBox, QTableWidgetItem, QWidget
 
 from ppl_tools.gui.clustering.model import ClusteringModel
 from ppl_tools.gui.clustering.cluster_tab_ui import ClusterTabUI
 from ppl_tools.gui.common import Worker
+from ppl_tools.scripts.backends import EmbeddingBackend
+from ppl_tools.scripts.incremental import UpdateMode
 from ppl_tools.scripts.cluster import ClusteringConfig, ClusteringModelType, CovarianceType
+from ppl_tools.scripts.export import ExportFormat
+from ppl_tools.scripts.graph import CommunityAlgorithm
+from ppl_tools.scripts.projection import ProjectionMethod
 
 
 logger = logging.getLogger(__name__)
 fh = logging.FileHandler(Path.cwd() / 'log/cluster.log')
 fh.setLevel(logging.DEBUG)
-logger.addHandler(fh)
+# on the package's logger, so that the model's messages are logged there too
+logging.getLogger(__package__).addHandler(fh)
+
+# save dialog filters, by the export format they choose; Parquet and Arrow
+# exports are directories holding the table and the arrays
+EXPORT_FILTERS = {
+    'CSV Files, Assignments Only (*.csv)': ExportFormat.CSV,
+    'Parquet Directory (*.parquet)': ExportFormat.PARQUET,
+    'Arrow Directory (*.arrow)': ExportFormat.ARROW,
+    'NumPy Archive (*.npz)': ExportFormat.NPZ,
+}
 
 
 class ClusterTab(QWidget):
@@ -34,7 +49,10 @@ class ClusterTab(QWidget):
         self.setup_model_signals()
 
         self.clustering_config: ClusteringConfig | None = None
+        self.sweep_range: tuple[int, int] | None = None
         self.embedding_model_type: str = ''
+        self.embedding_workers: int = 1
+        self.embedding_backend = EmbeddingBackend.TORCH
 
         self.cancellation_flag: bool = False
 
@@ -47,15 +65,27 @@ class ClusterTab(QWidget):
         self.ui.column_combo.currentIndexChanged.connect(self.handle_column_selection)
         # model options inputs --
         self.ui.advanced_checkbox.checkStateChanged.connect(self.toggle_advanced_options)
+        self.ui.sweep_checkbox.checkStateChanged.connect(self.toggle_sweep)
+        self.ui.skm_soft_checkbox.checkStateChanged.connect(self.toggle_soft_assignments)
         self.ui.cluster_model_combo.currentIndexChanged.connect(self.update_model_options)
+        self.ui.reduction_combo.currentIndexChanged.connect(self.update_reduction_options)
         # control pane --
         # this is a UI signal instead of a direct state transition because
         # we prompt the user to confirm with a message box if they haven't
         # downloaded the results
         self.ui.new_analysis_btn.clicked.connect(self.handle_new_analysis_clicked)
+        self.ui.cancel_btn.clicked.connect(self.cancel_plot)
         # export options --
         self.ui.export_csv_btn.clicked.connect(self.export_csv)
         self.ui.export_html_btn.clicked.connect(self.export_html)
+        self.ui.save_run_btn.clicked.connect(self.save_run)
+        # saved sessions --
+        self.ui.save_session_btn.clicked.connect(self.save_session)
+        self.ui.open_session_btn.clicked.connect(self.open_session)
+        # incremental update of a previous run --
+        self.ui.previous_run_btn.clicked.connect(self.select_previous_run)
+        # similar findings to the one clicked in the plot --
+        self.ui.plot_page.finding_clicked.connect(self.show_similar_findings)
 
     def setup_model_signals(self):
         self.clustering_model.file_loaded.connect(self.file_selection_state.finished)
@@ -130,6 +160,9 @@ class ClusterTab(QWidget):
         self.loading_model_state.addTransition(self.loading_model_state.finished, self.creating_embeddings_state)
         self.creating_embeddings_state.addTransition(self.creating_embeddings_state.finished, self.performing_clustering_state)
         self.performing_clustering_state.addTransition(self.performing_clustering_state.finished, self.analysis_complete_state)
+        # a reopened session goes straight to its results
+        for state in [self.idle_state, self.file_selection_state, self.column_selection_state, self.ready_state]:
+            state.addTransition(self.clustering_model.session_loaded, self.analysis_complete_state)
 
         # Cancellation transitions
         for state in [self.loading_model_state, self.creating_embeddings_state, self.performing_clustering_state]:
@@ -154,11 +187,17 @@ class ClusterTab(QWidget):
         self.ui.file_label.setText('No file selected')
         self.ui.file_label.setStyleSheet("color: gray;")
         self.ui.file_btn.setEnabled(True)
+        self.ui.open_session_btn.setEnabled(True)
         # prep combo box
         self.ui.column_combo.clear()
         self.ui.column_combo.setEnabled(False)
         self.ui.run_btn.setEnabled(False)
         self.ui.model_options_group.setEnabled(False)
+        self.ui.previous_run_label.setText('No previous run')
+        self.ui.previous_run_label.setStyleSheet("color: gray;")
+        self.ui.update_mode_combo.setEnabled(False)
+        self.ui.model_combo.setEnabled(True)
+        self.ui.cluster_spin.setEnabled(True)
         self.ui.progress_widget.hide()
         self.ui.cancel_btn.hide()
         self.ui.new_analysis_btn.hide()
@@ -166,6 +205,9 @@ class ClusterTab(QWidget):
         # clear the web view widget
         self.ui.web_view.setHtml('')
         self.ui.web_view.hide()
+        self.ui.similar_label.hide()
+        self.ui.similar_table.setRowCount(0)
+        self.ui.similar_table.hide()
         self.ui.results_label.setText("Select a file to begin.")
         self.ui.results_label.show()
 
@@ -179,6 +221,8 @@ class ClusterTab(QWidget):
         self.reset_ui()
 
     def on_file_selection_state_entered(self):
+        # the label is reset below, so don't keep updating a run loaded for the previous file
+        self.clustering_model.clear_previous_run()
         self.reset_ui()
         self.select_file()
 
@@ -231,7 +275,9 @@ class ClusterTab(QWidget):
         self.collect_model_options()
         # logger.debug(f'Options collected: {self.options}')
         logger.debug(f'Attempting to load model...')
-        self.clustering_model.load_embedding_model(self.embedding_model_type)
+        self.clustering_model.load_embedding_model(
+            self.embedding_model_type, self.embedding_backend, self.embedding_workers
+            )
         # self.current_task = self.load_embedding_model()
 
     def on_creating_embeddings_state_entered(self):
@@ -241,7 +287,7 @@ class ClusterTab(QWidget):
         self.ui.progress_label.setText("Creating embeddings...")
 
         # self.current_task = self.create_embeddings()
-        self.clustering_model.create_embeddings()
+        self.clustering_model.create_embeddings(self.embedding_workers)
 
     def on_performing_clustering_state_entered(self):
         self.ui.results_label.hide()
@@ -250,21 +296,47 @@ class ClusterTab(QWidget):
         self.ui.progress_label.setText("Performing clustering...")
 
         # self.current_task = self.perform_clustering()
-        self.clustering_model.perform_clustering(self.clustering_config)
+        self.clustering_model.perform_clustering(self.clustering_config, self.sweep_range)
 
     def collect_model_options(self):
         self.embedding_model_type = self.ui.model_combo.currentText()
+        self.embedding_workers = int(self.ui.embedding_workers_spin.value())
+        self.embedding_backend = EmbeddingBackend(self.ui.backend_combo.currentText())
 
         self.clustering_config = ClusteringConfig()
 
         self.clustering_config.n_clusters = int(self.ui.cluster_spin.value())
         self.clustering_config.max_iter = int(self.ui.max_iter_spin.value())
+        self.clustering_config.n_init = int(self.ui.n_init_spin.value())
+
+        self.sweep_range = None
+        if self.ui.sweep_checkbox.isChecked():
+            min_clusters = self.clustering_config.n_clusters
+            self.sweep_range = (min_clusters, max(min_clusters, int(self.ui.sweep_max_spin.value())))
 
         weight_concentration_prior: float | None = None
+        concentration: float | None = None
+        covariance_type = CovarianceType.FULL
         
         if self.ui.cluster_model_combo.currentText() == 'Gaussian Mixture':
             clustering_model = ClusteringModelType.GMM
             covariance_type = CovarianceType(self.ui.gm_covariance_type.currentText())
+        elif self.ui.cluster_model_combo.currentText() == 'Mini-Batch Gaussian Mixture':
+            # shares the Gaussian mixture's options
+            clustering_model = ClusteringModelType.MINIBATCH
+            covariance_type = CovarianceType(self.ui.gm_covariance_type.currentText())
+        elif self.ui.cluster_model_combo.currentText() == 'Graph Communities':
+            # finds the number of clusters itself
+            clustering_model = ClusteringModelType.GRAPH
+            self.clustering_config.n_neighbors = int(self.ui.graph_neighbors_spin.value())
+            self.clustering_config.resolution = self.ui.graph_resolution_spin.value()
+            self.clustering_config.community_algorithm = CommunityAlgorithm(
+                self.ui.graph_algorithm_combo.currentText()
+                )
+        elif self.ui.cluster_model_combo.currentText() == 'Spherical K-Means':
+            clustering_model = ClusteringModelType.SPHERICAL
+            if self.ui.skm_soft_checkbox.isChecked():
+                concentration = self.ui.skm_concentration.value()
         else:
             clustering_model = ClusteringModelType.DPGMM
             covariance_type = CovarianceType(self.ui.bgm_covariance_type.currentText())
@@ -273,6 +345,18 @@ class ClusterTab(QWidget):
         self.clustering_config.model_type = clustering_model
         self.clustering_config.covariance_type = covariance_type
         self.clustering_config.weight_concentration_prior = weight_concentration_prior
+        self.clustering_config.concentration = concentration
+
+        reduction = self.ui.reduction_combo.currentText()
+        if reduction == 'Explained Variance':
+            self.clustering_config.reduction_variance = self.ui.reduction_value_spin.value()
+        elif reduction == 'Fixed Dimension':
+            self.clustering_config.reduction_components = int(self.ui.reduction_value_spin.value())
+        self.clustering_config.whiten = self.ui.whiten_checkbox.isChecked()
+
+        self.clustering_model.set_update_mode(UpdateMode(self.ui.update_mode_combo.currentText()))
+        self.clustering_model.set_projection_method(ProjectionMethod(self.ui.projection_combo.currentText()))
+        self.clustering_model.set_point_budget(int(self.ui.point_budget_spin.value()))
 
     def on_analysis_complete_state_entered(self):
         # UI updates --
@@ -280,22 +364,48 @@ class ClusterTab(QWidget):
         self.ui.export_group.show()
         # results pane
         self.ui.progress_widget.hide()
-        self.ui.results_label.setText("Analysis complete.")
-        # control pane
-        self.ui.cancel_btn.hide()
+        results_text = "Analysis complete."
+        if self.clustering_model.result_from_cache:
+            results_text = "Analysis complete (clustering loaded from cache)."
+        sweep_table = self.clustering_model.sweep_table
+        if sweep_table is not None:
+            logger.debug('Cluster count sweep:\n' + sweep_table.to_string(index=False))
+            results_text += f" Best number of clusters: {self.clustering_model.fitted_config.n_clusters}."
+        if self.clustering_model.fitted_config.model_type == ClusteringModelType.GRAPH:
+            results_text += f" Found {self.clustering_model.n_clusters} clusters."
+        restart_table = self.clustering_model.restart_table
+        if restart_table is not None:
+            logger.debug('Restarts:\n' + restart_table.to_string(index=False))
+            n_abandoned = int((restart_table['status'] == 'abandoned').sum())
+            results_text += f" Best of {len(restart_table)} restarts ({n_abandoned} stopped early)."
+        self.ui.results_label.setText(results_text)
+        self.ui.results_label.show()
+        # control pane; cancel stays available while the plot is generated
         self.ui.new_analysis_btn.show()
-        # display cluster TSNE visualization --
+        # display cluster visualization, generated in the background --
+        self.ui.progress_widget.show()
+        self.ui.progress_bar.setValue(0)
+        self.ui.progress_label.setText("Generating plot...")
         self.clustering_model.generate_plot()
 
     def set_model_options_enabled(self, enabled: bool):
         self.ui.model_options_group.setEnabled(enabled)
         self.ui.file_btn.setEnabled(enabled)
+        self.ui.open_session_btn.setEnabled(enabled)
         self.ui.column_combo.setEnabled(enabled)
 
     @Slot(Qt.CheckState)
     def toggle_advanced_options(self, state):
         self.ui.advanced_group.setVisible(state == Qt.CheckState.Checked)
 
+    @Slot(Qt.CheckState)
+    def toggle_sweep(self, state):
+        self.ui.sweep_max_spin.setEnabled(state == Qt.CheckState.Checked)
+
+    @Slot(Qt.CheckState)
+    def toggle_soft_assignments(self, state):
+        self.ui.skm_concentration.setEnabled(state == Qt.CheckState.Checked)
+
     def select_file(self):
         file_path, _ = QFileDialog.getOpenFileName(self, "Select CSV File", "", "CSV Files (*.csv)")
         if file_path:
@@ -309,8 +419,35 @@ class ClusterTab(QWidget):
             self.clustering_model.set_text_column(column)
 
     def update_model_options(self):
-        is_bayesian = self.ui.cluster_model_combo.currentText() == 'Bayesian Gaussian Mixture'
-        self.ui.model_options_stack.setCurrentIndex(1 if is_bayesian else 0)
+        model = self.ui.cluster_model_combo.currentText()
+        if model == 'Bayesian Gaussian Mixture':
+            self.ui.model_options_stack.setCurrentIndex(1)
+        elif model == 'Spherical K-Means':
+            self.ui.model_options_stack.setCurrentIndex(2)
+        elif model == 'Graph Communities':
+            self.ui.model_options_stack.setCurrentIndex(3)
+        else:
+            self.ui.model_options_stack.setCurrentIndex(0)
+        # graph clustering finds the number of clusters itself
+        sweepable = model != 'Graph Communities'
+        self.ui.sweep_checkbox.setEnabled(sweepable)
+        if not sweepable:
+            self.ui.sweep_checkbox.setChecked(False)
+
+    def update_reduction_options(self):
+        reduction = self.ui.reduction_combo.currentText()
+        self.ui.reduction_value_spin.setEnabled(reduction != 'None')
+        self.ui.whiten_checkbox.setEnabled(reduction != 'None')
+        if reduction == 'Explained Variance':
+            self.ui.reduction_value_spin.setDecimals(2)
+            self.ui.reduction_value_spin.setRange(0.5, 0.99)
+            self.ui.reduction_value_spin.setSingleStep(0.01)
+            self.ui.reduction_value_spin.setValue(0.9)
+        elif reduction == 'Fixed Dimension':
+            self.ui.reduction_value_spin.setDecimals(0)
+            self.ui.reduction_value_spin.setRange(2, 1024)
+            self.ui.reduction_value_spin.setSingleStep(8)
+            self.ui.reduction_value_spin.setValue(64)
 
     @Slot(int)
     def display_load_model_progress(self, prog: int):
@@ -346,6 +483,41 @@ class ClusterTab(QWidget):
             )
         self.ui.web_view.load(QUrl.fromLocalFile(plot_file_path))
         self.ui.web_view.show()
+        self.ui.similar_label.show()
+        self.ui.progress_widget.hide()
+        self.ui.cancel_btn.hide()
+
+    def cancel_plot(self):
+        # the cancel button also cancels earlier stages, through the state machine
+        if not self.clustering_model.plot_in_progress:
+            return
+        self.clustering_model.cancel_plot()
+        self.ui.progress_widget.hide()
+        self.ui.cancel_btn.hide()
+        self.ui.results_label.setText(self.ui.results_label.text() + " Plot cancelled.")
+
+    @Slot(int)
+    def show_similar_findings(self, row: int):
+        similar = self.clustering_model.similar_findings(row)
+        if similar is None:
+            return
+        text = self.clustering_model.clustering_state.text_data[row]
+        preview = text if len(text) <= 120 else text[:120] + '...'
+        self.ui.similar_label.setText(f"Findings most similar to: \"{preview}\"")
+
+        table = self.ui.similar_table
+        table.setRowCount(len(similar))
+        for i, (_, finding) in enumerate(similar.iterrows()):
+            cells = [
+                f"{finding['Similarity']:.3f}",
+                str(finding.get('Cluster', '')),
+                str(finding.get('Participant Code', 'Unknown')),
+                finding['Key Data Points'],
+            ]
+            for j, cell in enumerate(cells):
+                table.setItem(i, j, QTableWidgetItem(cell))
+        table.resizeRowsToContents()
+        table.show()
 
     def export_csv(self):
         if self.csv_filename is None:
@@ -355,12 +527,12 @@ class ClusterTab(QWidget):
         default_out_dir = self.csv_filename.parent
         fname = '[Clustered] ' + self.csv_filename.name
 
-        out_path, _ = QFileDialog.getSaveFileName(
+        out_path, selected_filter = QFileDialog.getSaveFileName(
             dir=str(default_out_dir / fname),
-            filter='CSV Files (*.csv)'
+            filter=';;'.join(EXPORT_FILTERS)
             )
         if out_path:
-            success = self.clustering_model.export_csv(Path(out_path))
+            success = self.clustering_model.export_results(Path(out_path), EXPORT_FILTERS[selected_filter])
         else:
             success = False
         self.downloaded_csv = success
@@ -385,6 +557,59 @@ class ClusterTab(QWidget):
             success = False
         self.downloaded_html = success
 
+    def select_previous_run(self):
+        run_dir = QFileDialog.getExistingDirectory(self, "Select Saved Run")
+        if not run_dir or not self.clustering_model.load_previous_run(Path(run_dir)):
+            return
+        run = self.clustering_model.previous_run
+        self.ui.previous_run_label.setText(Path(run_dir).name)
+        self.ui.previous_run_label.setStyleSheet("color: black;")
+        self.ui.update_mode_combo.setEnabled(True)
+        # new findings have to be embedded and clustered like the previous run's
+        self.ui.model_combo.setCurrentText(run.model_name)
+        self.ui.model_combo.setEnabled(False)
+        self.ui.cluster_spin.setValue(run.config.n_clusters)
+        self.ui.cluster_spin.setEnabled(False)
+
+    def save_run(self):
+        csv_filename = self.clustering_model.csv_filename
+        if csv_filename is None:
+            logger.error('No csv filename.')
+            return
+        default_out_dir = csv_filename.parent
+        dirname = '[Run] ' + csv_filename.stem
+
+        out_path, _ = QFileDialog.getSaveFileName(
+            dir=str(default_out_dir / dirname),
+            )
+        if out_path:
+            self.clustering_model.save_run(Path(out_path))
+
+    def save_session(self):
+        csv_filename = self.clustering_model.csv_filename
+        if csv_filename is None:
+            logger.error('No csv filename.')
+            return
+        default_out_dir = csv_filename.parent
+        dirname = '[Session] ' + csv_filename.stem
+
+        out_path, _ = QFileDialog.getSaveFileName(
+            dir=str(default_out_dir / dirname),
+            )
+        if out_path:
+            self.clustering_model.save_session(Path(out_path))
+
+    def open_session(self):
+        session_dir = QFileDialog.getExistingDirectory(self, "Select Saved Session")
+        if not session_dir or not self.clustering_model.load_session(Path(session_dir)):
+            return
+        # the state machine moves on to the session's results
+        self.ui.file_label.setText(Path(session_dir).name)
+        self.ui.file_label.setStyleSheet("color: black;")
+        self.ui.projection_combo.setCurrentText(self.clustering_model.projection_method.value)
+        self.set_model_options_enabled(False)
+        self.ui.run_btn.setEnabled(False)
+
     def handle_new_analysis_clicked(self):
         start_new_analysis = True
 
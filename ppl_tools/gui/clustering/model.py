@@ -1,7 +1,7 @@
 import io
+import logging
 import os
 import re
-import shutil
 import sys
 import tempfile
 
@@ -15,9 +15,33 @@ import pandas as pd
 from PySide6.QtCore import QObject, QThreadPool, Signal, SignalInstance, Slot
 from sentence_transformers import SentenceTransformer
 
-from ppl_tools.gui.clustering.state import ClusteringState
+from ppl_tools.gui.clustering.plot_page import FINDING_CLICK_SCRIPT
+from ppl_tools.gui.clustering.session import ClusteringSession
+from ppl_tools.gui.clustering.state import ClusteringState, compact_results
 from ppl_tools.gui.common import Worker
-from ppl_tools.scripts.cluster import ClusteringConfig, cluster, make_plot
+from ppl_tools.scripts.backends import EmbeddingBackend, cache_model_name, verify_backend
+from ppl_tools.scripts.batching import EmbeddingCancelled
+from ppl_tools.scripts.cluster import ClusteringConfig, assign, fit, make_plot
+from ppl_tools.scripts.embedding_cache import EmbeddingCache
+from ppl_tools.scripts.embedding_pool import EmbeddingPool, encode, get_pool
+from ppl_tools.scripts.export import ExportFormat, export_results
+from ppl_tools.scripts.incremental import (ClusteringRun, UpdateMode, embed_new,
+                                           make_run, update_clusters)
+from ppl_tools.scripts.model_registry import get_model, registry
+from ppl_tools.scripts.neighbors import NeighborIndex
+from ppl_tools.scripts.plotting import DEFAULT_POINT_BUDGET, export_plot
+from ppl_tools.scripts.projection import ProjectionCache, ProjectionCancelled, ProjectionMethod
+from ppl_tools.scripts.restarts import fit_restarts
+from ppl_tools.scripts.result_cache import ClusteringResult, ResultCache, result_key
+from ppl_tools.scripts.sweep import sweep
+
+
+logger = logging.getLogger(__name__)
+
+# similar findings listed for a clicked finding
+DEFAULT_N_SIMILAR = 10
+# share of the plot's progress bar for laying out the findings
+PLOT_LAYOUT_PROGRESS = 80
 
 
 class ProgressCapture(io.StringIO):
@@ -114,6 +138,7 @@ class ClusteringModel(QObject):
     model_loaded = Signal()
     embeddings_created = Signal()
     clustering_complete = Signal()
+    session_loaded = Signal()
     plot_generated = Signal(str)  # Emits the path to the temporary plot file
     error_occurred = Signal(str)
     progress_updated = Signal(tuple)
@@ -123,8 +148,34 @@ class ClusteringModel(QObject):
         self._csv_filename: Path | None = None
         self._df: pd.DataFrame | None = None
         self._clustering_state = ClusteringState()
-        self._embedding_model: SentenceTransformer | None = None
+        # a pool when embedding in worker processes, which hold their own copies of the model
+        self._embedding_model: SentenceTransformer | EmbeddingPool | None = None
+        self._embedding_model_name: str | None = None
+        self._embedding_backend = EmbeddingBackend.TORCH
+        self._embedding_cache = EmbeddingCache()
         self._tmp_plot_file: IO | None = None
+        # the plot being generated, if any
+        self._plot_worker: Worker | None = None
+        # set when updating a previous run with new findings
+        self._previous_run: ClusteringRun | None = None
+        self._update_mode = UpdateMode.ASSIGN
+        # results of configurations already clustered, by embeddings and config
+        self._result_cache = ResultCache()
+        # the latest clustering, and whether it was loaded from the result cache
+        self._result: ClusteringResult | None = None
+        self._result_from_cache: bool = False
+        # the latest clustering's result cache key, if it was cached
+        self._result_key: str | None = None
+        # 2-D layouts of embeddings already plotted, reused across reclusterings
+        self._projection_cache = ProjectionCache()
+        self._projection_method = ProjectionMethod.TSNE
+        # the distinct findings' layout in the latest plot, and its method
+        self._layout: np.ndarray | None = None
+        self._layout_method: ProjectionMethod | None = None
+        # findings drawn at first in large plots
+        self._point_budget = DEFAULT_POINT_BUDGET
+        # index of the distinct findings' embeddings, built with them
+        self._neighbor_index: NeighborIndex | None = None
 
         self.thread_pool = QThreadPool()
 
@@ -186,17 +237,106 @@ class ClusteringModel(QObject):
         except Exception as e:
             self._handle_error(f'Failed to set text column: {str(e)}')
 
-    def load_embedding_model(self, model_name: str):
-        worker = Worker(self._load_embedding_model_task, model_name)
+    @property
+    def embedding_cache(self):
+        return self._embedding_cache
+
+    @property
+    def previous_run(self):
+        return self._previous_run
+
+    @property
+    def result_cache(self):
+        return self._result_cache
+
+    @property
+    def result_from_cache(self) -> bool:
+        return self._result_from_cache
+
+    @property
+    def sweep_table(self):
+        return self._result.sweep_table if self._result is not None else None
+
+    @property
+    def restart_table(self):
+        return self._result.restart_table if self._result is not None else None
+
+    @property
+    def n_clusters(self) -> int | None:
+        # may differ from the config's for models which pick their own, like graph clustering
+        return self._result.probs.shape[1] if self._result is not None else None
+
+    @property
+    def fitted_config(self) -> ClusteringConfig | None:
+        return self._result.config if self._result is not None else None
+
+    @property
+    def projection_method(self) -> ProjectionMethod:
+        return self._projection_method
+
+    @property
+    def neighbor_index(self) -> NeighborIndex | None:
+        return self._neighbor_index
+
+    def similar_findings(self, row: int, k: int = DEFAULT_N_SIMILAR) -> pd.DataFrame | None:
+        """
+        Finds the findings most similar to the one in a row of the data.
+
+        Identical findings count once: each is listed at its first row, with
+        the number of rows it occurs in.
+
+        Args:
+            row (int): Row of the finding in the data.
+            k (int): Number of similar findings to list.
+
+        Returns:
+            pd.DataFrame | None: One row per similar finding, most similar
+                first, with its row, similarity, cluster (once clustered),
+                participant and text; or None if there are no embeddings yet.
+        """
+        state = self._clustering_state
+        if self._neighbor_index is None or state.inverse is None:
+            self._handle_error("No embeddings available. Please create embeddings first.")
+            return None
+        try:
+            indices, similarities = self._neighbor_index.similar(int(state.inverse[row]), k)
+            rows = state.first_idx[indices]
+            similar = pd.DataFrame({'Row': rows, 'Similarity': similarities})
+            if state.unique_assignments is not None:
+                similar['Cluster'] = state.unique_assignments[indices]
+            if 'Participant Code' in state.df:
+                similar['Participant Code'] = state.df['Participant Code'].iloc[rows].to_numpy()
+            similar['Occurrences'] = state.counts[indices]
+            similar['Key Data Points'] = [state.unique_text[i] for i in indices]
+            return similar
+        except Exception as e:
+            self._handle_error(f"Failed to find similar findings: {str(e)}")
+            return None
+
+    def load_embedding_model(
+            self, model_name: str, backend: EmbeddingBackend = EmbeddingBackend.TORCH, n_workers: int = 1):
+        self._embedding_model_name = model_name
+        self._embedding_backend = backend
+        worker = Worker(self._load_embedding_model_task, model_name, backend, n_workers)
         worker.signals.result.connect(self._on_model_loaded)
         progress_msg = "Loading embedding model..."
         worker.signals.progress.connect(lambda v: self.progress_updated.emit((progress_msg, v)))
 
         self.thread_pool.start(worker)
 
-    def _load_embedding_model_task(self, model_name: str, progress_callback, cancellation_check):
+    def _load_embedding_model_task(
+            self, model_name: str, backend: EmbeddingBackend, n_workers: int,
+            progress_callback, cancellation_check):
         try:
-            model = SentenceTransformer(model_name)
+            if n_workers > 1:
+                # only the workers need the model, so don't keep a copy in this process too;
+                # a pool with the same settings is reused without reloading
+                registry.remove(model_name, backend)
+                model = get_pool(model_name, n_workers, backend=backend)
+                model.start()
+            else:
+                # resident models from earlier analyses are reused without reloading
+                model = get_model(model_name, backend)
             if not cancellation_check():
                 progress_callback.emit(100)
                 return model
@@ -208,7 +348,7 @@ class ClusteringModel(QObject):
             self._embedding_model = model
             self.model_loaded.emit()
 
-    def create_embeddings(self):
+    def create_embeddings(self, n_workers: int = 1):
         if self._clustering_state.text_data is None:
             self.error_occurred.emit("No text data available. Please set a valid text column first.")
             return
@@ -216,14 +356,14 @@ class ClusteringModel(QObject):
             self.error_occurred.emit("No embedding model loaded. Please load a model first.")
             return
 
-        worker = Worker(self._create_embeddings_task)
+        worker = Worker(self._create_embeddings_task, n_workers)
         worker.signals.result.connect(self._on_embeddings_created)
         progress_msg = "Creating embeddings..."
         worker.signals.progress.connect(lambda v: self.progress_updated.emit((progress_msg, v)))
 
         self.thread_pool.start(worker)
 
-    def _create_embeddings_task(self, progress_callback, cancellation_check):
+    def _create_embeddings_task(self, n_workers: int, progress_callback, cancellation_check):
         if self._clustering_state.text_data is None:
             self._handle_error("No text data available. Please set a valid text column first.")
             return
@@ -234,88 +374,264 @@ class ClusteringModel(QObject):
             # to avoid getting a warning printed. see this link for more:
             # https://stackoverflow.com/questions/62691279/how-to-disable-tokenizers-parallelism-true-false-warning
             os.environ["TOKENIZERS_PARALLELISM"] = "false"
-            with capture_progress(progress_callback, cancellation_check):
-                embeddings = self._embedding_model.encode(
-                    self._clustering_state.text_data,
-                    show_progress_bar=True
+
+            def encode_uncached(text: list[str]) -> np.ndarray:
+                verify_backend(self._embedding_model_name, self._embedding_backend, text)
+                embeddings, stats = encode(
+                    text,
+                    self._embedding_model_name,
+                    n_workers=n_workers,
+                    progress_callback=progress_callback.emit,
+                    cancellation_check=cancellation_check,
+                    backend=self._embedding_backend
+                )
+                logger.info(f'Embedded {stats}')
+                return embeddings
+
+            def encode_cached(text: list[str]) -> np.ndarray:
+                # only rows whose text isn't already cached get encoded
+                return self._embedding_cache.get_or_embed(
+                    text,
+                    cache_model_name(self._embedding_model_name, self._embedding_backend),
+                    encode_uncached
+                )
+
+            if self._previous_run is not None:
+                # findings the previous run already embedded are reused as is
+                embeddings, n_new = embed_new(
+                    self._previous_run, self._clustering_state.unique_text, encode_cached
                 )
+                logger.info(f'Embedded {n_new} findings not in the previous run')
+            else:
+                embeddings = encode_cached(self._clustering_state.unique_text)
+            logger.info(f'Embedding cache: {self._embedding_cache.stats}')
+            if cancellation_check():
+                return
+            # indexed once here, for every later similar findings query
+            neighbor_index = NeighborIndex.build(embeddings)
             if not cancellation_check():
                 progress_callback.emit(100)
-                return np.array(embeddings)
+                return embeddings, neighbor_index
+        except EmbeddingCancelled:
+            return
         except Exception as e:
             self._handle_error(f"Failed to create embeddings: {str(e)}")
 
-    @Slot(np.ndarray)
-    def _on_embeddings_created(self, embeddings: np.ndarray):
+    @Slot(tuple)
+    def _on_embeddings_created(self, results: tuple[np.ndarray, NeighborIndex]):
+        embeddings, self._neighbor_index = results
         self._clustering_state.set_embeddings(embeddings)
         self.embeddings_created.emit()
 
-    def perform_clustering(self, config: ClusteringConfig):
-        worker = Worker(self._perform_clustering_task, config)
+    def perform_clustering(self, config: ClusteringConfig, sweep_range: tuple[int, int] | None = None):
+        worker = Worker(self._perform_clustering_task, config, sweep_range)
         worker.signals.result.connect(self._on_clustering_complete)
         progress_msg = "Performing clustering..."
         worker.signals.progress.connect(lambda v: self.progress_updated.emit((progress_msg, v)))
 
         self.thread_pool.start(worker)
 
-    def _perform_clustering_task(self, config: ClusteringConfig, progress_callback, cancellation_check):
-        if self._clustering_state.embeddings is None:
+    def _perform_clustering_task(
+            self, config: ClusteringConfig, sweep_range: tuple[int, int] | None,
+            progress_callback, cancellation_check):
+        if self._clustering_state.unique_embeddings is None:
             self._handle_error("No embeddings available. Please create embeddings first.")
             return
         try:
+            # fit on each distinct finding once, weighted by how often it occurs;
+            # results are broadcast back to all rows in set_clustering_results
+            embeddings = self._clustering_state.unique_embeddings
+            counts = self._clustering_state.counts
+
+            # updates of a previous run depend on that run, so they aren't cached
+            key = None
+            if self._previous_run is None:
+                key = result_key(embeddings, config, counts, sweep_range)
+                result = self._result_cache.get(key)
+                if result is not None:
+                    progress_callback.emit(100)
+                    return result, True, key
+
             with capture_progress(progress_callback, cancellation_check):
-                probs, dists, assignments = cluster(self._clustering_state.embeddings, config)
+                if self._previous_run is not None:
+                    # keep the previous run's clusters and their numbering
+                    config = self._previous_run.config
+                    order = self._previous_run.order
+                    (probs, dists, assignments), mixture = update_clusters(
+                        self._previous_run, embeddings, self._update_mode, sample_weight=counts
+                    )
+                    sweep_table = restart_table = None
+                elif sweep_range is not None:
+                    # fit every candidate cluster count in parallel and keep the best
+                    min_clusters, max_clusters = sweep_range
+                    swept = sweep(
+                        embeddings,
+                        config,
+                        list(range(min_clusters, max_clusters + 1)),
+                        sample_weight=counts,
+                        progress_callback=progress_callback.emit,
+                        cancellation_check=cancellation_check
+                    )
+                    if swept is None:
+                        return
+                    (mixture, order, config), sweep_table = swept
+                    probs, dists, assignments = assign(mixture, embeddings, order)
+                    restart_table = None
+                elif config.n_init > 1:
+                    # fit independently seeded restarts in parallel and keep the best
+                    restarted = fit_restarts(
+                        embeddings,
+                        config,
+                        sample_weight=counts,
+                        progress_callback=progress_callback.emit,
+                        cancellation_check=cancellation_check
+                    )
+                    if restarted is None:
+                        return
+                    (mixture, order), restart_table = restarted
+                    probs, dists, assignments = assign(mixture, embeddings, order)
+                    sweep_table = None
+                else:
+                    mixture, order = fit(embeddings, config, sample_weight=counts)
+                    probs, dists, assignments = assign(mixture, embeddings, order)
+                    sweep_table = restart_table = None
             if not cancellation_check():
+                # kept in the dtypes the clustering state stores, so the two share them
+                probs, dists, assignments = compact_results(probs, dists, assignments)
+                result = ClusteringResult(
+                    probs, dists, assignments, mixture, order, config, sweep_table, restart_table
+                )
+                if key is not None:
+                    self._result_cache.put(key, result)
                 progress_callback.emit(100)
-                return probs, dists, assignments
+                return result, False, key
         except Exception as e:
             self._handle_error(f"Clustering failed: {str(e)}")
 
     def _on_clustering_complete(self, results):
-        probs, dists, assignments = results
-        self._clustering_state.set_clustering_results(probs, dists, assignments)
+        self._result, self._result_from_cache, self._result_key = results
+        # a reclustering of other findings can't reuse the last layout
+        self._layout = self._layout_method = None
+        self._clustering_state.set_clustering_results(
+            self._result.probs, self._result.dists, self._result.labels
+        )
         self.clustering_complete.emit()
 
     def generate_plot(self):
-        if self._df is None or self._clustering_state.text_data is None or self._clustering_state.assignments is None:
+        if self._df is None or self._clustering_state.unique_assignments is None:
             self._handle_error("Cannot generate plot: missing data or clustering results.")
             return
 
+        # a newer plot replaces one still being generated
+        self.cancel_plot()
+        # the task gets its own references to the data, since a new analysis
+        # may clear the state while it runs
+        worker = Worker(
+            self._generate_plot_task,
+            self._clustering_state.plot_data(),
+            self._clustering_state.unique_embeddings,
+            self._clustering_state.inverse,
+            self._clustering_state.assignments,
+            self._clustering_state.dists,
+            self._projection_method,
+            # a layout made with the same method, say from a reopened session, is reused
+            self._layout if self._layout_method == self._projection_method else None,
+            self._point_budget
+        )
+        worker.signals.result.connect(self._on_plot_generated)
+        progress_msg = "Generating plot..."
+        worker.signals.progress.connect(lambda v: self.progress_updated.emit((progress_msg, v)))
+        self._plot_worker = worker
+
+        self.thread_pool.start(worker)
+
+    def _generate_plot_task(
+            self, plot_data: pd.DataFrame, unique_embeddings: np.ndarray,
+            inverse: np.ndarray, assignments: np.ndarray, dists: np.ndarray, projection: ProjectionMethod,
+            layout: np.ndarray | None, point_budget: int, progress_callback, cancellation_check):
         try:
-            n_datapoints = len(self._clustering_state.text_data)
-            # Create a temporary DataFrame with the necessary columns
-            temp_df = pd.DataFrame({
-                'Key Data Points': self._clustering_state.text_data,
-                'Participant Code': self._df.get('Participant Code', ['Unknown'] * n_datapoints),
-                'Project': self._df.get('Project', ['Unknown'] * n_datapoints)
-            })
+            # lay out each distinct finding once; the layout is cached, since
+            # it doesn't depend on the clustering. It takes most of the time,
+            # so it gets most of the progress bar
+            if layout is None:
+                layout = self._projection_cache.get_or_project(
+                    unique_embeddings,
+                    projection,
+                    progress_callback=lambda v: progress_callback.emit(round(PLOT_LAYOUT_PROGRESS * v / 100)),
+                    cancellation_check=cancellation_check
+                )
+            if cancellation_check():
+                return
+            progress_callback.emit(PLOT_LAYOUT_PROGRESS)
 
             # Create a temporary file to save the plot
-            self._tmp_plot_file = tempfile.NamedTemporaryFile(
+            plot_file = tempfile.NamedTemporaryFile(
                 mode='w', suffix='.html', delete=False
                 )
-            
-            # Generate the plot
+
+            # Generate the plot, reporting clicked findings to the plot's page
             make_plot(
-                temp_df,
-                self._clustering_state.embeddings,
-                self._clustering_state.assignments,
-                out_file=self._tmp_plot_file.name
+                plot_data,
+                # only used to lay the findings out, which is done above
+                None,
+                assignments,
+                out_file=plot_file.name,
+                post_script=FINDING_CLICK_SCRIPT,
+                layout=layout[inverse],
+                projection=projection,
+                # loads the shared plotly.js and a data sidecar; made
+                # self-contained on export
+                self_contained=False,
+                # large plots draw a sample, always including the findings
+                # closest to their cluster's mean
+                dists=dists,
+                max_points=point_budget
             )
-
-            self.plot_generated.emit(self._tmp_plot_file.name)
+            if not cancellation_check():
+                progress_callback.emit(100)
+                return plot_file, layout, projection
+        except ProjectionCancelled:
+            return
         except Exception as e:
             self._handle_error(f"Failed to generate plot: {str(e)}")
 
-    def export_csv(self, path: Path) -> bool:
-        if self._df is None:
+    def _on_plot_generated(self, results: tuple[IO, np.ndarray, ProjectionMethod] | None):
+        # results are only emitted by workers which weren't cancelled
+        self._plot_worker = None
+        if results is None:
+            return
+        plot_file, self._layout, self._layout_method = results
+        if self._tmp_plot_file:
+            self._tmp_plot_file.close()
+        self._tmp_plot_file = plot_file
+        self.plot_generated.emit(self._tmp_plot_file.name)
+
+    @property
+    def plot_in_progress(self) -> bool:
+        return self._plot_worker is not None
+
+    def cancel_plot(self):
+        if self._plot_worker is not None:
+            self._plot_worker.cancel()
+            self._plot_worker = None
+
+    def export_results(self, path: Path, export_format: ExportFormat = ExportFormat.CSV) -> bool:
+        if self._df is None or self._clustering_state.unique_assignments is None:
             self._handle_error("No data available to export.")
             return False
         try:
-            self._df.to_csv(path, index=False)
+            export_results(
+                path,
+                self._df,
+                self._clustering_state.probs,
+                self._clustering_state.dists,
+                self._clustering_state.assignments,
+                self._clustering_state.embeddings,
+                export_format
+            )
             return True
         except Exception as e:
-            self._handle_error(f"Failed to export CSV: {str(e)}")
+            self._handle_error(f"Failed to export results: {str(e)}")
             return False
 
     def export_html(self, path: Path) -> bool:
@@ -323,14 +639,109 @@ class ClusteringModel(QObject):
             self._handle_error("No plot generated. Please generate the plot first.")
             return False
         try:
-            shutil.copy(self._tmp_plot_file.name, str(path))
+            export_plot(Path(self._tmp_plot_file.name), path)
             return True
         except Exception as e:
             self._handle_error(f"Failed to export HTML: {str(e)}")
             return False
 
+    def load_previous_run(self, path: Path) -> bool:
+        try:
+            self._previous_run = ClusteringRun.load(path)
+            return True
+        except Exception as e:
+            self._handle_error(f"Failed to load previous run: {str(e)}")
+            return False
+
+    def clear_previous_run(self):
+        self._previous_run = None
+
+    def set_update_mode(self, mode: UpdateMode):
+        self._update_mode = mode
+
+    def set_projection_method(self, method: ProjectionMethod):
+        self._projection_method = method
+
+    def set_point_budget(self, point_budget: int):
+        self._point_budget = point_budget
+
+    def save_session(self, path: Path) -> bool:
+        if self._result is None or self._clustering_state.unique_embeddings is None:
+            self._handle_error("No clustering results to save. Please run the analysis first.")
+            return False
+        try:
+            session = ClusteringSession(
+                state=self._clustering_state,
+                result=self._result,
+                model_name=self._embedding_model_name,
+                csv_filename=self._csv_filename,
+                projection=self._layout_method or self._projection_method,
+                layout=self._layout,
+                neighbor_index=self._neighbor_index
+            )
+            session.save(path)
+            return True
+        except Exception as e:
+            self._handle_error(f"Failed to save session: {str(e)}")
+            return False
+
+    def load_session(self, path: Path) -> bool:
+        try:
+            session = ClusteringSession.load(path)
+        except Exception as e:
+            self._handle_error(f"Failed to open session: {str(e)}")
+            return False
+        self.reset()
+        self._clustering_state = session.state
+        self._df = session.state.df
+        self._csv_filename = session.csv_filename
+        self._embedding_model_name = session.model_name
+        self._result = session.result
+        self._neighbor_index = session.neighbor_index
+        self._projection_method = session.projection
+        self._layout = session.layout
+        self._layout_method = session.projection if session.layout is not None else None
+        self.session_loaded.emit()
+        return True
+
+    def save_run(self, path: Path) -> bool:
+        if self._result is None or self._clustering_state.unique_embeddings is None:
+            self._handle_error("No clustering results to save. Please run the analysis first.")
+            return False
+        if self._result.mixture is None:
+            # so that running the analysis again fits the model
+            if self._result_key is not None:
+                self._result_cache.delete(self._result_key)
+            self._handle_error(
+                "This clustering was loaded from the cache, which doesn't keep the fitted model. "
+                "Please run the analysis again to save it as a run."
+            )
+            return False
+        try:
+            run = make_run(
+                self._embedding_model_name,
+                self._result.config,
+                self._clustering_state.unique_text,
+                self._clustering_state.unique_embeddings,
+                self._result.mixture,
+                self._result.order,
+                self._neighbor_index
+            )
+            run.save(path)
+            return True
+        except Exception as e:
+            self._handle_error(f"Failed to save run: {str(e)}")
+            return False
+
     def reset(self):
+        self.cancel_plot()
         self._df = None
+        self._result = None
+        self._result_from_cache = False
+        self._result_key = None
+        self._neighbor_index = None
+        self._layout = self._layout_method = None
+        self._previous_run = None
         self._clustering_state.clear()
         self._file_path = None
         if self._tmp_plot_file:
@@ -0,0 +1,29 @@
+from PySide6.QtCore import Signal
+from PySide6.QtWebEngineCore import QWebEnginePage
+
+# the plot reports clicked findings by logging this prefix and their row index
+FINDING_CLICK_PREFIX = 'ppl_tools:finding_clicked:'
+
+# run in the plot's page once it is drawn (see make_plot's post_script); the
+# plot's div is available there as {plot_id}
+FINDING_CLICK_SCRIPT = """
+document.getElementById('{plot_id}').on('plotly_click', function(data) {
+    var point = data.points[0];
+    console.log('%s' + point.customdata[point.customdata.length - 1]);
+});
+""" % FINDING_CLICK_PREFIX
+
+
+class PlotPage(QWebEnginePage):
+    """
+    A web page for the cluster plot which turns clicks on findings in the
+    plot into a signal, since the page's JavaScript can't call into Python
+    directly.
+    """
+    finding_clicked = Signal(int)  # Emits the clicked finding's row index
+
+    def javaScriptConsoleMessage(self, level, message, line_number, source_id):
+        if message.startswith(FINDING_CLICK_PREFIX):
+            self.finding_clicked.emit(int(float(message[len(FINDING_CLICK_PREFIX):])))
+            return
+        super().javaScriptConsoleMessage(level, message, line_number, source_id)
@@ -0,0 +1,201 @@
+import json
+import os
+import shutil
+import tempfile
+
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from ppl_tools.gui.clustering.state import ClusteringState
+from ppl_tools.scripts.cluster import config_from_dict, config_to_dict
+from ppl_tools.scripts.model_io import load_mixture, save_mixture
+from ppl_tools.scripts.neighbors import NeighborIndex
+from ppl_tools.scripts.projection import ProjectionMethod
+from ppl_tools.scripts.result_cache import ClusteringResult
+
+SESSION_FILE = 'session.json'
+# each save writes a new data directory, named with this prefix, which
+# session.json then points to
+DATA_DIR_PREFIX = 'data-'
+SOURCE_FILE = 'source.arrow'
+MODEL_FILE = 'mixture.npz'
+NEIGHBORS_DIR = 'neighbors'
+# arrays of the distinct findings (embeddings, results, layout), of the rows
+# (inverse) and of the clusters (order), saved as .npy files of these names so
+# they can be memory-mapped
+UNIQUE_ARRAYS = ['embeddings', 'probs', 'dists', 'labels', 'counts', 'layout']
+ROW_ARRAYS = ['inverse']
+CLUSTER_ARRAYS = ['order']
+# bump when the format changes, so older sessions are refused rather than misread
+SESSION_VERSION = 2
+
+
+def _owned_data_dirs(path: Path) -> list[str]:
+    # the data directories an existing session in path wrote, and so may be deleted;
+    # only plain names with the prefix, so a malformed file can't point elsewhere
+    with open(path / SESSION_FILE) as f:
+        info = json.load(f)
+    names = [info.get('data_dir')] + info.get('stale_data_dirs', [])
+    return [
+        name for name in names
+        if isinstance(name, str) and name.startswith(DATA_DIR_PREFIX) and Path(name).name == name
+        and (path / name).exists()
+    ]
+
+
+def _require_pyarrow() -> None:
+    # optional dependency, only needed for saved sessions
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError as e:
+        raise ImportError('Saved sessions require the pyarrow package (pip install pyarrow).') from e
+
+
+@dataclass
+class ClusteringSession:
+    """
+    A completed analysis, saved so that it can be reopened without embedding
+    or clustering again.
+
+    A session is a directory: a JSON file of settings, and a data directory
+    with the source DataFrame as an uncompressed Arrow (Feather) file, the
+    fitted mixture's arrays as an .npz file, and every other array as a .npy
+    file. The table and arrays are memory-mapped when the session is loaded,
+    so reopening takes about as long whatever the number of findings, and
+    none of the files are pickles, so loading runs no code from them.
+    Results are saved per distinct finding, like the clustering state keeps
+    them.
+
+    Attributes:
+        state (ClusteringState): The data, embeddings and results.
+        result (ClusteringResult): The clustering of the distinct findings.
+        model_name (str): The embedding model used.
+        csv_filename (Path | None): The CSV the data was loaded from.
+        projection (ProjectionMethod): How the findings were laid out.
+        layout (np.ndarray | None): The distinct findings' 2-D layout, if it
+            was made before the session was saved.
+        neighbor_index (NeighborIndex | None): Index of the distinct findings'
+            embeddings, for similar findings queries.
+    """
+    state: ClusteringState
+    result: ClusteringResult
+    model_name: str
+    csv_filename: Path | None = None
+    projection: ProjectionMethod = ProjectionMethod.TSNE
+    layout: np.ndarray | None = None
+    neighbor_index: NeighborIndex | None = None
+
+    def save(self, path: Path) -> None:
+        """
+        Saves the session to a directory, replacing any session saved there.
+
+        Raises:
+            ValueError: If path is a non-empty directory which isn't a session.
+            ImportError: If pyarrow isn't installed.
+        """
+        _require_pyarrow()
+        path = Path(path)
+        if (path / SESSION_FILE).exists():
+            old_dirs = _owned_data_dirs(path)
+        elif path.exists() and any(path.iterdir()):
+            # don't mix session files into, and later delete from, some other directory
+            raise ValueError(f'{path} is not empty and not a saved session.')
+        else:
+            old_dirs = []
+        path.mkdir(parents=True, exist_ok=True)
+        # a new data directory rather than overwriting files, since the session
+        # being saved over may be the open one, with its files memory-mapped
+        data_dir = Path(tempfile.mkdtemp(prefix=DATA_DIR_PREFIX, dir=path))
+        state = self.state
+        state.df.reset_index(drop=True).to_feather(data_dir / SOURCE_FILE, compression='uncompressed')
+        arrays = {
+            'embeddings': np.asarray(state.unique_embeddings, dtype=np.float32),
+            'probs': np.asarray(self.result.probs, dtype=np.float32),
+            'dists': np.asarray(self.result.dists, dtype=np.float32),
+            'labels': np.asarray(self.result.labels, dtype=np.int32),
+            'counts': np.asarray(state.counts),
+            'inverse': np.asarray(state.inverse),
+            'order': np.asarray(self.result.order),
+        }
+        if self.layout is not None:
+            arrays['layout'] = np.asarray(self.layout, dtype=np.float32)
+        for name, array in arrays.items():
+            np.save(data_dir / f'{name}.npy', array)
+        # results from the cache have no mixture
+        if self.result.mixture is not None:
+            save_mixture(data_dir / MODEL_FILE, self.result.mixture, self.result.order)
+        if self.neighbor_index is not None:
+            self.neighbor_index.save(data_dir / NEIGHBORS_DIR)
+
+        # written last, and renamed into place, so that a session is only
+        # loadable once complete, and then from its new data directory
+        tmp_file = path / f'tmp_{SESSION_FILE}'
+        with open(tmp_file, 'w') as f:
+            json.dump({
+                'version': SESSION_VERSION,
+                'data_dir': data_dir.name,
+                # earlier data directories, until a later save has deleted them
+                'stale_data_dirs': old_dirs,
+                'model_name': self.model_name,
+                'csv_filename': str(self.csv_filename) if self.csv_filename is not None else None,
+                'text_column': state.text_column,
+                'projection': self.projection.value,
+                'config': config_to_dict(self.result.config),
+            }, f, indent=2)
+        os.replace(tmp_file, path / SESSION_FILE)
+        # files still memory-mapped (on Windows) can't be deleted, so earlier
+        # data directories which can't be removed yet are left to the next save
+        for name in old_dirs:
+            shutil.rmtree(path / name, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path: Path) -> 'ClusteringSession':
+        """
+        Loads a saved session, memory-mapping its table and arrays.
+
+        Raises:
+            FileNotFoundError: If path isn't a complete session.
+            ValueError: If the session was saved in an unsupported format.
+            ImportError: If pyarrow isn't installed.
+        """
+        path = Path(path)
+        with open(path / SESSION_FILE) as f:
+            info = json.load(f)
+        if info.get('version') != SESSION_VERSION:
+            raise ValueError(f"Unsupported session version: {info.get('version')}")
+        _require_pyarrow()
+        from pyarrow import feather
+
+        data_dir = path / info['data_dir']
+        arrays = {
+            name: np.load(data_dir / f'{name}.npy', mmap_mode='r')
+            for name in UNIQUE_ARRAYS + ROW_ARRAYS + CLUSTER_ARRAYS
+            if (data_dir / f'{name}.npy').exists()
+        }
+        config = config_from_dict(info['config'])
+        mixture = None
+        if (data_dir / MODEL_FILE).exists():
+            mixture, _ = load_mixture(data_dir / MODEL_FILE, config)
+        neighbor_index = None
+        if (data_dir / NEIGHBORS_DIR).exists():
+            neighbor_index = NeighborIndex.load(data_dir / NEIGHBORS_DIR)
+
+        state = ClusteringState()
+        df = feather.read_table(data_dir / SOURCE_FILE, memory_map=True).to_pandas()
+        state.set_data(df, info['text_column'], arrays['inverse'], arrays['counts'])
+        state.set_embeddings(arrays['embeddings'])
+        result = ClusteringResult(
+            arrays['probs'], arrays['dists'], arrays['labels'], mixture, arrays['order'], config
+        )
+        state.set_clustering_results(result.probs, result.dists, result.labels)
+        return cls(
+            state=state,
+            result=result,
+            model_name=info['model_name'],
+            csv_filename=Path(info['csv_filename']) if info['csv_filename'] is not None else None,
+            projection=ProjectionMethod(info['projection']),
+            layout=arrays.get('layout'),
+            neighbor_index=neighbor_index,
+        )
@@ -3,28 +3,99 @@ from typing import Optional
 import numpy as np
 import pandas as pd
 
+from ppl_tools.scripts.cluster import deduplicate
+
+
+def compact_results(
+    probs: np.ndarray, dists: np.ndarray, assignments: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns clustering results in the dtypes they are kept in: float32
+    probabilities and distances, and int32 assignments. Arrays already in
+    those dtypes are returned as is.
+    """
+    return (
+        np.asarray(probs, dtype=np.float32),
+        np.asarray(dists, dtype=np.float32),
+        np.asarray(assignments, dtype=np.int32),
+    )
+
+
 class ClusteringState:
     """
     Manages the state of the clustering process, including input data and results.
 
     This class encapsulates all data related to the clustering process, providing
     methods to set and retrieve data at various stages of the analysis.
+
+    Identical text entries are deduplicated when the data is set: only
+    unique_text needs to be embedded and clustered (weighted by counts), and
+    the results are broadcast back to every row via inverse.
+
+    Each array is stored once, per unique text entry and in a compact dtype.
+    The per-row embeddings, probs, dists and assignments are broadcast from
+    them on each access, so index the unique_ arrays with inverse instead
+    where only some rows are needed. The DataFrame is the caller's, and
+    isn't copied or added to.
     """
     def __init__(self):
         self.df: Optional[pd.DataFrame] = None
-        self.text_data: Optional[list[str]] = None
-        self.embeddings: Optional[np.ndarray] = None
-        self.probs: Optional[np.ndarray] = None
-        self.dists: Optional[np.ndarray] = None
-        self.assignments: Optional[np.ndarray] = None
+        self.text_column: Optional[str] = None
+        self.unique_text: Optional[list[str]] = None
+        self.first_idx: Optional[np.ndarray] = None
+        self.inverse: Optional[np.ndarray] = None
+        self.counts: Optional[np.ndarray] = None
+        self.unique_embeddings: Optional[np.ndarray] = None
+        self.unique_probs: Optional[np.ndarray] = None
+        self.unique_dists: Optional[np.ndarray] = None
+        self.unique_assignments: Optional[np.ndarray] = None
+
+    @property
+    def text_data(self) -> Optional[pd.api.extensions.ExtensionArray]:
+        """
+        The text of every row: a positionally indexed view of the DataFrame's
+        text column.
+        """
+        if self.df is None:
+            return None
+        return self.df[self.text_column].array
+
+    def _broadcast(self, unique: Optional[np.ndarray]) -> Optional[np.ndarray]:
+        return None if unique is None else unique[self.inverse]
+
+    @property
+    def embeddings(self) -> Optional[np.ndarray]:
+        return self._broadcast(self.unique_embeddings)
+
+    @property
+    def probs(self) -> Optional[np.ndarray]:
+        return self._broadcast(self.unique_probs)
+
+    @property
+    def dists(self) -> Optional[np.ndarray]:
+        return self._broadcast(self.unique_dists)
+
+    @property
+    def assignments(self) -> Optional[np.ndarray]:
+        return self._broadcast(self.unique_assignments)
 
-    def set_data(self, df: pd.DataFrame, text_column: str) -> None:
+    def set_data(
+        self,
+        df: pd.DataFrame,
+        text_column: str,
+        inverse: Optional[np.ndarray] = None,
+        counts: Optional[np.ndarray] = None
+        ) -> None:
         """
-        Sets the input DataFrame and extracts the text data.
+        Sets the input DataFrame and deduplicates its text data.
 
         Args:
             df (pd.DataFrame): The input DataFrame containing the data to be clustered.
             text_column (str): The name of the column in df containing the text data.
+            inverse (np.ndarray): Optionally, the unique text entry of each row,
+                from an earlier deduplication of the same data, which is then skipped.
+            counts (np.ndarray): The number of rows of each unique text entry,
+                required with inverse.
 
         Raises:
             KeyError: If the specified text_column does not exist in the DataFrame.
@@ -32,27 +103,44 @@ class ClusteringState:
         if text_column not in df.columns:
             raise KeyError(f"Column '{text_column}' not found in the DataFrame.")
         self.df = df
-        self.text_data = df[text_column].tolist()
+        self.text_column = text_column
+        text_data = self.text_data
+        if inverse is None:
+            first_idx, inverse, counts = deduplicate(text_data)
+        else:
+            _, first_idx = np.unique(inverse, return_index=True)
+        # indices fit in int32 for any table that fits in memory
+        self.first_idx = np.asarray(first_idx, dtype=np.int32)
+        self.inverse = np.asarray(inverse, dtype=np.int32)
+        self.counts = np.asarray(counts, dtype=np.int32)
+        self.unique_text = [text_data[i] for i in self.first_idx]
 
     def set_embeddings(self, embeddings: np.ndarray) -> None:
         """
         Sets the embeddings created from the text data.
 
         Args:
-            embeddings (np.ndarray): The embeddings array.
+            embeddings (np.ndarray): The embeddings array, with one row either per
+                unique text entry or per text entry.
 
         Raises:
             ValueError: If the number of embeddings doesn't match the number of text entries.
         """
-        if self.text_data is None:
+        if self.df is None:
             raise ValueError("Text data is not set. Call set_data() before set_embeddings().")
-        if len(embeddings) != len(self.text_data):
+        if len(embeddings) == len(self.unique_text):
+            self.unique_embeddings = np.asarray(embeddings, dtype=np.float32)
+        elif len(embeddings) == len(self.inverse):
+            self.unique_embeddings = np.asarray(embeddings[self.first_idx], dtype=np.float32)
+        else:
             raise ValueError("Number of embeddings does not match the number of text entries.")
-        self.embeddings = embeddings
 
     def set_clustering_results(self, probs: np.ndarray, dists: np.ndarray, assignments: np.ndarray) -> None:
         """
-        Sets the results of the clustering process and updates the DataFrame.
+        Sets the results of the clustering process.
+
+        Results may be given per unique text entry, or per row of the
+        DataFrame, in which case the first row of each unique entry is kept.
 
         Args:
             probs (np.ndarray): The probabilities associated with each cluster assignment.
@@ -65,15 +153,26 @@ class ClusteringState:
         """
         if self.df is None:
             raise ValueError("DataFrame is not set. Call set_data() before set_clustering_results().")
-        if len(probs) != len(self.df) or len(dists) != len(self.df) or len(assignments) != len(self.df):
+        if len(probs) == len(dists) == len(assignments) == len(self.df) != len(self.unique_text):
+            probs = probs[self.first_idx]
+            dists = dists[self.first_idx]
+            assignments = assignments[self.first_idx]
+        if len(probs) != len(self.unique_text) or len(dists) != len(self.unique_text) or len(assignments) != len(self.unique_text):
             raise ValueError("Length of clustering results does not match the number of rows in the DataFrame.")
 
-        self.probs = probs
-        self.dists = dists
-        self.assignments = assignments
-        self.df['probs'] = self.probs.tolist()
-        self.df['dists'] = self.dists.tolist()
-        self.df['assignments'] = self.assignments
+        self.unique_probs, self.unique_dists, self.unique_assignments = compact_results(probs, dists, assignments)
+
+    def plot_data(self) -> pd.DataFrame:
+        """
+        Returns the columns make_plot needs: the text as 'Key Data Points',
+        and the participant code and project, where the data has them. The
+        columns are the DataFrame's own, not copies.
+        """
+        columns = {'Key Data Points': self.df[self.text_column]}
+        for name in ['Participant Code', 'Project']:
+            if name in self.df:
+                columns[name] = self.df[name]
+        return pd.DataFrame(columns, copy=False)
 
     def clear(self) -> None:
         """
@@ -0,0 +1,109 @@
+from enum import Enum
+
+import numpy as np
+import torch
+
+from sentence_transformers import SentenceTransformer
+
+# minimum cosine similarity between a backend's vectors and the fp32 torch
+# vectors for the same text, below which the backend is considered broken
+PARITY_THRESHOLD = 0.99
+PARITY_SAMPLE_SIZE = 32
+
+
+class EmbeddingBackend(Enum):
+    TORCH = 'torch'
+    ONNX = 'onnx'
+    INT8 = 'int8'
+
+
+def load_model(model_name: str, backend: EmbeddingBackend = EmbeddingBackend.TORCH) -> SentenceTransformer:
+    """
+    Loads model_name for inference with the given backend.
+
+    TORCH is the reference fp32 PyTorch model. ONNX runs an exported ONNX
+    graph through onnxruntime (exported on first use, which requires the
+    optimum[onnxruntime] extra). INT8 dynamically quantizes the weights of
+    the model's linear layers to int8, for CPU inference.
+    """
+    if backend == EmbeddingBackend.TORCH:
+        return SentenceTransformer(model_name)
+    elif backend == EmbeddingBackend.ONNX:
+        return SentenceTransformer(model_name, backend='onnx', device='cpu')
+    elif backend == EmbeddingBackend.INT8:
+        model = SentenceTransformer(model_name, device='cpu')
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    else:
+        raise ValueError(f"Unsupported embedding backend: {backend}")
+
+
+def cache_model_name(model_name: str, backend: EmbeddingBackend) -> str:
+    """
+    Name under which a backend's embeddings are cached, so that approximate
+    vectors are never mixed with fp32 ones.
+    """
+    if backend == EmbeddingBackend.TORCH:
+        return model_name
+    return f'{model_name}@{backend.value}'
+
+
+def cosine_similarities(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return np.sum(a * b, axis=1)
+
+
+def check_parity(
+    reference: SentenceTransformer,
+    candidate: SentenceTransformer,
+    text: list[str]
+    ) -> np.ndarray:
+    """
+    Returns the cosine similarity between the reference and candidate
+    model's embeddings of each entry of text.
+    """
+    expected = reference.encode(text, convert_to_numpy=True)
+    actual = candidate.encode(text, convert_to_numpy=True)
+    return cosine_similarities(expected, actual)
+
+
+_verified: set[tuple[str, EmbeddingBackend]] = set()
+
+
+def verify_backend(
+    model_name: str,
+    backend: EmbeddingBackend,
+    sample_text: list[str],
+    threshold: float = PARITY_THRESHOLD
+    ) -> None:
+    """
+    Checks, once per model and backend, that the backend reproduces the fp32
+    embeddings of a sample of text.
+
+    Models already in the registry are used as they are; any others are
+    loaded just for the check and released afterwards, rather than kept
+    resident, since the fp32 model isn't otherwise used and the backend's
+    model may only be used in worker processes.
+
+    Raises:
+        ValueError: If any sample's cosine similarity falls below threshold.
+    """
+    if backend == EmbeddingBackend.TORCH or (model_name, backend) in _verified:
+        return
+    # imported here since the registry itself loads models through this module
+    from ppl_tools.scripts.model_registry import registry
+
+    models = []
+    for model_backend in (EmbeddingBackend.TORCH, backend):
+        model = registry.peek(model_name, model_backend)
+        models.append(model if model is not None else load_model(model_name, model_backend))
+    similarities = check_parity(*models, sample_text[:PARITY_SAMPLE_SIZE])
+    # released here rather than kept alive by the traceback of the error below
+    del models
+    if similarities.min() < threshold:
+        raise ValueError(
+            f"The {backend.value} backend's embeddings differ from the full precision model's "
+            f"(cosine similarity {similarities.min():.4f} < {threshold}). "
+            f"Please use the {EmbeddingBackend.TORCH.value} backend for {model_name}."
+            )
+    _verified.add((model_name, backend))
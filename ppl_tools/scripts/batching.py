@@ -0,0 +1,137 @@
+import time
+
+from dataclasses import dataclass
+from typing import Callable
+
+import numpy as np
+
+from sentence_transformers import SentenceTransformer
+
+# padded tokens per batch; 64 sequences at gte-large's 512 token limit
+DEFAULT_TOKEN_BUDGET = 32768
+DEFAULT_MAX_BATCH_SIZE = 256
+
+
+class EmbeddingCancelled(Exception):
+    pass
+
+
+@dataclass
+class EncodeStats:
+    n_texts: int = 0
+    n_tokens: int = 0
+    n_padded_tokens: int = 0
+    n_batches: int = 0
+    seconds: float = 0.0
+
+    @property
+    def texts_per_second(self) -> float:
+        return self.n_texts / self.seconds if self.seconds else 0.0
+
+    @property
+    def tokens_per_second(self) -> float:
+        return self.n_tokens / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        padding = 100 * (1 - self.n_tokens / self.n_padded_tokens) if self.n_padded_tokens else 0
+        return (
+            f'{self.n_texts} texts in {self.n_batches} batches, {self.seconds:.1f}s '
+            f'({self.texts_per_second:.1f} texts/s, {self.tokens_per_second:.0f} tokens/s, '
+            f'{padding:.0f}% padding)'
+            )
+
+
+def token_lengths(model: SentenceTransformer, text: list[str]) -> np.ndarray:
+    encoded = model.tokenizer(
+        text,
+        add_special_tokens=True,
+        truncation=True,
+        max_length=model.max_seq_length,
+    )
+    return np.array([len(ids) for ids in encoded['input_ids']], dtype=np.int64)
+
+
+def make_batches(
+    lengths: np.ndarray,
+    token_budget: int = DEFAULT_TOKEN_BUDGET,
+    max_batch_size: int = DEFAULT_MAX_BATCH_SIZE
+    ) -> list[np.ndarray]:
+    """
+    Groups indices into batches of similar token length.
+
+    Indices are sorted by length, longest first (so that a batch that doesn't
+    fit in memory fails right away rather than at the end), and each batch is
+    grown until its padded size, batch size times its longest sequence, would
+    exceed token_budget.
+
+    Returns:
+        list[np.ndarray]: Arrays of indices into lengths, one per batch.
+    """
+    order = np.argsort(-lengths, kind='stable')
+    batches = []
+    start = 0
+    while start < len(order):
+        # the first element is the longest in the batch, so it sets the padded length
+        longest = max(int(lengths[order[start]]), 1)
+        size = max(1, min(token_budget // longest, max_batch_size))
+        batches.append(order[start:start + size])
+        start += size
+    return batches
+
+
+def encode_bucketed(
+    model: SentenceTransformer,
+    text: list[str],
+    token_budget: int = DEFAULT_TOKEN_BUDGET,
+    max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+    progress_callback: Callable[[int], None] | None = None,
+    cancellation_check: Callable[[], bool] | None = None,
+    ) -> tuple[np.ndarray, EncodeStats]:
+    """
+    Embeds text in length-sorted batches sized by a token budget.
+
+    Batching similar lengths together keeps padding to a minimum, and sizing
+    batches by tokens rather than by count means short findings are encoded
+    many at a time while long ones don't blow up memory. Embeddings are
+    returned in the original order of text.
+
+    Args:
+        model (SentenceTransformer): The embedding model.
+        text (list[str]): The text to embed.
+        token_budget (int): Maximum padded tokens per batch.
+        max_batch_size (int): Maximum number of texts per batch.
+        progress_callback (Callable): Called with the percentage of tokens encoded so far.
+        cancellation_check (Callable): Returns True if encoding should stop.
+
+    Raises:
+        EmbeddingCancelled: If cancellation_check returns True between batches.
+
+    Returns:
+        tuple[np.ndarray, EncodeStats]: A float32 (len(text), d) array, and throughput stats.
+    """
+    start_time = time.perf_counter()
+    lengths = token_lengths(model, text)
+    batches = make_batches(lengths, token_budget, max_batch_size)
+
+    embeddings = np.empty((len(text), model.get_sentence_embedding_dimension()), dtype=np.float32)
+    stats = EncodeStats(n_texts=len(text), n_tokens=int(lengths.sum()), n_batches=len(batches))
+
+    tokens_done = 0
+    for batch in batches:
+        if cancellation_check is not None and cancellation_check():
+            raise EmbeddingCancelled()
+
+        embeddings[batch] = model.encode(
+            [text[i] for i in batch],
+            batch_size=len(batch),
+            show_progress_bar=False,
+            convert_to_numpy=True,
+        )
+        stats.n_padded_tokens += len(batch) * int(lengths[batch].max())
+
+        tokens_done += int(lengths[batch].sum())
+        if progress_callback is not None and stats.n_tokens:
+            progress_callback(round(100 * tokens_done / stats.n_tokens))
+
+    stats.seconds = time.perf_counter() - start_time
+    return embeddings, stats
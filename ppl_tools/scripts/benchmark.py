@@ -0,0 +1,256 @@
+import contextlib
+import dataclasses
+import io
+import multiprocessing
+import sys
+import time
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from sklearn.metrics import adjusted_rand_score, silhouette_score
+
+from ppl_tools.scripts.backends import EmbeddingBackend, check_parity
+from ppl_tools.scripts.batching import encode_bucketed
+from ppl_tools.scripts.cluster import (MODEL_OPTIONS, ClusteringConfig, ClusteringModelType,
+                                       CovarianceType, assign, deduplicate, embed, fit, load_data)
+from ppl_tools.scripts.embedding_cache import EmbeddingCache
+from ppl_tools.scripts.model_registry import get_model
+from ppl_tools.scripts.sweep import SILHOUETTE_SAMPLE_SIZE
+
+DEFAULT_SAMPLE_SIZE = 1000
+# single-text encodes timed to measure latency
+N_LATENCY_SAMPLES = 20
+# how the GUI's clustering state holds its data, in the memory benchmark: as
+# before, with the text and results copied into Python lists, per-row
+# embeddings and a separate table for the plot; or as ClusteringState does now
+STATE_LAYOUTS = ['lists', 'arrays']
+DEFAULT_EMBEDDING_DIM = 384
+
+
+def benchmark_backends(
+    text: list[str],
+    model_name: str,
+    backends: list[EmbeddingBackend] = list(EmbeddingBackend)
+    ) -> pd.DataFrame:
+    """
+    Times each backend on the same text, and compares its vectors to the
+    fp32 torch model's.
+
+    Returns:
+        pd.DataFrame: One row per backend with load time, single-text latency,
+            batch throughput, and min/mean cosine similarity to torch.
+    """
+    reference = get_model(model_name)
+    rows = []
+    for backend in backends:
+        start = time.perf_counter()
+        model = get_model(model_name, backend)
+        load_seconds = time.perf_counter() - start
+
+        latencies = []
+        for t in text[:N_LATENCY_SAMPLES]:
+            start = time.perf_counter()
+            model.encode([t], convert_to_numpy=True)
+            latencies.append(time.perf_counter() - start)
+
+        _, stats = encode_bucketed(model, text)
+        similarities = check_parity(reference, model, text)
+
+        rows.append({
+            'backend': backend.value,
+            'load_s': load_seconds,
+            'latency_ms': 1000 * float(np.median(latencies)),
+            'texts_per_s': stats.texts_per_second,
+            'tokens_per_s': stats.tokens_per_second,
+            'min_cosine': float(similarities.min()),
+            'mean_cosine': float(similarities.mean()),
+        })
+    return pd.DataFrame(rows)
+
+
+def benchmark_clustering(
+    embeddings: np.ndarray,
+    config: ClusteringConfig,
+    model_types: list[ClusteringModelType] = [ClusteringModelType.GMM, ClusteringModelType.SPHERICAL]
+    ) -> pd.DataFrame:
+    """
+    Clusters the same embeddings with each model type, using config's other
+    settings.
+
+    Returns:
+        pd.DataFrame: One row per model type with fit and assignment times,
+            iterations, cosine silhouette, and agreement (adjusted Rand index)
+            with the first model type's labels.
+    """
+    rows = []
+    reference_labels = None
+    for model_type in model_types:
+        model_config = dataclasses.replace(config, model_type=model_type)
+        # the models' per-iteration output would bury the table
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            model, order = fit(embeddings, model_config)
+            fit_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            _, _, labels = assign(model, embeddings, order)
+            assign_seconds = time.perf_counter() - start
+
+        if reference_labels is None:
+            reference_labels = labels
+        silhouette = np.nan
+        if len(np.unique(labels)) > 1:
+            silhouette = silhouette_score(
+                embeddings, labels, metric='cosine',
+                sample_size=min(SILHOUETTE_SAMPLE_SIZE, len(embeddings)), random_state=0
+                )
+        rows.append({
+            'model_type': model_type.name.lower(),
+            'fit_s': fit_seconds,
+            'assign_s': assign_seconds,
+            'n_iter': model.n_iter_,
+            'converged': model.converged_,
+            'cosine_silhouette': silhouette,
+            'ari_vs_first': adjusted_rand_score(reference_labels, labels),
+        })
+    return pd.DataFrame(rows)
+
+
+def _peak_rss() -> int:
+    # resource is Unix only; ru_maxrss is in bytes on macOS and KiB elsewhere
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else 1024 * peak
+
+
+def _state_memory(data_file: str, column: str, layout: str, dim: int, n_clusters: int) -> dict:
+    # run in a fresh process, since peak RSS never goes down
+    from ppl_tools.gui.clustering.state import ClusteringState
+
+    df = pd.read_csv(data_file)
+    loaded_rss = _peak_rss()
+    rng = np.random.default_rng(0)
+
+    def fake_results(n_unique: int):
+        embeddings = rng.standard_normal((n_unique, dim), dtype=np.float32)
+        probs = rng.dirichlet(np.ones(n_clusters), n_unique)
+        return embeddings, probs, rng.random(n_unique), probs.argmax(axis=1)
+
+    if layout == 'lists':
+        text_data = df[column].tolist()
+        first_idx, inverse, counts = deduplicate(text_data)
+        embeddings, probs, dists, assignments = fake_results(len(first_idx))
+        row_embeddings = embeddings[inverse]
+        df['probs'] = probs[inverse].tolist()
+        df['dists'] = dists[inverse].tolist()
+        df['assignments'] = assignments[inverse]
+        n = len(text_data)
+        plot_data = pd.DataFrame({
+            'Key Data Points': text_data,
+            'Participant Code': df.get('Participant Code', ['Unknown'] * n),
+            'Project': df.get('Project', ['Unknown'] * n)
+        })
+        plot_arrays = (row_embeddings, df['assignments'].to_numpy(), dists[inverse])
+    else:
+        state = ClusteringState()
+        state.set_data(df, column)
+        embeddings, probs, dists, assignments = fake_results(len(state.unique_text))
+        state.set_embeddings(embeddings)
+        state.set_clustering_results(probs, dists, assignments)
+        del embeddings, probs, dists, assignments
+        plot_data = state.plot_data()
+        plot_arrays = (state.assignments, state.dists)
+
+    # the plot's data is referenced until here, as it is while the plot is generated
+    del plot_data, plot_arrays
+    peak_rss = _peak_rss()
+    return {
+        'layout': layout,
+        'rows': len(df),
+        'loaded_mb': loaded_rss / 2**20,
+        'peak_mb': peak_rss / 2**20,
+        'state_mb': (peak_rss - loaded_rss) / 2**20,
+    }
+
+
+def benchmark_memory(
+    data_file: str,
+    column: str,
+    dim: int = DEFAULT_EMBEDDING_DIM,
+    n_clusters: int = 10
+    ) -> pd.DataFrame:
+    """
+    Measures the peak memory of holding a CSV's data, embeddings and
+    clustering results in each state layout (see STATE_LAYOUTS), each in
+    its own process. The embeddings and results are random, of the shapes
+    the model and clustering would give, so no model is loaded.
+
+    Returns:
+        pd.DataFrame: One row per layout with the peak RSS after reading
+            the CSV, the peak RSS overall, and the difference, in MiB.
+    """
+    rows = []
+    context = multiprocessing.get_context('spawn')
+    for layout in STATE_LAYOUTS:
+        with ProcessPoolExecutor(1, mp_context=context) as executor:
+            rows.append(executor.submit(_state_memory, data_file, column, layout, dim, n_clusters).result())
+    return pd.DataFrame(rows)
+
+
+def get_args():
+    p = ArgumentParser(description='Benchmark stages of the clustering pipeline on a findings CSV.')
+    subparsers = p.add_subparsers(dest='benchmark', required=True)
+
+    backends = subparsers.add_parser('backends', help='Compare embedding inference backends.')
+    backends.add_argument('data_file')
+    backends.add_argument('--model', default=MODEL_OPTIONS[0], type=str, choices=MODEL_OPTIONS)
+    backends.add_argument('--column', default='Key Data Points', type=str)
+    backends.add_argument('--sample', default=DEFAULT_SAMPLE_SIZE, type=int,
+                          help='Number of rows to embed with each backend.')
+
+    clustering = subparsers.add_parser('clustering', help='Compare clustering model types.')
+    clustering.add_argument('data_file')
+    clustering.add_argument('--model', default=MODEL_OPTIONS[0], type=str, choices=MODEL_OPTIONS)
+    clustering.add_argument('--column', default='Key Data Points', type=str)
+    clustering.add_argument('--num_clusters', default=10, type=int)
+    clustering.add_argument('--covariance_type', default=CovarianceType.FULL.value, type=str,
+                            choices=[c.value for c in CovarianceType],
+                            help='Covariance type of the Gaussian mixtures.')
+    clustering.add_argument('--model_types', nargs='+', default=['gmm', 'spherical'],
+                            choices=[t.name.lower() for t in ClusteringModelType],
+                            help='Model types to compare; agreement is measured against the first.')
+
+    memory = subparsers.add_parser('memory', help='Compare the peak memory of clustering state layouts.')
+    memory.add_argument('data_file')
+    memory.add_argument('--column', default='Key Data Points', type=str)
+    memory.add_argument('--dim', default=DEFAULT_EMBEDDING_DIM, type=int,
+                        help='Dimension of the embeddings, which are random.')
+    memory.add_argument('--num_clusters', default=10, type=int)
+
+    return p.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+
+    if args.benchmark == 'backends':
+        df = load_data(args.data_file)
+        text = df[args.column].dropna().astype(str).tolist()[:args.sample]
+        print(benchmark_backends(text, args.model).to_string(index=False, float_format='%.3f'))
+    elif args.benchmark == 'clustering':
+        df = load_data(args.data_file)
+        text = df[args.column].dropna().astype(str).tolist()
+        embeddings = embed(text, args.model, cache=EmbeddingCache())
+        config = ClusteringConfig(
+            n_clusters=args.num_clusters, covariance_type=CovarianceType(args.covariance_type)
+            )
+        table = benchmark_clustering(
+            embeddings, config, [ClusteringModelType[t.upper()] for t in args.model_types]
+            )
+        print(table.to_string(index=False, float_format='%.3f'))
+    elif args.benchmark == 'memory':
+        table = benchmark_memory(args.data_file, args.column, args.dim, args.num_clusters)
+        print(table.to_string(index=False, float_format='%.1f'))
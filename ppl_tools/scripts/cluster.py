@@ -1,8 +1,9 @@
+import dataclasses
 import os
 import textwrap
 
 from argparse import ArgumentParser
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 from enum import Enum
 from pathlib import Path
 
@@ -11,10 +12,25 @@ import pandas as pd
 
 from plotly import graph_objects as go
 
-from sentence_transformers import SentenceTransformer
-
-from sklearn.manifold import TSNE
+from sklearn.cluster import KMeans
 from sklearn.mixture import BayesianGaussianMixture, GaussianMixture
+from sklearn.mixture._gaussian_mixture import _compute_precision_cholesky, _estimate_gaussian_parameters
+
+from ppl_tools.scripts.backends import EmbeddingBackend, cache_model_name, verify_backend
+from ppl_tools.scripts.batching import DEFAULT_TOKEN_BUDGET
+from ppl_tools.scripts.embedding_cache import DEFAULT_CACHE_DIR, EmbeddingCache, normalize_text
+from ppl_tools.scripts.embedding_pool import DEFAULT_N_WORKERS, encode
+from ppl_tools.scripts.export import ExportFormat, export_results
+from ppl_tools.scripts.graph import DEFAULT_N_NEIGHBORS, CommunityAlgorithm, GraphClustering
+from ppl_tools.scripts.minibatch import MiniBatchGaussianMixture
+from ppl_tools.scripts.neighbors import NeighborIndex
+from ppl_tools.scripts.plotting import (CLUSTER_TRACE_SCRIPT, DEFAULT_POINT_BUDGET, WEBGL_MIN_POINTS, PlotMode,
+                                        add_webgl_trace, default_plot_mode, sample_points, write_plot)
+from ppl_tools.scripts.projection import (AXIS_TITLES, DEFAULT_PROJECTION_CACHE_DIR, ProjectionCache,
+                                          ProjectionMethod, project_2d)
+from ppl_tools.scripts.reduction import ReducedMixture, estimated_speedup, fit_projection
+from ppl_tools.scripts.spherical import SphericalKMeans
+from ppl_tools.scripts.streaming import DEFAULT_CHUNK_SIZE, stream_embeddings
 
 VERBOSITY = 10
 VERBOSE_INTERVAL = 1
@@ -34,6 +50,12 @@ class CovarianceType(Enum):
 class ClusteringModelType(Enum):
     GMM = GaussianMixture
     DPGMM = BayesianGaussianMixture
+    # fit by online EM on mini-batches, for very large finding sets
+    MINIBATCH = MiniBatchGaussianMixture
+    # k-means by cosine similarity, on L2-normalized embeddings
+    SPHERICAL = SphericalKMeans
+    # community detection on the k-nearest-neighbor graph; finds the number of clusters itself
+    GRAPH = GraphClustering
 
 @dataclass
 class ClusteringConfig:
@@ -43,6 +65,43 @@ class ClusteringConfig:
     model_type: ClusteringModelType = ClusteringModelType.GMM
     covariance_type: CovarianceType = CovarianceType.FULL
     weight_concentration_prior: float | None = 0.01
+    # spherical k-means only: soft assignments with this concentration, or hard ones if None
+    concentration: float | None = None
+    # graph clustering only; n_clusters is ignored, since a higher resolution gives more clusters
+    n_neighbors: int = DEFAULT_N_NEIGHBORS
+    resolution: float = 1.0
+    community_algorithm: CommunityAlgorithm = CommunityAlgorithm.LOUVAIN
+    # independently seeded fits, of which the best is kept (see restarts.py)
+    n_init: int = 1
+
+    # optional PCA before fitting, to either a fixed number of dimensions or
+    # the fewest dimensions retaining a fraction of the variance
+    reduction_components: int | None = None
+    reduction_variance: float | None = None
+    whiten: bool = False
+
+
+def config_to_dict(config: ClusteringConfig) -> dict:
+    """
+    Converts config to a JSON-serializable dict, with enums stored by name.
+    """
+    d = {}
+    for f in fields(config):
+        value = getattr(config, f.name)
+        d[f.name] = value.name if isinstance(value, Enum) else value
+    return d
+
+
+def config_from_dict(d: dict) -> ClusteringConfig:
+    kwargs = {}
+    for f in fields(ClusteringConfig):
+        if f.name not in d:
+            continue
+        value = d[f.name]
+        if isinstance(f.type, type) and issubclass(f.type, Enum):
+            value = f.type[value]
+        kwargs[f.name] = value
+    return ClusteringConfig(**kwargs)
 
 
 def get_args():
@@ -52,11 +111,90 @@ def get_args():
     p.add_argument('--model', default=MODEL_OPTIONS[0], type=str, choices=MODEL_OPTIONS)
 
     p.add_argument('--num_clusters', required=False, type=int, default=ClusteringConfig.n_clusters)
-
-    return p.parse_args()
-
-
-def load_data(path: str) -> pd.DataFrame:
+    p.add_argument('--n_init', required=False, type=int, default=ClusteringConfig.n_init,
+                   help='Number of independently seeded fits to run in parallel, keeping the best.')
+    p.add_argument('--concentration', required=False, type=float,
+                   help='With --model_type spherical, assign findings softly, with probabilities '
+                        'sharper the higher this is.')
+    p.add_argument('--n_neighbors', required=False, type=int, default=ClusteringConfig.n_neighbors,
+                   help='With --model_type graph, neighbors each finding is connected to.')
+    p.add_argument('--resolution', required=False, type=float, default=ClusteringConfig.resolution,
+                   help='With --model_type graph, higher values find more, smaller clusters.')
+    p.add_argument('--community_algorithm', default=ClusteringConfig.community_algorithm.value, type=str,
+                   choices=[a.value for a in CommunityAlgorithm],
+                   help="With --model_type graph, 'leiden' requires the leidenalg package.")
+    p.add_argument('--model_type', default=ClusteringConfig.model_type.name.lower(), type=str,
+                   choices=[t.name.lower() for t in ClusteringModelType],
+                   help="Clustering model; 'minibatch' fits on mini-batches, for very large files.")
+    p.add_argument('--sweep', required=False, type=int, nargs=2, metavar=('MIN', 'MAX'),
+                   help='Try every number of clusters from MIN to MAX in parallel and keep the best, '
+                        'instead of using --num_clusters.')
+    p.add_argument('--sweep_workers', required=False, type=int,
+                   help='Number of processes to fit sweep candidates with.')
+
+    reduction = p.add_mutually_exclusive_group()
+    reduction.add_argument('--reduce_dim', required=False, type=int,
+                           help='Project embeddings to this many dimensions with PCA before clustering.')
+    reduction.add_argument('--reduce_variance', required=False, type=float,
+                           help='Project embeddings with PCA to the fewest dimensions retaining '
+                                'this fraction of their variance before clustering.')
+    p.add_argument('--whiten', action='store_true',
+                   help='Scale projected dimensions to unit variance.')
+
+    p.add_argument('--projection', default=ProjectionMethod.TSNE.value, type=str,
+                   choices=[m.value for m in ProjectionMethod],
+                   help="How findings are laid out in the plot; 'opentsne' requires the openTSNE package.")
+    p.add_argument('--plot_mode', required=False, type=str, choices=[m.value for m in PlotMode],
+                   help="How the plot is drawn; defaults to 'webgl' for more than "
+                        f"{WEBGL_MIN_POINTS} findings and 'svg' otherwise.")
+    p.add_argument('--max_points', required=False, type=int,
+                   help='Draw a sample of at most this many findings, always including those closest '
+                        'to their cluster means, and draw more on zooming in.')
+
+    p.add_argument('--cache_dir', default=DEFAULT_CACHE_DIR, type=Path,
+                   help='Directory of the on-disk embedding cache.')
+    p.add_argument('--projection_cache_dir', default=DEFAULT_PROJECTION_CACHE_DIR, type=Path,
+                   help='Directory of the on-disk cache of plot layouts.')
+    p.add_argument('--no_cache', action='store_true',
+                   help='Re-embed every row and re-project the plot layout instead of reusing cached ones.')
+    p.add_argument('--token_budget', default=DEFAULT_TOKEN_BUDGET, type=int,
+                   help='Maximum padded tokens per embedding batch.')
+    p.add_argument('--backend', default=EmbeddingBackend.TORCH.value, type=str,
+                   choices=[b.value for b in EmbeddingBackend],
+                   help='Inference backend for the embedding model.')
+    p.add_argument('--workers', default=DEFAULT_N_WORKERS, type=int,
+                   help='Number of processes to embed with, each holding a copy of the model.')
+
+    p.add_argument('--stream', action='store_true',
+                   help='Read and embed the CSV in chunks, storing embeddings in a .npy file '
+                        'and the text and metadata columns in an Arrow file, both memory-mapped; '
+                        'other columns are dropped. Requires pyarrow.')
+    p.add_argument('--chunk_size', default=DEFAULT_CHUNK_SIZE, type=int,
+                   help='Rows per chunk when streaming.')
+
+    p.add_argument('--export_format', default=ExportFormat.CSV.value, type=str,
+                   choices=[f.value for f in ExportFormat],
+                   help="Format of the results: 'csv' writes cluster assignments and distances only; "
+                        "'parquet' and 'arrow' write a directory of the table and float32 probability and "
+                        "embedding arrays (requires pyarrow); 'npz' writes them all to one file.")
+
+    p.add_argument('--save_run', required=False, type=Path,
+                   help='Directory to save this run to, so it can be updated with new findings later.')
+    p.add_argument('--update_run', required=False, type=Path,
+                   help='Directory of a saved run to update. Only findings it does not contain are '
+                        'embedded, and its model, clusters and cluster numbering are kept.')
+    p.add_argument('--update_mode', default='assign', type=str, choices=['assign', 'refit'],
+                   help="With --update_run, whether to 'assign' findings to the run's clusters "
+                        "or 'refit' the clusters starting from the run's.")
+
+    args = p.parse_args()
+    if args.sweep and args.model_type == ClusteringModelType.GRAPH.name.lower():
+        # graph clustering finds the number of clusters itself
+        p.error('--sweep is not supported with --model_type graph; vary --resolution instead.')
+    return args
+
+
+def check_csv(path: str) -> None:
     ext = Path(path).suffix
     if ext != '.csv':
         raise ValueError(
@@ -65,91 +203,370 @@ def load_data(path: str) -> pd.DataFrame:
             'Please redownload from airtable and try again.'
             )
 
+
+def load_data(path: str) -> pd.DataFrame:
+    check_csv(path)
     df = pd.read_csv(path)
     return df
 
 # make embeddings
-def embed(text: list[str], model_name: str) -> np.ndarray:
-    model = SentenceTransformer(model_name)
+def embed(
+    text: list[str],
+    model_name: str,
+    cache: EmbeddingCache | None = None,
+    token_budget: int = DEFAULT_TOKEN_BUDGET,
+    n_workers: int = 1,
+    backend: EmbeddingBackend = EmbeddingBackend.TORCH
+    ) -> np.ndarray:
     # setting tokenizer parallel environment variable to false,
     # to avoid getting a warning printed. see this link for more:
     # https://stackoverflow.com/questions/62691279/how-to-disable-tokenizers-parallelism-true-false-warning
     os.environ["TOKENIZERS_PARALLELISM"] = "false"
-    embeddings = np.array(model.encode(text))
-    return embeddings
 
-
-def pairwise_euclidean_distances(data, means):
-    # Compute the squared differences between each pair of vectors
-    diff = data[:, np.newaxis, :] - means[np.newaxis, :, :]
-    # Compute the Euclidean distances
-    distances = np.sqrt(np.sum(diff**2, axis=-1))
+    def encode_uncached(to_encode: list[str]) -> np.ndarray:
+        # fails loudly if the backend's vectors drift from the fp32 model's
+        verify_backend(model_name, backend, to_encode)
+        embeddings, stats = encode(
+            to_encode, model_name, n_workers=n_workers, token_budget=token_budget, backend=backend
+            )
+        print(f'Embedded {stats}')
+        return embeddings
+
+    if cache is None:
+        return encode_uncached(text)
+    return cache.get_or_embed(text, cache_model_name(model_name, backend), encode_uncached)
+
+
+def deduplicate(text: list[str]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Finds the unique entries of text, ignoring differences in whitespace.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: The index of the first
+            occurrence of each unique entry, the index of each entry's unique
+            entry (so that unique[inverse] restores the original order), and
+            the number of times each unique entry occurs.
+    """
+    inverse, _ = pd.factorize(pd.Series([normalize_text(t) for t in text], dtype=object))
+    _, first_idx, counts = np.unique(inverse, return_index=True, return_counts=True)
+    return first_idx, inverse, counts
+
+
+class _WeightedMixtureMixin:
+    """
+    Adds sample weights to sklearn's mixture models, so that fitting them
+    fits the same model as fitting on a dataset where each point is repeated
+    weight times: the k-means initialization, the M-step (including tied
+    covariances), the lower bound and the Bayesian mixture's data-derived
+    priors are all weighted. Fits can still differ from the repeated
+    dataset's where k-means draws different random initial centers.
+    """
+    sample_weight: np.ndarray | None = None
+
+    def _initialize_parameters(self, X, random_state, *args, **kwargs):
+        # sklearn's k-means initialization ignores weights, so redo it with them
+        if self.sample_weight is None or self.init_params != 'kmeans':
+            return super()._initialize_parameters(X, random_state, *args, **kwargs)
+        labels = KMeans(self.n_components, n_init=1, random_state=random_state).fit(
+            X, sample_weight=self.sample_weight
+            ).labels_
+        resp = np.zeros((len(X), self.n_components), dtype=X.dtype)
+        resp[np.arange(len(X)), labels] = 1
+        self._initialize(X, resp)
+
+    def _initialize(self, X, resp, *args, **kwargs):
+        if self.sample_weight is None or resp is None:
+            return super()._initialize(X, resp, *args, **kwargs)
+        # weighted, like the repeated points' responsibilities
+        resp = resp * self.sample_weight[:, np.newaxis]
+        if self.covariance_type == 'tied':
+            return self._weighted_tied_update(X, resp)
+        super()._initialize(X, resp, *args, **kwargs)
+
+    def _e_step(self, X, *args, **kwargs):
+        if self.sample_weight is None:
+            return super()._e_step(X, *args, **kwargs)
+        log_prob_norm, log_resp = self._estimate_log_prob_resp(X)
+        return np.average(log_prob_norm, weights=self.sample_weight), log_resp
+
+    def _m_step(self, X, log_resp, *args, **kwargs):
+        if self.sample_weight is None:
+            return super()._m_step(X, log_resp, *args, **kwargs)
+        log_resp = log_resp + np.log(self.sample_weight)[:, np.newaxis]
+        if self.covariance_type == 'tied':
+            return self._weighted_tied_update(X, np.exp(log_resp))
+        super()._m_step(X, log_resp, *args, **kwargs)
+
+    def _weighted_tied_parameters(self, X, resp):
+        # sklearn's tied covariance assumes each point's responsibilities sum to
+        # one, so recompute it with each point's scatter weighted; used for the
+        # initial parameters and in each M-step
+        nk, means, _ = _estimate_gaussian_parameters(X, resp, self.reg_covar, 'tied')
+        covariance = X.T @ (self.sample_weight[:, np.newaxis] * X) - (nk * means.T) @ means
+        covariance /= nk.sum()
+        covariance.flat[::len(covariance) + 1] += self.reg_covar
+        return nk, means, covariance
+
+
+class WeightedGaussianMixture(_WeightedMixtureMixin, GaussianMixture):
+    def _initialize(self, X, resp, *args, **kwargs):
+        super()._initialize(X, resp, *args, **kwargs)
+        if self.sample_weight is not None and self.weights_init is None:
+            # sklearn divides by the number of points rather than their total weight
+            self.weights_ = self.weights_ / self.weights_.sum()
+
+    def _weighted_tied_update(self, X, resp):
+        nk, self.means_, self.covariances_ = self._weighted_tied_parameters(X, resp)
+        self.weights_ = nk / nk.sum()
+        self.precisions_cholesky_ = _compute_precision_cholesky(self.covariances_, 'tied')
+
+
+class WeightedBayesianGaussianMixture(_WeightedMixtureMixin, BayesianGaussianMixture):
+    def _check_parameters(self, X, *args, **kwargs):
+        super()._check_parameters(X, *args, **kwargs)
+        if self.sample_weight is None:
+            return
+        # the priors sklearn takes from the data, as the repeated points' mean and covariance
+        weight = np.asarray(self.sample_weight, dtype=np.float64)
+        mean = np.average(X, axis=0, weights=weight)
+        if self.mean_prior is None:
+            self.mean_prior_ = mean
+        if self.covariance_prior is None:
+            centered = X - mean
+            if self.covariance_type in ('full', 'tied'):
+                covariance = (weight[:, np.newaxis] * centered).T @ centered
+            else:
+                covariance = weight @ centered ** 2
+            covariance /= weight.sum() - 1
+            self.covariance_prior_ = covariance.mean() if self.covariance_type == 'spherical' else covariance
+
+    def _compute_lower_bound(self, log_resp, log_prob_norm):
+        lower_bound = super()._compute_lower_bound(log_resp, log_prob_norm)
+        if self.sample_weight is None:
+            return lower_bound
+        # the bound's entropy term sums over points, so swap it for the weighted sum
+        entropy = np.exp(log_resp) * log_resp
+        return lower_bound + np.sum(entropy) - np.sum(self.sample_weight @ entropy)
+
+    def _weighted_tied_update(self, X, resp):
+        nk, means, covariance = self._weighted_tied_parameters(X, resp)
+        self._estimate_weights(nk)
+        self._estimate_means(nk, means)
+        self._estimate_precisions(nk, means, covariance)
+
+
+# memory used by temporaries in each block of the distance computations
+DISTANCE_BLOCK_BYTES = 64 * 1024 ** 2
+
+
+def _block_rows(row_bytes: int, block_bytes: int = DISTANCE_BLOCK_BYTES) -> int:
+    return max(1, block_bytes // max(row_bytes, 1))
+
+
+def pairwise_euclidean_distances(data: np.ndarray, means: np.ndarray) -> np.ndarray:
+    """
+    Returns the (n, k) float32 distances between each row of data and each mean.
+
+    Uses ||x||^2 + ||mu||^2 - 2 x.mu, so that the bulk of the work is one
+    matrix product per block of rows, rather than materializing an
+    (n, k, d) array of differences.
+    """
+    means = np.asarray(means, dtype=np.float32)
+    mean_sq_norms = np.einsum('ij,ij->i', means, means)
+
+    distances = np.empty((len(data), len(means)), dtype=np.float32)
+    block = _block_rows(4 * (len(means) + data.shape[1]))
+    for start in range(0, len(data), block):
+        x = np.asarray(data[start:start + block], dtype=np.float32)
+        sq_dists = x @ means.T
+        sq_dists *= -2
+        sq_dists += np.einsum('ij,ij->i', x, x)[:, np.newaxis]
+        sq_dists += mean_sq_norms[np.newaxis, :]
+        # rounding can make near-zero distances slightly negative
+        np.maximum(sq_dists, 0, out=sq_dists)
+        distances[start:start + block] = np.sqrt(sq_dists)
     return distances
 
 
+def assigned_euclidean_distances(data: np.ndarray, means: np.ndarray, labels: np.ndarray) -> np.ndarray:
+    """
+    Returns the (n,) float32 distances between each row of data and the mean
+    of its assigned cluster, without computing distances to any other cluster.
+    """
+    means = np.asarray(means, dtype=np.float32)
+    distances = np.empty(len(data), dtype=np.float32)
+    block = _block_rows(4 * data.shape[1])
+    for start in range(0, len(data), block):
+        diff = np.asarray(data[start:start + block], dtype=np.float32) - means[labels[start:start + block]]
+        distances[start:start + block] = np.sqrt(np.einsum('ij,ij->i', diff, diff))
+    return distances
+
 
-def cluster(embeddings: np.ndarray, config: ClusteringConfig) -> tuple[
-        np.ndarray, np.ndarray, np.ndarray]:
+def build_model(config: ClusteringConfig, **kwargs):
+    """
+    Creates an unfitted mixture model for config. Extra keyword arguments are
+    passed through to the sklearn constructor.
+    """
     if config.model_type == ClusteringModelType.GMM:
-        model = GaussianMixture(
+        return WeightedGaussianMixture(
             n_components=config.n_clusters,
             max_iter=config.max_iter,
             covariance_type=config.covariance_type.value,
             verbose=VERBOSITY,
-            verbose_interval=VERBOSE_INTERVAL
+            verbose_interval=VERBOSE_INTERVAL,
+            **kwargs
         )
     elif config.model_type == ClusteringModelType.DPGMM:
-        model = BayesianGaussianMixture(
+        return WeightedBayesianGaussianMixture(
             n_components=config.n_clusters,
             max_iter=config.max_iter,
             covariance_type=config.covariance_type.value,
             weight_concentration_prior=config.weight_concentration_prior,
             verbose=VERBOSITY,
             verbose_interval=VERBOSE_INTERVAL,
+            **kwargs
+        )
+    elif config.model_type == ClusteringModelType.SPHERICAL:
+        return SphericalKMeans(
+            n_clusters=config.n_clusters,
+            concentration=config.concentration,
+            max_iter=config.max_iter,
+            verbose=VERBOSITY,
+            verbose_interval=VERBOSE_INTERVAL,
+            **kwargs
+        )
+    elif config.model_type == ClusteringModelType.GRAPH:
+        return GraphClustering(
+            n_neighbors=config.n_neighbors,
+            resolution=config.resolution,
+            algorithm=config.community_algorithm,
+            verbose=VERBOSITY,
+            **kwargs
+        )
+    elif config.model_type == ClusteringModelType.MINIBATCH:
+        return MiniBatchGaussianMixture(
+            n_components=config.n_clusters,
+            max_iter=config.max_iter,
+            covariance_type=config.covariance_type.value,
+            verbose=VERBOSITY,
+            verbose_interval=VERBOSE_INTERVAL,
+            **kwargs
         )
     else:
         raise ValueError(f"Unsupported model type: {config.model_type}")
 
+
+def size_order(labels: np.ndarray, n_clusters: int, sample_weight: np.ndarray | None = None) -> np.ndarray:
+    """
+    Returns the model's cluster indices in descending order of size, which is
+    the order clusters are numbered in for convenience.
+    """
+    # calculate cluster sizes, counting each point as many times as it's weighted
+    cluster_sizes = np.bincount(labels, weights=sample_weight, minlength=n_clusters)
+    return np.argsort(cluster_sizes)[::-1]
+
+
+def reduce_embeddings(embeddings: np.ndarray, config: ClusteringConfig):
+    """
+    Applies config's optional PCA reduction to embeddings.
+
+    Returns:
+        tuple: The fitted projection (None if config has no reduction), and the
+            embeddings to fit the mixture on.
+    """
+    if config.reduction_components is None and config.reduction_variance is None:
+        return None, embeddings
+    projection = fit_projection(
+        embeddings, config.reduction_components, config.reduction_variance, config.whiten
+        )
+    speedup = estimated_speedup(
+        embeddings.shape[1], projection.n_components_, config.covariance_type.value
+        )
+    print(f'Estimated speedup per EM iteration: {speedup:.0f}x')
+    return projection, projection.transform(embeddings)
+
+
+def fit(
+    embeddings: np.ndarray,
+    config: ClusteringConfig,
+    sample_weight: np.ndarray | None = None,
+    n_workers: int | None = None
+    ):
+    """
+    Fits a mixture model for config. With config.n_init > 1, the restarts are
+    run in n_workers processes (see restarts.fit_restarts).
+
+    Returns:
+        tuple: The fitted model, and the order in which its clusters are numbered
+            (see size_order).
+    """
+    if config.n_init > 1:
+        # imported here, since the restarts module itself imports this one
+        from ppl_tools.scripts.restarts import fit_restarts
+        (model, order), _ = fit_restarts(embeddings, config, sample_weight, n_workers=n_workers)
+        return model, order
+
+    projection, embeddings = reduce_embeddings(embeddings, config)
+    model = build_model(config)
+    model.sample_weight = sample_weight
     labels = model.fit_predict(embeddings)
+    # weights are only needed while fitting; don't keep them around
+    model.sample_weight = None
+    if projection is not None:
+        model = ReducedMixture(projection, model)
+    # len(means_) rather than config.n_clusters, since graph clustering picks its own
+    return model, size_order(labels, len(model.means_), sample_weight)
+
+
+def assign(model, embeddings: np.ndarray, order: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Assigns embeddings to a fitted model's clusters, numbered as given by order.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: Cluster probabilities (n, k),
+            distance to the assigned cluster's mean (n,), and cluster labels (n,).
+    """
     probs = model.predict_proba(embeddings)
+    labels = probs.argmax(axis=1)
 
-    # get distances between each embedding and each cluster mean
-    pairwise_dists = pairwise_euclidean_distances(embeddings, model.means_)
-    # dists to assigned cluster
-    dists_to_assigned_cluster = pairwise_dists[np.arange(len(labels)), labels]
-
-    # rename clusters in descending order by size for convenience
-
-    # calculate cluster sizes
-    _, cluster_sizes = np.unique(labels, return_counts=True)
-
-    # get the new order of the clusters
-    sorted_clusters = np.argsort(cluster_sizes)[::-1]
+    # distance from each embedding to its assigned cluster's mean
+    dists_to_assigned_cluster = assigned_euclidean_distances(embeddings, model.means_, labels)
 
-    # rename labels
-    mapping = {old: new for new, old in enumerate(sorted_clusters)}
-    labels = np.array([mapping[label] for label in labels])
+    # rename labels: the model's cluster order[i] becomes cluster i
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    labels = rank[labels]
 
     # reorder probs
-    probs = probs[:, sorted_clusters]
+    probs = probs[:, order]
 
     return probs, dists_to_assigned_cluster, labels
 
 
-def make_plot(df, embeddings, labels, out_file=None):
-    # create TSNE 2d embeddings ---
-    tsne_embeddings = TSNE(n_components=2).fit_transform(embeddings)
-    tsne_x = tsne_embeddings[:, 0]
-    tsne_y = tsne_embeddings[:, 1]
+def cluster(
+    embeddings: np.ndarray,
+    config: ClusteringConfig,
+    sample_weight: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    model, order = fit(embeddings, config, sample_weight)
+    # rename clusters in descending order by size
+    return assign(model, embeddings, order)
+
+
+def make_plot(df, embeddings, labels, out_file=None, post_script=None, layout=None,
+              projection=ProjectionMethod.TSNE, mode=None, self_contained=True, dists=None, max_points=None):
+    # create 2d embeddings, unless given a (cached) layout made with projection ---
+    if layout is None:
+        layout = project_2d(embeddings, projection)
+    tsne_x = layout[:, 0]
+    tsne_y = layout[:, 1]
 
     # create the plot ---
     text_preview = df['Key Data Points'].map(lambda x: '<br>'.join(textwrap.wrap(x, 75)) + '...')
     # remove NA from participant codes for display
-    participant_code = np.where(
-        df['Participant Code'].isna(),
-        'Unknown',
-        df['Participant Code']
-        )
+    participant_code = np.full(len(df), 'Unknown', dtype=object)
+    if 'Participant Code' in df:
+        participant_code = np.where(df['Participant Code'].isna(), participant_code, df['Participant Code'])
 
     fig = go.Figure()
 
@@ -163,34 +580,54 @@ def make_plot(df, embeddings, labels, out_file=None):
     else:
         hover_template += '<extra></extra>'
 
-
-    for i in range(len(np.unique(labels))):
-        cluster_idxs = (labels == i)
-
-        custom_data = np.stack((
-            labels[cluster_idxs],
-            text_preview[cluster_idxs],
-            participant_code[cluster_idxs],
-            project[cluster_idxs],
-            ), axis=-1)
-
-        fig.add_trace(go.Scatter(
-            x=tsne_x[cluster_idxs],
-            y=tsne_y[cluster_idxs],
-            mode='markers',
-            marker_color=i,
-            customdata=custom_data,
-            hovertemplate=hover_template,
-            name=i
-        ))
+    # large plots are drawn as a single WebGL trace (see plotting.add_webgl_trace)
+    mode = mode or default_plot_mode(len(df))
+    shown = None
+    if max_points is not None and len(df) > max_points:
+        # draw a sample of at most max_points findings, loading more on zoom;
+        # only the WebGL trace supports this
+        mode = PlotMode.WEBGL
+        shown = sample_points(labels, max_points, dists)
+    post_scripts = [post_script] if post_script else []
+    if mode == PlotMode.WEBGL:
+        hover_text = [f'Participant {code}<br>{text}' for code, text in zip(participant_code, text_preview)]
+        add_webgl_trace(
+            fig, tsne_x, tsne_y, labels, hover_text,
+            extra_text=project.astype(str).tolist() if multi_project else None,
+            shown=shown,
+            point_budget=max_points or DEFAULT_POINT_BUDGET
+            )
+        post_scripts.insert(0, CLUSTER_TRACE_SCRIPT)
+    else:
+        for i in range(len(np.unique(labels))):
+            cluster_idxs = (labels == i)
+
+            # the row index is last, for click handlers (see post_script)
+            custom_data = np.stack((
+                labels[cluster_idxs],
+                text_preview[cluster_idxs],
+                participant_code[cluster_idxs],
+                project[cluster_idxs],
+                np.flatnonzero(cluster_idxs),
+                ), axis=-1)
+
+            fig.add_trace(go.Scatter(
+                x=tsne_x[cluster_idxs],
+                y=tsne_y[cluster_idxs],
+                mode='markers',
+                marker_color=i,
+                customdata=custom_data,
+                hovertemplate=hover_template,
+                name=i
+            ))
 
     xrange = (tsne_x.min() - 1, tsne_x.max() + 1)
     yrange = (tsne_y.min() - 1, tsne_y.max() + 1)
 
     # Customize the plot
     fig.update_layout(
-        xaxis_title='t-SNE Dimension 1',
-        yaxis_title='t-SNE Dimension 2',
+        xaxis_title=f'{AXIS_TITLES[projection]} 1',
+        yaxis_title=f'{AXIS_TITLES[projection]} 2',
         legend_title='Cluster',
         template='plotly_white',
         showlegend=True,
@@ -203,31 +640,127 @@ def make_plot(df, embeddings, labels, out_file=None):
     )
     if not out_file:
         out_file = Path.home() / "Downloads" / "cluster_visualization.html"
-    fig.write_html(out_file)
+    # post_script is JavaScript run once the plot is drawn, e.g. to handle clicks;
+    # see plotting.write_plot for self_contained
+    write_plot(fig, out_file, post_script=post_scripts, self_contained=self_contained)
     print(f'Saved interactive visualization to {out_file}')
     return
 
 
 if __name__ == "__main__":
+    # imported here, since the incremental module itself imports this one
+    from ppl_tools.scripts.incremental import ClusteringRun, UpdateMode, embed_new, make_run, update_clusters
+    from ppl_tools.scripts.restarts import fit_restarts
+    from ppl_tools.scripts.sweep import sweep
+
     args = get_args()
 
-    df = load_data(args.data_file)
-    # throw out rows with nan text
-    df = df[~df['Key Data Points'].isna()]
+    previous_run = None
+    if args.update_run:
+        previous_run = ClusteringRun.load(args.update_run)
+        # new findings must be embedded the same way as the previous run's
+        args.model = previous_run.model_name
+        print(f'Updating run {args.update_run} (model {args.model}, {len(previous_run.keys)} findings)')
 
     print('Creating embeddings...')
-    embeddings = embed(df['Key Data Points'].tolist(), args.model)
-    df['embeddings'] = embeddings.tolist()
+    cache = None if args.no_cache else EmbeddingCache(args.cache_dir)
+
+    def embed_text(text: list[str]) -> np.ndarray:
+        if previous_run is not None:
+            embeddings, _ = embed_new(previous_run, text, embed_with_model)
+            return embeddings
+        return embed_with_model(text)
+
+    def embed_with_model(text: list[str]) -> np.ndarray:
+        return embed(text, args.model, cache=cache,
+                     token_budget=args.token_budget, n_workers=args.workers,
+                     backend=EmbeddingBackend(args.backend))
+
+    out_file = Path(args.data_file)
+    if args.stream:
+        check_csv(args.data_file)
+        embeddings_file = out_file.with_suffix('.embeddings.npy')
+        df, embeddings = stream_embeddings(
+            out_file, 'Key Data Points', embed_text, embeddings_file, chunk_size=args.chunk_size
+            )
+        print(f'Saved embeddings to {embeddings_file} and findings to {embeddings_file.with_suffix(".arrow")}')
+        # the streamed table only has some of the input's columns, so don't overwrite it
+        out_file = out_file.with_name('[Clustered] ' + out_file.name)
+    else:
+        df = load_data(args.data_file)
+        # throw out rows with nan text
+        df = df[~df['Key Data Points'].isna()]
+        embeddings = embed_text(df['Key Data Points'].tolist())
+    if cache is not None:
+        print(f'Embedding cache: {cache.stats}')
 
     print('Clustering data points...')
-    config = ClusteringConfig(n_clusters=args.num_clusters)
-    probs, dists, assignments = cluster(embeddings, config)
-
-    df['probs'] = probs.tolist()
-    df['dists'] = dists.tolist()
-    df['assignments'] = assignments
-
-    print(args.data_file)
-    df.to_csv(args.data_file, index=False)
+    # fit each distinct finding once, weighted by how often it occurs
+    first_idx, inverse, counts = deduplicate(df['Key Data Points'].tolist())
+    # without duplicates, a streamed memory-mapped store is used as is rather than copied
+    unique_embeddings = embeddings if len(first_idx) == len(embeddings) else embeddings[first_idx]
+    base_config = ClusteringConfig(
+        model_type=ClusteringModelType[args.model_type.upper()],
+        n_init=args.n_init,
+        concentration=args.concentration,
+        n_neighbors=args.n_neighbors,
+        resolution=args.resolution,
+        community_algorithm=CommunityAlgorithm(args.community_algorithm),
+        reduction_components=args.reduce_dim,
+        reduction_variance=args.reduce_variance,
+        whiten=args.whiten
+        )
+    if previous_run is not None:
+        config = previous_run.config
+        (probs, dists, assignments), mixture = update_clusters(
+            previous_run, unique_embeddings, UpdateMode(args.update_mode), sample_weight=counts
+            )
+        order = previous_run.order
+    elif args.sweep:
+        min_clusters, max_clusters = args.sweep
+        (mixture, order, config), sweep_table = sweep(
+            unique_embeddings, base_config, list(range(min_clusters, max_clusters + 1)),
+            sample_weight=counts, n_workers=args.sweep_workers
+            )
+        print(sweep_table.to_string(index=False, float_format='%.3f'))
+        print(f'Best number of clusters: {config.n_clusters}')
+        probs, dists, assignments = assign(mixture, unique_embeddings, order)
+    elif args.n_init > 1:
+        config = dataclasses.replace(base_config, n_clusters=args.num_clusters)
+        (mixture, order), restart_table = fit_restarts(unique_embeddings, config, sample_weight=counts)
+        print(restart_table.to_string(index=False, float_format='%.3f'))
+        probs, dists, assignments = assign(mixture, unique_embeddings, order)
+    else:
+        config = dataclasses.replace(base_config, n_clusters=args.num_clusters)
+        mixture, order = fit(unique_embeddings, config, sample_weight=counts)
+        probs, dists, assignments = assign(mixture, unique_embeddings, order)
+    probs, dists, assignments = probs[inverse], dists[inverse], assignments[inverse]
+
+    if args.save_run:
+        run = make_run(
+            args.model, config, df['Key Data Points'].tolist(), embeddings, mixture, order,
+            NeighborIndex.build(embeddings)
+            )
+        run.save(args.save_run)
+        print(f'Saved run to {args.save_run}')
+
+    export_format = ExportFormat(args.export_format)
+    if export_format != ExportFormat.CSV:
+        out_file = out_file.with_suffix('.' + export_format.value)
+    print(out_file)
+    # streamed embeddings are already saved next to the input
+    export_results(
+        out_file, df, probs, dists, assignments,
+        embeddings=None if args.stream else embeddings, export_format=export_format
+        )
 
-    make_plot(df, embeddings, assignments)
+    projection = ProjectionMethod(args.projection)
+    if args.no_cache:
+        layout = project_2d(unique_embeddings, projection)
+    else:
+        layout = ProjectionCache(args.projection_cache_dir).get_or_project(unique_embeddings, projection)
+    make_plot(
+        df, embeddings, assignments, layout=layout[inverse], projection=projection,
+        mode=PlotMode(args.plot_mode) if args.plot_mode else None,
+        dists=dists, max_points=args.max_points
+        )
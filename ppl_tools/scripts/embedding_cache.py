@@ -0,0 +1,213 @@
+import hashlib
+import os
+import re
+import time
+import unicodedata
+import uuid
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = Path.home() / '.ppl_tools' / 'embedding_cache'
+# 2 GB is roughly 500k gte-large vectors
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+VECTORS_SUFFIX = '.npy'
+KEYS_SUFFIX = '.keys.npy'
+# sha1 digests, stored as raw bytes
+KEY_DTYPE = 'S20'
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes text so that cosmetic differences (unicode composition,
+    runs of whitespace, leading/trailing whitespace) don't cause cache misses.
+    """
+    return ' '.join(unicodedata.normalize('NFC', str(text)).split())
+
+
+def text_key(text: str) -> bytes:
+    return hashlib.sha1(normalize_text(text).encode('utf-8')).digest()
+
+
+def array_fingerprint(array: np.ndarray) -> str:
+    """
+    Returns a hash of an array's shape, dtype and contents, for use as a cache key.
+    """
+    array = np.ascontiguousarray(array)
+    digest = hashlib.sha1(f'{array.shape}{array.dtype.str}'.encode('utf-8'))
+    digest.update(memoryview(array).cast('B'))
+    return digest.hexdigest()
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+
+    def __str__(self):
+        total = self.hits + self.misses
+        rate = 100 * self.hits / total if total else 0
+        return f'{self.hits} hits, {self.misses} misses ({rate:.0f}% hit rate)'
+
+
+class EmbeddingCache:
+    """
+    On-disk, content-addressed cache of embedding vectors.
+
+    Vectors are keyed by (model name, hash of the normalized text) and stored
+    as float32 shards, one pair of .npy files (vectors and keys) per write.
+    Shards are memory-mapped on read, so only the rows that are actually hit
+    are pulled into memory. When the cache grows beyond max_bytes, the least
+    recently used shards are deleted.
+
+    Attributes:
+        cache_dir (Path): Root directory of the cache.
+        max_bytes (int | None): Size bound for the cache, or None for unbounded.
+        stats (CacheStats): Running hit/miss counts for this instance.
+    """
+    def __init__(self, cache_dir: Path = DEFAULT_CACHE_DIR, max_bytes: int | None = DEFAULT_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+
+    def _model_dir(self, model_name: str) -> Path:
+        return self.cache_dir / re.sub(r'[^\w.-]', '_', model_name)
+
+    def _shards(self, model_name: str) -> list[Path]:
+        model_dir = self._model_dir(model_name)
+        if not model_dir.exists():
+            return []
+        # a shard is only valid once its keys file exists, since it is written last
+        return sorted(
+            p.with_name(p.name[:-len(KEYS_SUFFIX)] + VECTORS_SUFFIX)
+            for p in model_dir.glob('*' + KEYS_SUFFIX)
+            if '.tmp' not in p.name
+            )
+
+    def _index(self, model_name: str) -> dict[bytes, tuple[Path, int]]:
+        index = {}
+        for shard in self._shards(model_name):
+            keys = np.load(shard.with_name(shard.stem + KEYS_SUFFIX))
+            for row, key in enumerate(keys):
+                index[bytes(key)] = (shard, row)
+        return index
+
+    def lookup(self, model_name: str, keys: list[bytes]) -> dict[bytes, np.ndarray]:
+        """
+        Returns the cached vectors for whichever of the given keys are present.
+        """
+        index = self._index(model_name)
+
+        by_shard: dict[Path, list[bytes]] = {}
+        for key in set(keys):
+            if key in index:
+                by_shard.setdefault(index[key][0], []).append(key)
+
+        found = {}
+        now = time.time()
+        for shard, shard_keys in by_shard.items():
+            vectors = np.load(shard, mmap_mode='r')
+            rows = [index[key][1] for key in shard_keys]
+            for key, vector in zip(shard_keys, np.asarray(vectors[rows])):
+                found[key] = vector
+            # mark as recently used, for eviction
+            os.utime(shard, (now, now))
+        return found
+
+    def put(self, model_name: str, keys: list[bytes], vectors: np.ndarray) -> None:
+        if len(keys) == 0:
+            return
+        model_dir = self._model_dir(model_name)
+        model_dir.mkdir(parents=True, exist_ok=True)
+
+        shard = model_dir / (uuid.uuid4().hex + VECTORS_SUFFIX)
+        keys_file = shard.with_name(shard.stem + KEYS_SUFFIX)
+        # write to temporary names and rename, so that a crash never leaves
+        # a half-written shard behind
+        tmp_vectors = shard.with_name(shard.stem + '.tmp' + VECTORS_SUFFIX)
+        tmp_keys = shard.with_name(shard.stem + '.tmp' + KEYS_SUFFIX)
+        np.save(tmp_vectors, np.asarray(vectors, dtype=np.float32))
+        np.save(tmp_keys, np.array(keys, dtype=KEY_DTYPE))
+        os.replace(tmp_vectors, shard)
+        os.replace(tmp_keys, keys_file)
+
+        if self.max_bytes is not None:
+            self.evict(self.max_bytes)
+
+    def get_or_embed(
+        self,
+        text: list[str],
+        model_name: str,
+        encode: Callable[[list[str]], np.ndarray]
+        ) -> np.ndarray:
+        """
+        Returns embeddings for text, only calling encode on entries which aren't
+        already cached. Newly encoded vectors are added to the cache.
+
+        Args:
+            text (list[str]): The text to embed.
+            model_name (str): Name of the embedding model; part of the cache key.
+            encode (Callable): Embeds a list of strings, returning an (n, d) array.
+
+        Returns:
+            np.ndarray: A float32 array of shape (len(text), d).
+        """
+        keys = [text_key(t) for t in text]
+        found = self.lookup(model_name, keys)
+
+        # encode each missing text only once, even if it appears several times
+        missing: dict[bytes, int] = {}
+        for i, key in enumerate(keys):
+            if key not in found and key not in missing:
+                missing[key] = i
+
+        n_hits = sum(key in found for key in keys)
+        self.stats.hits += n_hits
+        self.stats.misses += len(keys) - n_hits
+
+        if missing:
+            new_vectors = np.asarray(encode([text[i] for i in missing.values()]), dtype=np.float32)
+            self.put(model_name, list(missing), new_vectors)
+            found.update(zip(missing, new_vectors))
+
+        if not keys:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.stack([found[key] for key in keys]).astype(np.float32, copy=False)
+
+    def size_bytes(self) -> int:
+        return sum(p.stat().st_size for p in self.cache_dir.glob('*/*.npy'))
+
+    def evict(self, max_bytes: int) -> int:
+        """
+        Deletes least recently used shards until the cache fits in max_bytes.
+
+        Returns:
+            int: The number of shards deleted.
+        """
+        shards = [
+            p for p in self.cache_dir.glob('*/*' + VECTORS_SUFFIX)
+            if not p.name.endswith(KEYS_SUFFIX) and '.tmp' not in p.name
+            ]
+        sizes = {}
+        for shard in shards:
+            keys_file = shard.with_name(shard.stem + KEYS_SUFFIX)
+            sizes[shard] = shard.stat().st_size + (keys_file.stat().st_size if keys_file.exists() else 0)
+
+        total = sum(sizes.values())
+        n_deleted = 0
+        for shard in sorted(shards, key=lambda p: p.stat().st_mtime):
+            if total <= max_bytes:
+                break
+            # remove the keys file first, so the shard is invalid before it's gone
+            shard.with_name(shard.stem + KEYS_SUFFIX).unlink(missing_ok=True)
+            shard.unlink(missing_ok=True)
+            total -= sizes[shard]
+            n_deleted += 1
+        return n_deleted
+
+    def clear(self) -> None:
+        self.evict(0)
@@ -0,0 +1,220 @@
+import multiprocessing
+import os
+import threading
+import time
+
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Callable
+
+import numpy as np
+import torch
+
+from ppl_tools.scripts.backends import EmbeddingBackend
+from ppl_tools.scripts.batching import (DEFAULT_TOKEN_BUDGET, EmbeddingCancelled,
+                                        EncodeStats, encode_bucketed)
+from ppl_tools.scripts.model_registry import get_model
+
+# cores given to each worker's torch threads by default. A model's forward
+# pass is multi-threaded and scales well over a few cores, while each worker
+# holds its own copy of the model, so a worker per few cores uses far less
+# memory than a worker per core for much the same throughput
+CORES_PER_WORKER = 4
+# leave the main process a core to keep the GUI responsive
+DEFAULT_N_WORKERS = max(1, ((os.cpu_count() or 1) - 1) // CORES_PER_WORKER)
+# texts per task sent to a worker; small enough to give smooth progress
+# and cancellation, large enough to keep batches full
+SHARD_SIZE = 256
+
+# set in each worker process by _init_worker
+_worker_model_name: str | None = None
+_worker_backend: EmbeddingBackend = EmbeddingBackend.TORCH
+
+
+def _init_worker(model_name: str, backend: EmbeddingBackend, n_threads: int) -> None:
+    global _worker_model_name, _worker_backend
+    _worker_model_name = model_name
+    _worker_backend = backend
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    # split the machine's cores between workers instead of oversubscribing
+    torch.set_num_threads(n_threads)
+    get_model(model_name, backend)
+
+
+def _worker_ready() -> None:
+    # the model is loaded by _init_worker before any task runs
+    pass
+
+
+def _encode_shard(text: list[str], token_budget: int) -> tuple[np.ndarray, EncodeStats]:
+    model = get_model(_worker_model_name, _worker_backend)
+    return encode_bucketed(model, text, token_budget=token_budget)
+
+
+class EmbeddingPool:
+    """
+    A pool of worker processes, each holding its own copy of one embedding model.
+
+    Text is sorted by length and split into shards which are encoded in
+    parallel; results are written into a preallocated float32 array as they
+    arrive, so they end up in the original order regardless of which worker
+    finishes first.
+
+    Attributes:
+        model_name (str): The model loaded in every worker.
+        backend (EmbeddingBackend): The inference backend the workers run the model with.
+        n_workers (int): Number of worker processes.
+        token_budget (int): Maximum padded tokens per batch within a worker.
+    """
+    def __init__(
+        self,
+        model_name: str,
+        n_workers: int,
+        token_budget: int = DEFAULT_TOKEN_BUDGET,
+        backend: EmbeddingBackend = EmbeddingBackend.TORCH
+        ):
+        self.model_name = model_name
+        self.backend = backend
+        self.n_workers = n_workers
+        self.token_budget = token_budget
+        n_threads = max(1, (os.cpu_count() or 1) // n_workers)
+        # spawn rather than fork, since forking a process which has Qt and
+        # torch threads running is unsafe
+        self._executor = ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(model_name, backend, n_threads),
+        )
+
+    def encode(
+        self,
+        text: list[str],
+        progress_callback: Callable[[int], None] | None = None,
+        cancellation_check: Callable[[], bool] | None = None,
+        ) -> tuple[np.ndarray, EncodeStats]:
+        """
+        Embeds text across the worker processes.
+
+        Args:
+            text (list[str]): The text to embed.
+            progress_callback (Callable): Called with the percentage of texts encoded so far.
+            cancellation_check (Callable): Returns True if encoding should stop.
+
+        Raises:
+            EmbeddingCancelled: If cancellation_check returns True before all shards finish.
+
+        Returns:
+            tuple[np.ndarray, EncodeStats]: A float32 (len(text), d) array, and throughput stats.
+        """
+        start_time = time.perf_counter()
+        # character length is a cheap stand-in for token length here;
+        # workers sort by actual token length within each shard
+        order = np.argsort([-len(t) for t in text], kind='stable')
+        shards = [order[i:i + SHARD_SIZE] for i in range(0, len(order), SHARD_SIZE)]
+
+        pending: dict[Future, np.ndarray] = {
+            self._executor.submit(_encode_shard, [text[i] for i in shard], self.token_budget): shard
+            for shard in shards
+        }
+
+        embeddings: np.ndarray | None = None
+        stats = EncodeStats(n_texts=len(text))
+        n_done = 0
+        while pending:
+            done, _ = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+            if cancellation_check is not None and cancellation_check():
+                # running shards finish in the background, but nothing new starts
+                for future in pending:
+                    future.cancel()
+                raise EmbeddingCancelled()
+
+            for future in done:
+                shard = pending.pop(future)
+                shard_embeddings, shard_stats = future.result()
+                if embeddings is None:
+                    embeddings = np.empty((len(text), shard_embeddings.shape[1]), dtype=np.float32)
+                embeddings[shard] = shard_embeddings
+
+                stats.n_tokens += shard_stats.n_tokens
+                stats.n_padded_tokens += shard_stats.n_padded_tokens
+                stats.n_batches += shard_stats.n_batches
+                n_done += len(shard)
+                if progress_callback is not None:
+                    progress_callback(round(100 * n_done / len(text)))
+
+        stats.seconds = time.perf_counter() - start_time
+        if embeddings is None:
+            embeddings = np.empty((0, 0), dtype=np.float32)
+        return embeddings, stats
+
+    def start(self) -> None:
+        """
+        Starts the worker processes and waits for each to load the model,
+        instead of on the first call to encode.
+
+        Raises:
+            Exception: Whatever loading the model raised in a worker.
+        """
+        # a process is spawned per task until one is idle, and loading takes
+        # far longer than submitting, so every worker gets started
+        for future in [self._executor.submit(_worker_ready) for _ in range(self.n_workers)]:
+            future.result()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# worker processes are expensive to start, so the most recent pool is kept
+# around for the next call with the same settings
+_pool: EmbeddingPool | None = None
+_pool_lock = threading.Lock()
+
+
+def _is_running(settings: tuple) -> bool:
+    # whether the kept pool has these settings; call with _pool_lock held
+    return _pool is not None and (_pool.model_name, _pool.n_workers, _pool.token_budget, _pool.backend) == settings
+
+
+def get_pool(
+    model_name: str,
+    n_workers: int,
+    token_budget: int = DEFAULT_TOKEN_BUDGET,
+    backend: EmbeddingBackend = EmbeddingBackend.TORCH
+    ) -> EmbeddingPool:
+    global _pool
+    settings = (model_name, n_workers, token_budget, backend)
+    with _pool_lock:
+        if not _is_running(settings):
+            if _pool is not None:
+                _pool.shutdown()
+            _pool = EmbeddingPool(*settings)
+        return _pool
+
+
+def encode(
+    text: list[str],
+    model_name: str,
+    n_workers: int = 1,
+    token_budget: int = DEFAULT_TOKEN_BUDGET,
+    progress_callback: Callable[[int], None] | None = None,
+    cancellation_check: Callable[[], bool] | None = None,
+    backend: EmbeddingBackend = EmbeddingBackend.TORCH,
+    ) -> tuple[np.ndarray, EncodeStats]:
+    """
+    Embeds text with model_name run by backend, in worker processes if
+    n_workers > 1 and either they are already running or there is enough
+    text to make starting them worthwhile, otherwise in the current process.
+    """
+    with _pool_lock:
+        running = _is_running((model_name, n_workers, token_budget, backend))
+    # a running pool is used even for a little text, rather than loading another copy of the model here
+    if n_workers <= 1 or (len(text) < 2 * SHARD_SIZE and not running):
+        return encode_bucketed(
+            get_model(model_name, backend),
+            text,
+            token_budget=token_budget,
+            progress_callback=progress_callback,
+            cancellation_check=cancellation_check,
+        )
+    pool = get_pool(model_name, n_workers, token_budget, backend)
+    return pool.encode(text, progress_callback, cancellation_check)
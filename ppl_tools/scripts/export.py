@@ -0,0 +1,157 @@
+from dataclasses import dataclass
+from enum import Enum
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# columns holding a vector per row, which are stored as arrays rather than in the table
+ARRAY_COLUMNS = ['embeddings', 'probs']
+
+TABLE_FILES = {'parquet': 'table.parquet', 'arrow': 'table.arrow'}
+PROBS_FILE = 'probs.npy'
+EMBEDDINGS_FILE = 'embeddings.npy'
+# prefix of the table's columns in .npz exports, to keep them apart from the arrays
+NPZ_COLUMN_PREFIX = 'column:'
+
+
+class ExportFormat(Enum):
+    # a directory with the table as Parquet and the arrays as .npy files; requires pyarrow
+    PARQUET = 'parquet'
+    # a directory with the table as an Arrow (Feather) file and the arrays as .npy files,
+    # all memory-mapped when loaded; requires pyarrow
+    ARROW = 'arrow'
+    # a single uncompressed .npz file, with no extra dependencies
+    NPZ = 'npz'
+    # the table only, as CSV: cluster assignments and distances, without probabilities or embeddings
+    CSV = 'csv'
+
+
+@dataclass
+class ExportedResults:
+    """
+    Clustering results loaded from an export.
+
+    Attributes:
+        table (pd.DataFrame): The input's columns, with each row's cluster
+            ('assignments') and distance to its cluster's mean ('dists').
+        probs (np.ndarray | None): Cluster probabilities (n, k), if exported.
+        embeddings (np.ndarray | None): Embeddings (n, d), if exported.
+    """
+    table: pd.DataFrame
+    probs: np.ndarray | None = None
+    embeddings: np.ndarray | None = None
+
+
+def _require_pyarrow(export_format: ExportFormat) -> None:
+    # optional dependency, only needed for these formats
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError as e:
+        raise ImportError(
+            f'{export_format.value} exports require the pyarrow package '
+            '(pip install pyarrow); use npz or csv instead.'
+            ) from e
+
+
+def results_table(df: pd.DataFrame, dists: np.ndarray, assignments: np.ndarray) -> pd.DataFrame:
+    """
+    Returns df's scalar columns, with each row's assignment and distance as
+    compact numeric columns.
+    """
+    table = df.drop(columns=[c for c in ARRAY_COLUMNS + ['dists', 'assignments'] if c in df])
+    return table.assign(
+        assignments=np.asarray(assignments, dtype=np.int32),
+        dists=np.asarray(dists, dtype=np.float32)
+        ).reset_index(drop=True)
+
+
+def export_results(
+    path: Path,
+    df: pd.DataFrame,
+    probs: np.ndarray,
+    dists: np.ndarray,
+    assignments: np.ndarray,
+    embeddings: np.ndarray | None = None,
+    export_format: ExportFormat = ExportFormat.PARQUET
+    ) -> None:
+    """
+    Exports clustering results: the table of input columns, assignments and
+    distances, and the probability and embedding matrices as float32 arrays
+    rather than as text in the table.
+
+    Args:
+        path (Path): The directory to write (Parquet, Arrow), or file (NPZ, CSV).
+        df (pd.DataFrame): The input's rows.
+        probs (np.ndarray): Cluster probabilities of each row (n, k).
+        dists (np.ndarray): Distance of each row to its cluster's mean (n,).
+        assignments (np.ndarray): Cluster of each row (n,).
+        embeddings (np.ndarray): Optional embedding of each row (n, d).
+        export_format (ExportFormat): The format to write.
+    """
+    path = Path(path)
+    table = results_table(df, dists, assignments)
+
+    if export_format == ExportFormat.CSV:
+        table.to_csv(path, index=False)
+        return
+
+    arrays = {'probs': np.asarray(probs, dtype=np.float32)}
+    if embeddings is not None:
+        arrays['embeddings'] = np.asarray(embeddings, dtype=np.float32)
+
+    if export_format == ExportFormat.NPZ:
+        # text columns as fixed-width strings, with missing values empty, so loading needs no pickle
+        columns = {
+            NPZ_COLUMN_PREFIX + name: (
+                column.to_numpy() if pd.api.types.is_numeric_dtype(column) or pd.api.types.is_bool_dtype(column)
+                else column.fillna('').to_numpy(dtype=str)
+                )
+            for name, column in table.items()
+        }
+        np.savez(path, **columns, **arrays)
+        return
+
+    _require_pyarrow(export_format)
+    path.mkdir(parents=True, exist_ok=True)
+    if export_format == ExportFormat.PARQUET:
+        table.to_parquet(path / TABLE_FILES['parquet'], index=False)
+    else:
+        # uncompressed, so that it can be memory-mapped
+        table.to_feather(path / TABLE_FILES['arrow'], compression='uncompressed')
+    np.save(path / PROBS_FILE, arrays['probs'])
+    if embeddings is not None:
+        np.save(path / EMBEDDINGS_FILE, arrays['embeddings'])
+
+
+def load_results(path: Path) -> ExportedResults:
+    """
+    Loads results written by export_results, in any format.
+
+    The arrays of Parquet and Arrow exports are memory-mapped rather than
+    read, so loading them is immediate whatever their size, as is reading
+    an Arrow table.
+    """
+    path = Path(path)
+    if path.is_dir():
+        if (path / TABLE_FILES['arrow']).exists():
+            _require_pyarrow(ExportFormat.ARROW)
+            from pyarrow import feather
+            table = feather.read_table(path / TABLE_FILES['arrow'], memory_map=True).to_pandas()
+        else:
+            _require_pyarrow(ExportFormat.PARQUET)
+            table = pd.read_parquet(path / TABLE_FILES['parquet'])
+        embeddings = None
+        if (path / EMBEDDINGS_FILE).exists():
+            embeddings = np.load(path / EMBEDDINGS_FILE, mmap_mode='r')
+        return ExportedResults(table, np.load(path / PROBS_FILE, mmap_mode='r'), embeddings)
+
+    if path.suffix == '.npz':
+        with np.load(path) as npz:
+            table = pd.DataFrame({
+                key[len(NPZ_COLUMN_PREFIX):]: npz[key] for key in npz.files if key.startswith(NPZ_COLUMN_PREFIX)
+            })
+            embeddings = npz['embeddings'] if 'embeddings' in npz.files else None
+            return ExportedResults(table, npz['probs'], embeddings)
+
+    return ExportedResults(pd.read_csv(path))
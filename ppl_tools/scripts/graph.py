@@ -0,0 +1,185 @@
+from enum import Enum
+
+import numpy as np
+
+from scipy import sparse
+from sklearn.base import BaseEstimator
+from sklearn.utils.validation import check_is_fitted
+
+from ppl_tools.scripts.embedding_cache import array_fingerprint
+from ppl_tools.scripts.neighbors import EXACT_MAX_POINTS, IVFIndex, exact_top_k, knn
+from ppl_tools.scripts.spherical import l2_normalize
+
+DEFAULT_N_NEIGHBORS = 15
+
+
+class CommunityAlgorithm(Enum):
+    # networkx's Louvain method
+    LOUVAIN = 'louvain'
+    # the Leiden algorithm, which requires the optional leidenalg and igraph packages
+    LEIDEN = 'leiden'
+
+
+def knn_graph(embeddings: np.ndarray, n_neighbors: int = DEFAULT_N_NEIGHBORS) -> sparse.csr_matrix:
+    """
+    Builds a symmetric graph connecting each embedding to its n_neighbors
+    nearest neighbors by cosine similarity, weighted by that similarity
+    (negative similarities are dropped). See neighbors.knn.
+    """
+    indices, similarities = knn(embeddings, n_neighbors)
+    rows = np.repeat(np.arange(len(embeddings)), indices.shape[1])
+    keep = (indices.ravel() >= 0) & (similarities.ravel() > 0)
+    graph = sparse.csr_matrix(
+        (similarities.ravel()[keep], (rows[keep], indices.ravel()[keep])),
+        shape=(len(embeddings), len(embeddings))
+        )
+    # an edge is kept if either end has the other among its neighbors
+    return graph.maximum(graph.T).tocsr()
+
+
+def detect_communities(
+    graph: sparse.csr_matrix,
+    algorithm: CommunityAlgorithm = CommunityAlgorithm.LOUVAIN,
+    resolution: float = 1.0,
+    random_state: int | None = None
+    ) -> tuple[np.ndarray, float]:
+    """
+    Partitions a weighted graph into communities.
+
+    Returns:
+        tuple[np.ndarray, float]: The community of each node, and the
+            partition's modularity.
+    """
+    labels = np.empty(graph.shape[0], dtype=np.int64)
+    if algorithm == CommunityAlgorithm.LEIDEN:
+        # optional dependencies, only needed for this algorithm
+        try:
+            import igraph
+            import leidenalg
+        except ImportError as e:
+            raise ImportError(
+                'The Leiden algorithm requires the leidenalg and igraph packages '
+                '(pip install leidenalg); use Louvain instead.'
+                ) from e
+        upper = sparse.triu(graph).tocoo()
+        g = igraph.Graph(n=graph.shape[0], edges=list(zip(upper.row, upper.col)))
+        partition = leidenalg.find_partition(
+            g, leidenalg.RBConfigurationVertexPartition, weights=upper.data.tolist(),
+            resolution_parameter=resolution, seed=random_state
+            )
+        labels[:] = partition.membership
+        return labels, partition.modularity
+
+    import networkx as nx
+
+    g = nx.from_scipy_sparse_array(graph)
+    communities = nx.community.louvain_communities(g, resolution=resolution, seed=random_state)
+    for i, community in enumerate(communities):
+        labels[list(community)] = i
+    return labels, nx.community.modularity(g, communities, resolution=resolution)
+
+
+class GraphClustering(BaseEstimator):
+    """
+    Clusters embeddings by community detection on their k-nearest-neighbor
+    graph, which finds the number of clusters itself (more of them at higher
+    resolutions) and copes better with high dimensions than a mixture.
+
+    After fitting, a point's cluster probabilities are the similarity-weighted
+    votes of its n_neighbors nearest fitted points' communities, so new
+    findings can be assigned to the fitted clusters. It has the parts of
+    sklearn's mixture interface that the rest of the pipeline uses, with the
+    partition's modularity as lower_bound_, so restarts keep the best
+    partition.
+
+    Attributes:
+        labels_ (np.ndarray): The community of each fitted point.
+        means_ (np.ndarray): Mean of each community's points.
+        modularity_ (float): Modularity of the partition.
+        sample_weight (np.ndarray): Unused; communities are found on distinct
+            findings, so repeated findings don't add edges.
+    """
+    sample_weight: np.ndarray | None = None
+
+    def __init__(
+        self,
+        n_neighbors: int = DEFAULT_N_NEIGHBORS,
+        *,
+        resolution: float = 1.0,
+        algorithm: CommunityAlgorithm = CommunityAlgorithm.LOUVAIN,
+        random_state: int | None = None,
+        warm_start: bool = False,
+        verbose: int = 0,
+    ):
+        self.n_neighbors = n_neighbors
+        self.resolution = resolution
+        self.algorithm = algorithm
+        self.random_state = random_state
+        self.warm_start = warm_start
+        self.verbose = verbose
+
+    def fit(self, X: np.ndarray, y=None) -> 'GraphClustering':
+        # detection isn't iterative, so a warm start has nothing to continue
+        if self.warm_start and hasattr(self, 'converged_'):
+            return self
+
+        graph = knn_graph(X, self.n_neighbors)
+        self.labels_, self.modularity_ = detect_communities(
+            graph, self.algorithm, self.resolution, self.random_state
+            )
+        n_clusters = self.labels_.max() + 1
+        if self.verbose >= 1:
+            print(f'Found {n_clusters} communities (modularity {self.modularity_:.3f})')
+
+        membership = self._membership(n_clusters)
+        sums = membership.T @ np.asarray(X, dtype=np.float64)
+        counts = np.asarray(membership.sum(axis=0)).ravel()
+        self.means_ = (sums / counts[:, np.newaxis]).astype(np.float32)
+
+        self.fitted_points_ = l2_normalize(X)
+        # the fitted points' probabilities, which predict_proba returns for
+        # them rather than searching for their neighbors again
+        self._fit_fingerprint = array_fingerprint(np.asarray(X))
+        self._fit_probs = self._votes(graph + sparse.identity(len(X), format='csr'))
+
+        self.n_features_in_ = X.shape[1]
+        self.converged_ = True
+        self.n_iter_ = 1
+        self.lower_bound_ = self.modularity_
+        return self
+
+    def fit_predict(self, X: np.ndarray, y=None) -> np.ndarray:
+        return self.fit(X).predict(X)
+
+    def _membership(self, n_clusters: int) -> sparse.csr_matrix:
+        # (n, k) indicator of each fitted point's community
+        return sparse.csr_matrix(
+            (np.ones(len(self.labels_)), (np.arange(len(self.labels_)), self.labels_)),
+            shape=(len(self.labels_), n_clusters)
+            )
+
+    def _votes(self, weights: sparse.csr_matrix) -> np.ndarray:
+        # each row's edge weights, summed by the community at the other end
+        votes = np.asarray((weights @ self._membership(len(self.means_))).todense())
+        totals = votes.sum(axis=1, keepdims=True)
+        return votes / np.where(totals > 0, totals, 1)
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        check_is_fitted(self, 'labels_')
+        if array_fingerprint(np.asarray(X)) == self._fit_fingerprint:
+            return self._fit_probs
+        if len(self.fitted_points_) <= EXACT_MAX_POINTS:
+            indices, similarities = exact_top_k(X, self.fitted_points_, self.n_neighbors)
+        else:
+            indices, similarities = IVFIndex.build(self.fitted_points_).search(X, self.n_neighbors)
+        # approximate searches pad missing neighbors with index -1, which get no vote
+        similarities = np.where(indices >= 0, np.maximum(similarities, 0), 0)
+        indices = np.maximum(indices, 0)
+        weights = sparse.csr_matrix(
+            (similarities.ravel(), indices.ravel(), np.arange(0, indices.size + 1, indices.shape[1])),
+            shape=(len(X), len(self.labels_))
+            )
+        return self._votes(weights)
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        return self.predict_proba(X).argmax(axis=1)
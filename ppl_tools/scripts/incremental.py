@@ -0,0 +1,168 @@
+import copy
+import json
+import os
+
+from dataclasses import dataclass
+from enum import Enum
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+from ppl_tools.scripts.cluster import ClusteringConfig, assign, config_from_dict, config_to_dict
+from ppl_tools.scripts.embedding_cache import KEY_DTYPE, text_key
+from ppl_tools.scripts.model_io import load_mixture, save_mixture
+from ppl_tools.scripts.neighbors import NeighborIndex
+from ppl_tools.scripts.reduction import ReducedMixture
+
+RUN_FILE = 'run.json'
+EMBEDDINGS_FILE = 'embeddings.npy'
+KEYS_FILE = 'keys.npy'
+MODEL_FILE = 'mixture.npz'
+NEIGHBORS_DIR = 'neighbors'
+
+
+class UpdateMode(Enum):
+    # label new findings with the previous run's clusters, without refitting
+    ASSIGN = 'assign'
+    # refit on all findings, starting from the previous run's clusters
+    REFIT = 'refit'
+
+
+@dataclass
+class ClusteringRun:
+    """
+    The artifacts of a clustering run needed to extend it with new findings.
+
+    The mixture is saved as its fitted arrays (see model_io) rather than
+    pickled, so loading a run runs no code from its files.
+
+    Attributes:
+        model_name (str): The embedding model used.
+        config (ClusteringConfig): The clustering configuration used.
+        keys (np.ndarray): Hash of each embedded text entry (see text_key).
+        embeddings (np.ndarray): Embedding of each entry of keys.
+        mixture: The fitted mixture model.
+        order (np.ndarray): The mixture's cluster indices, in the order they are
+            numbered in the results.
+        neighbor_index (NeighborIndex | None): Index of embeddings for finding
+            similar findings, if one was built.
+    """
+    model_name: str
+    config: ClusteringConfig
+    keys: np.ndarray
+    embeddings: np.ndarray
+    mixture: object
+    order: np.ndarray
+    neighbor_index: NeighborIndex | None = None
+
+    def save(self, path: Path) -> None:
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        with open(path / RUN_FILE, 'w') as f:
+            json.dump({'model_name': self.model_name, 'config': config_to_dict(self.config)}, f, indent=2)
+        # write alongside and rename, since the run being saved over may have
+        # its embeddings memory-mapped from the same file
+        tmp_file = path / ('tmp_' + EMBEDDINGS_FILE)
+        np.save(tmp_file, np.asarray(self.embeddings, dtype=np.float32))
+        os.replace(tmp_file, path / EMBEDDINGS_FILE)
+        np.save(path / KEYS_FILE, self.keys)
+        save_mixture(path / MODEL_FILE, self.mixture, self.order)
+        if self.neighbor_index is not None:
+            self.neighbor_index.save(path / NEIGHBORS_DIR)
+
+    @classmethod
+    def load(cls, path: Path) -> 'ClusteringRun':
+        path = Path(path)
+        with open(path / RUN_FILE) as f:
+            run_info = json.load(f)
+        config = config_from_dict(run_info['config'])
+        mixture, order = load_mixture(path / MODEL_FILE, config)
+        neighbor_index = None
+        if (path / NEIGHBORS_DIR).exists():
+            neighbor_index = NeighborIndex.load(path / NEIGHBORS_DIR)
+        return cls(
+            model_name=run_info['model_name'],
+            config=config,
+            keys=np.load(path / KEYS_FILE),
+            embeddings=np.load(path / EMBEDDINGS_FILE, mmap_mode='r'),
+            mixture=mixture,
+            order=order,
+            neighbor_index=neighbor_index,
+        )
+
+
+def make_run(
+    model_name: str,
+    config: ClusteringConfig,
+    text: list[str],
+    embeddings: np.ndarray,
+    mixture,
+    order: np.ndarray,
+    neighbor_index: NeighborIndex | None = None
+    ) -> ClusteringRun:
+    return ClusteringRun(
+        model_name=model_name,
+        config=config,
+        keys=np.array([text_key(t) for t in text], dtype=KEY_DTYPE),
+        embeddings=embeddings,
+        mixture=mixture,
+        order=order,
+        neighbor_index=neighbor_index,
+    )
+
+
+def embed_new(
+    run: ClusteringRun,
+    text: list[str],
+    embed_fn: Callable[[list[str]], np.ndarray]
+    ) -> tuple[np.ndarray, int]:
+    """
+    Embeds text, reusing the run's embeddings for entries it already contains.
+
+    Returns:
+        tuple[np.ndarray, int]: Embeddings of every entry of text, and the number
+            of entries that had to be embedded.
+    """
+    known = {bytes(key): i for i, key in enumerate(run.keys)}
+    keys = [text_key(t) for t in text]
+    new_idx = [i for i, key in enumerate(keys) if key not in known]
+
+    embeddings = np.empty((len(text), run.embeddings.shape[1]), dtype=np.float32)
+    known_idx = [i for i, key in enumerate(keys) if key in known]
+    embeddings[known_idx] = run.embeddings[[known[keys[i]] for i in known_idx]]
+    if new_idx:
+        embeddings[new_idx] = embed_fn([text[i] for i in new_idx])
+    return embeddings, len(new_idx)
+
+
+def update_clusters(
+    run: ClusteringRun,
+    embeddings: np.ndarray,
+    mode: UpdateMode = UpdateMode.ASSIGN,
+    sample_weight: np.ndarray | None = None
+    ) -> tuple[tuple[np.ndarray, np.ndarray, np.ndarray], object]:
+    """
+    Clusters embeddings, which should include both the run's findings and new
+    ones, using the run's fitted mixture.
+
+    In ASSIGN mode the mixture is used as is. In REFIT mode it is refit on
+    embeddings, starting from its previous parameters. Either way the run's
+    cluster numbering is kept, so cluster 3 before an update is still
+    cluster 3 after it.
+
+    Returns:
+        tuple: The (probs, dists, labels) results, and the mixture they came from.
+    """
+    mixture = run.mixture
+    if mode == UpdateMode.REFIT:
+        mixture = copy.deepcopy(mixture)
+        # a reduced mixture keeps its projection and refits the mixture inside it
+        inner = mixture.mixture if isinstance(mixture, ReducedMixture) else mixture
+        # sklearn initializes from the previous fit's parameters when warm starting
+        inner.warm_start = True
+        inner.sample_weight = sample_weight
+        mixture.fit(embeddings)
+        inner.sample_weight = None
+    return assign(mixture, embeddings, run.order), mixture
+
@@ -0,0 +1,228 @@
+import numpy as np
+
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.mixture import GaussianMixture
+from sklearn.mixture._gaussian_mixture import _compute_precision_cholesky
+from sklearn.utils.validation import check_is_fitted
+
+DEFAULT_BATCH_SIZE = 1024
+# the t-th online update moves the statistics by (t + 2) ** -STEP_DECAY of the
+# way towards the batch's; any decay in (0.5, 1] converges
+DEFAULT_STEP_DECAY = 0.6
+
+
+class MiniBatchGaussianMixture(GaussianMixture):
+    """
+    A Gaussian mixture fit by online (stepwise) EM on mini-batches, for
+    finding sets too large to run full EM passes over.
+
+    Clusters are initialized with mini-batch k-means. Each EM step then
+    computes responsibilities for one batch and moves the mixture's
+    sufficient statistics part of the way towards that batch's, so only one
+    batch is in memory at a time and X may be a memory-mapped array. An
+    iteration is one pass over the data in shuffled batches.
+
+    Once fit, it is used exactly like sklearn's GaussianMixture (predictions
+    are also made batch by batch). Sample weights are set through the
+    sample_weight attribute, as with the weighted mixtures in cluster.py.
+
+    Attributes:
+        batch_size (int): Number of points per online EM step.
+        step_decay (float): Decay of the online EM step size.
+        sample_weight (np.ndarray): Optional weight of each point, used while fitting.
+    """
+    sample_weight: np.ndarray | None = None
+
+    def __init__(
+        self,
+        n_components=1,
+        *,
+        covariance_type='full',
+        tol=1e-3,
+        reg_covar=1e-6,
+        max_iter=100,
+        batch_size=DEFAULT_BATCH_SIZE,
+        step_decay=DEFAULT_STEP_DECAY,
+        random_state=None,
+        warm_start=False,
+        verbose=0,
+        verbose_interval=10,
+    ):
+        super().__init__(
+            n_components=n_components,
+            covariance_type=covariance_type,
+            tol=tol,
+            reg_covar=reg_covar,
+            max_iter=max_iter,
+            random_state=random_state,
+            warm_start=warm_start,
+            verbose=verbose,
+            verbose_interval=verbose_interval,
+        )
+        self.batch_size = batch_size
+        self.step_decay = step_decay
+
+    def _batches(self, n_samples: int, rng: np.random.RandomState):
+        # sorted indices within each batch keep reads from a memmap sequential
+        perm = rng.permutation(n_samples)
+        for start in range(0, n_samples, self.batch_size):
+            yield np.sort(perm[start:start + self.batch_size])
+
+    def _batch_weights(self, idx: np.ndarray) -> np.ndarray:
+        if self.sample_weight is None:
+            return np.ones(len(idx))
+        return np.asarray(self.sample_weight, dtype=np.float64)[idx]
+
+    def _batch_statistics(self, X: np.ndarray, resp: np.ndarray, weights: np.ndarray) -> tuple:
+        """
+        Sufficient statistics of a batch, averaged over its total weight:
+        the responsibility of each cluster, the responsibility-weighted sum
+        of points, and the second moments for the covariance type.
+        """
+        X = np.asarray(X, dtype=np.float64)
+        resp = resp * weights[:, np.newaxis]
+        total = weights.sum()
+        s0 = resp.sum(axis=0)
+        s1 = resp.T @ X
+        if self.covariance_type == 'full':
+            s2 = np.stack([(resp[:, k, np.newaxis] * X).T @ X for k in range(self.n_components)])
+        elif self.covariance_type == 'tied':
+            s2 = (weights[:, np.newaxis] * X).T @ X
+        elif self.covariance_type == 'diag':
+            s2 = resp.T @ (X ** 2)
+        else:
+            s2 = resp.T @ (X ** 2).mean(axis=1)
+        return s0 / total, s1 / total, s2 / total
+
+    def _set_from_statistics(self, statistics: tuple) -> None:
+        s0, s1, s2 = statistics
+        # as in sklearn, to avoid dividing by zero for empty clusters
+        s0 = s0 + 10 * np.finfo(s0.dtype).eps
+        weights = s0 / s0.sum()
+        means = s1 / s0[:, np.newaxis]
+        diagonal = np.arange(means.shape[1])
+        if self.covariance_type == 'full':
+            covariances = s2 / s0[:, np.newaxis, np.newaxis] - np.einsum('ki,kj->kij', means, means)
+            covariances[:, diagonal, diagonal] += self.reg_covar
+        elif self.covariance_type == 'tied':
+            covariances = (s2 - (s0[:, np.newaxis] * means).T @ means) / s0.sum()
+            covariances[diagonal, diagonal] += self.reg_covar
+        elif self.covariance_type == 'diag':
+            covariances = np.maximum(s2 / s0[:, np.newaxis] - means ** 2, 0) + self.reg_covar
+        else:
+            covariances = np.maximum(s2 / s0 - (means ** 2).mean(axis=1), 0) + self.reg_covar
+        self._set_parameters((
+            weights, means, covariances, _compute_precision_cholesky(covariances, self.covariance_type)
+        ))
+
+    def _statistics_from_parameters(self) -> tuple:
+        # the inverse of _set_from_statistics, to continue from a previous fit
+        weights, means, covariances = self.weights_, self.means_, self.covariances_
+        s0 = weights
+        s1 = weights[:, np.newaxis] * means
+        if self.covariance_type == 'full':
+            s2 = weights[:, np.newaxis, np.newaxis] * (covariances + np.einsum('ki,kj->kij', means, means))
+        elif self.covariance_type == 'tied':
+            s2 = covariances + s1.T @ means
+        elif self.covariance_type == 'diag':
+            s2 = weights[:, np.newaxis] * (covariances + means ** 2)
+        else:
+            s2 = weights * (covariances + (means ** 2).mean(axis=1))
+        return s0, s1, s2
+
+    def _initial_statistics(self, X: np.ndarray, rng: np.random.RandomState) -> tuple:
+        """
+        Fits mini-batch k-means in one pass, then computes the statistics of
+        its hard assignments in a second.
+        """
+        kmeans = MiniBatchKMeans(
+            n_clusters=self.n_components,
+            batch_size=self.batch_size,
+            random_state=rng,
+            n_init='auto',
+        )
+        for idx in self._batches(len(X), rng):
+            kmeans.partial_fit(np.asarray(X[idx]), sample_weight=self._batch_weights(idx))
+
+        statistics = None
+        total = 0.0
+        for idx in self._batches(len(X), rng):
+            x = np.asarray(X[idx])
+            weights = self._batch_weights(idx)
+            resp = np.zeros((len(idx), self.n_components))
+            resp[np.arange(len(idx)), kmeans.predict(x)] = 1
+            batch = [s * weights.sum() for s in self._batch_statistics(x, resp, weights)]
+            statistics = batch if statistics is None else [s + b for s, b in zip(statistics, batch)]
+            total += weights.sum()
+        return tuple(s / total for s in statistics)
+
+    def fit(self, X: np.ndarray, y=None) -> 'MiniBatchGaussianMixture':
+        if len(X) < self.n_components:
+            raise ValueError(
+                f"Expected at least n_components={self.n_components} samples, got {len(X)}."
+                )
+        rng = np.random.RandomState(self.random_state)
+
+        # a warm start continues the previous fit, including its step size
+        # schedule, so fitting in several calls is the same as fitting in one
+        if self.warm_start and hasattr(self, 'converged_'):
+            statistics = self._statistics_from_parameters()
+            lower_bound = self.lower_bound_
+            n_steps = self.n_steps_
+        else:
+            statistics = self._initial_statistics(X, rng)
+            self._set_from_statistics(statistics)
+            lower_bound = -np.inf
+            n_steps = 0
+        self.n_features_in_ = X.shape[1]
+
+        self.converged_ = False
+        for n_iter in range(1, self.max_iter + 1):
+            previous_lower_bound = lower_bound
+            log_likelihood = total = 0.0
+            for idx in self._batches(len(X), rng):
+                x = np.asarray(X[idx])
+                weights = self._batch_weights(idx)
+                log_prob_norm, log_resp = self._estimate_log_prob_resp(x)
+                log_likelihood += weights @ log_prob_norm
+                total += weights.sum()
+
+                step = (n_steps + 2) ** -self.step_decay
+                batch = self._batch_statistics(x, np.exp(log_resp), weights)
+                statistics = tuple((1 - step) * s + step * b for s, b in zip(statistics, batch))
+                self._set_from_statistics(statistics)
+                n_steps += 1
+
+            # the average log likelihood over the pass, as the parameters changed during it
+            lower_bound = log_likelihood / total
+            if self.verbose >= 2 and n_iter % self.verbose_interval == 0:
+                print(f"  Iteration {n_iter}\t lower bound {lower_bound:.5f}")
+            if abs(lower_bound - previous_lower_bound) < self.tol:
+                self.converged_ = True
+                break
+
+        self.n_iter_ = n_iter
+        self.n_steps_ = n_steps
+        self.lower_bound_ = lower_bound
+        if self.verbose >= 1:
+            print(f"Online EM {'converged' if self.converged_ else 'did not converge'}.")
+        return self
+
+    def fit_predict(self, X: np.ndarray, y=None) -> np.ndarray:
+        return self.fit(X).predict(X)
+
+    def _in_batches(self, method, X: np.ndarray) -> np.ndarray:
+        check_is_fitted(self)
+        return np.concatenate([
+            method(np.asarray(X[start:start + self.batch_size]))
+            for start in range(0, len(X), self.batch_size)
+        ])
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        return self._in_batches(super().predict, X)
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        return self._in_batches(super().predict_proba, X)
+
+    def score_samples(self, X: np.ndarray) -> np.ndarray:
+        return self._in_batches(super().score_samples, X)
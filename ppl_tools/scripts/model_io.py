@@ -0,0 +1,92 @@
+from pathlib import Path
+
+import numpy as np
+
+from sklearn.decomposition import PCA
+
+from ppl_tools.scripts.cluster import ClusteringConfig, build_model
+from ppl_tools.scripts.reduction import ReducedMixture
+
+ORDER_KEY = 'order'
+MODEL_PREFIX = 'model/'
+PROJECTION_PREFIX = 'projection/'
+
+
+def _as_array(value) -> np.ndarray | None:
+    if isinstance(value, (bool, int, float, str, np.generic)):
+        value = np.asarray(value)
+    if isinstance(value, np.ndarray) and value.dtype.kind in 'biufU':
+        # keep the memory order of column-major views (e.g. PCA's components_),
+        # so that products with the loaded arrays match the fitted ones exactly
+        if value.ndim == 2 and not value.flags.c_contiguous and value.strides[0] < value.strides[1]:
+            return np.asfortranarray(value)
+        return value
+    return None
+
+
+def _fitted_arrays(estimator, prefix: str) -> dict[str, np.ndarray]:
+    # everything set by fitting: attributes other than the constructor's
+    # parameters, of types which load without pickle. Tuples of arrays (e.g.
+    # the Bayesian mixture's weight_concentration_) are saved element-wise,
+    # as name.0, name.1, ...
+    params = estimator.get_params(deep=False)
+    arrays = {}
+    for name, value in vars(estimator).items():
+        if name in params or name == 'sample_weight':
+            continue
+        if isinstance(value, tuple):
+            elements = [_as_array(v) for v in value]
+            if all(e is not None for e in elements):
+                arrays.update({f'{prefix}{name}.{i}': e for i, e in enumerate(elements)})
+        elif _as_array(value) is not None:
+            arrays[prefix + name] = _as_array(value)
+    return arrays
+
+
+def _set_fitted(estimator, arrays: dict[str, np.ndarray], prefix: str) -> None:
+    tuples = {}
+    for key, value in arrays.items():
+        if not key.startswith(prefix):
+            continue
+        # scalars were saved as 0-d arrays, and come back as numpy scalars
+        value = value[()] if value.ndim == 0 else value
+        name, _, index = key[len(prefix):].partition('.')
+        if index:
+            tuples.setdefault(name, {})[int(index)] = value
+        else:
+            setattr(estimator, name, value)
+    for name, elements in tuples.items():
+        setattr(estimator, name, tuple(elements[i] for i in sorted(elements)))
+
+
+def save_mixture(path: Path, mixture, order: np.ndarray) -> None:
+    """
+    Saves a fitted mixture (see cluster.build_model), and its cluster order,
+    as an .npz file of its fitted arrays, so that loading it runs no code
+    from the file, unlike a pickle.
+    """
+    arrays = {ORDER_KEY: np.asarray(order)}
+    if isinstance(mixture, ReducedMixture):
+        arrays.update(_fitted_arrays(mixture.projection, PROJECTION_PREFIX))
+        mixture = mixture.mixture
+    arrays.update(_fitted_arrays(mixture, MODEL_PREFIX))
+    with open(path, 'wb') as f:
+        np.savez(f, **arrays)
+
+
+def load_mixture(path: Path, config: ClusteringConfig) -> tuple[object, np.ndarray]:
+    """
+    Loads a mixture saved by save_mixture, which was fit with config.
+
+    Returns:
+        tuple: The fitted mixture, and its cluster order.
+    """
+    with np.load(path, allow_pickle=False) as npz:
+        arrays = {key: npz[key] for key in npz.files}
+    mixture = build_model(config)
+    _set_fitted(mixture, arrays, MODEL_PREFIX)
+    if any(key.startswith(PROJECTION_PREFIX) for key in arrays):
+        projection = PCA(whiten=config.whiten)
+        _set_fitted(projection, arrays, PROJECTION_PREFIX)
+        mixture = ReducedMixture(projection, mixture)
+    return mixture, arrays[ORDER_KEY]
@@ -0,0 +1,119 @@
+import threading
+
+from collections import OrderedDict
+from pathlib import Path
+
+import torch
+
+from sentence_transformers import SentenceTransformer
+
+from ppl_tools.scripts.backends import EmbeddingBackend, load_model
+
+# enough to keep gte-large (~1.3 GB) resident alongside either of the smaller models
+DEFAULT_MEMORY_BUDGET = 2 * 1024 ** 3
+
+
+def _tensor_bytes(value) -> int:
+    if isinstance(value, torch.Tensor):
+        return value.numel() * value.element_size()
+    if isinstance(value, (tuple, list)):
+        # e.g. a dynamically quantized Linear's packed (weight, bias)
+        return sum(_tensor_bytes(v) for v in value)
+    return 0
+
+
+def model_size_bytes(model: SentenceTransformer, backend: EmbeddingBackend = EmbeddingBackend.TORCH) -> int:
+    """
+    Estimates the memory a loaded model's weights take.
+
+    The state dict, rather than parameters(), is counted for torch models,
+    since an INT8 model's quantized weights are packed outside its
+    parameters. An ONNX model's weights are held by onnxruntime rather than
+    torch, so it is sized by its ONNX files instead.
+    """
+    if backend == EmbeddingBackend.ONNX:
+        model_path = getattr(model[0].auto_model, 'model_path', None)
+        if model_path is not None:
+            model_path = Path(model_path)
+            # the graph, and any weights stored outside it (model.onnx_data)
+            return sum(p.stat().st_size for p in model_path.parent.glob(model_path.name + '*'))
+    return sum(_tensor_bytes(v) for v in model.state_dict().values())
+
+
+class ModelRegistry:
+    """
+    Process-wide store of loaded SentenceTransformer models.
+
+    Models are loaded on first use, once per backend, and kept resident so
+    that later analyses don't pay the load time again. Once the total
+    weight memory of the resident models exceeds memory_budget, the least
+    recently used models are dropped. The most recently requested model is
+    always kept, even if it alone exceeds the budget.
+
+    Attributes:
+        memory_budget (int): Maximum bytes of model weights to keep resident
+            (see model_size_bytes).
+    """
+    def __init__(self, memory_budget: int = DEFAULT_MEMORY_BUDGET):
+        self.memory_budget = memory_budget
+        self._models: OrderedDict[tuple[str, EmbeddingBackend], SentenceTransformer] = OrderedDict()
+        self._sizes: dict[tuple[str, EmbeddingBackend], int] = {}
+        # models are requested from both the main thread and QThreadPool workers
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        model_name: str,
+        backend: EmbeddingBackend = EmbeddingBackend.TORCH
+        ) -> SentenceTransformer:
+        key = (model_name, backend)
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key]
+
+            model = load_model(model_name, backend)
+            self._models[key] = model
+            self._sizes[key] = model_size_bytes(model, backend)
+            self._evict()
+            return model
+
+    def _evict(self) -> None:
+        while len(self._models) > 1 and self.resident_bytes() > self.memory_budget:
+            key, _ = self._models.popitem(last=False)
+            del self._sizes[key]
+
+    def resident_bytes(self) -> int:
+        return sum(self._sizes.values())
+
+    def peek(
+        self,
+        model_name: str,
+        backend: EmbeddingBackend = EmbeddingBackend.TORCH
+        ) -> SentenceTransformer | None:
+        # the model if resident, without loading it or counting it as recently used
+        with self._lock:
+            return self._models.get((model_name, backend))
+
+    def loaded_models(self) -> list[tuple[str, EmbeddingBackend]]:
+        return list(self._models)
+
+    def remove(self, model_name: str, backend: EmbeddingBackend = EmbeddingBackend.TORCH) -> None:
+        with self._lock:
+            self._models.pop((model_name, backend), None)
+            self._sizes.pop((model_name, backend), None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._models.clear()
+            self._sizes.clear()
+
+
+registry = ModelRegistry()
+
+
+def get_model(model_name: str, backend: EmbeddingBackend = EmbeddingBackend.TORCH) -> SentenceTransformer:
+    """
+    Returns the shared instance of model_name for backend, loading it if necessary.
+    """
+    return registry.get(model_name, backend)
@@ -0,0 +1,243 @@
+import os
+
+from pathlib import Path
+
+import numpy as np
+
+from ppl_tools.scripts.spherical import SphericalKMeans, l2_normalize
+
+# above this many points, neighbors are searched approximately (see IVFIndex)
+EXACT_MAX_POINTS = 20_000
+# memory used by the similarity matrix of each block of queries
+SEARCH_BLOCK_BYTES = 64 * 1024 ** 2
+# inverted lists searched per query
+DEFAULT_N_PROBE = 8
+
+
+def _merge_top_k(
+    indices: np.ndarray,
+    similarities: np.ndarray,
+    new_indices: np.ndarray,
+    new_similarities: np.ndarray,
+    k: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+    # keeps the k most similar of the current and new candidates of each query
+    indices = np.concatenate([indices, new_indices], axis=1)
+    similarities = np.concatenate([similarities, new_similarities], axis=1)
+    if similarities.shape[1] > k:
+        top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        indices = np.take_along_axis(indices, top, axis=1)
+        similarities = np.take_along_axis(similarities, top, axis=1)
+    return indices, similarities
+
+
+def _sort_top_k(indices: np.ndarray, similarities: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    order = np.argsort(-similarities, axis=1, kind='stable')
+    return np.take_along_axis(indices, order, axis=1), np.take_along_axis(similarities, order, axis=1)
+
+
+def exact_top_k(queries: np.ndarray, data: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Finds the k rows of data most cosine-similar to each query, by comparing
+    each block of queries with all of data in one matrix product.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The (n_queries, k) indices of the
+            neighbors in data, and their similarities, most similar first.
+    """
+    data = l2_normalize(data)
+    k = min(k, len(data))
+    indices = np.empty((len(queries), k), dtype=np.int64)
+    similarities = np.empty((len(queries), k), dtype=np.float32)
+    block = max(1, SEARCH_BLOCK_BYTES // (4 * max(len(data), 1)))
+    for start in range(0, len(queries), block):
+        sims = l2_normalize(queries[start:start + block]) @ data.T
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        indices[start:start + block], similarities[start:start + block] = _sort_top_k(
+            top, np.take_along_axis(sims, top, axis=1)
+            )
+    return indices, similarities
+
+
+class IVFIndex:
+    """
+    An inverted file index for approximate cosine nearest-neighbor search.
+
+    The data is partitioned into n_lists clusters by spherical k-means. A
+    query is only compared with the points in the n_probe clusters whose
+    centers are most similar to it, so a search costs about n_probe / n_lists
+    of an exact one.
+
+    Attributes:
+        data (np.ndarray): The L2-normalized indexed points.
+        centers (np.ndarray): Unit-norm center of each list (n_lists, d).
+        lists (list[np.ndarray]): Indices of the points in each list.
+        n_probe (int): Number of lists searched per query.
+    """
+    def __init__(self, data: np.ndarray, centers: np.ndarray, lists: list[np.ndarray], n_probe: int = DEFAULT_N_PROBE):
+        self.data = data
+        self.centers = centers
+        self.lists = lists
+        self.n_probe = min(n_probe, len(centers))
+
+    @classmethod
+    def build(cls, data: np.ndarray, n_lists: int | None = None, n_probe: int = DEFAULT_N_PROBE) -> 'IVFIndex':
+        data = l2_normalize(data)
+        n_lists = n_lists or max(1, int(np.sqrt(len(data))))
+        quantizer = SphericalKMeans(n_lists, max_iter=20, tol=1e-4, random_state=0).fit(data)
+        labels = quantizer.predict(data)
+        lists = [np.flatnonzero(labels == i) for i in range(n_lists)]
+        return cls(data, quantizer.cluster_centers_, lists, n_probe)
+
+    def search(self, queries: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Finds approximately the k indexed points most cosine-similar to each query.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The (n_queries, k) indices of the
+                neighbors, and their similarities, most similar first. Queries
+                whose probed lists hold fewer than k points are padded with
+                index -1 and similarity -inf.
+        """
+        queries = l2_normalize(queries)
+        k = min(k, len(self.data))
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        similarities = np.full((len(queries), k), -np.inf, dtype=np.float32)
+
+        probes = np.argpartition(-(queries @ self.centers.T), self.n_probe - 1, axis=1)[:, :self.n_probe]
+        # group the queries by the lists they probe
+        by_list = np.argsort(probes.ravel(), kind='stable')
+        list_sizes = np.bincount(probes.ravel(), minlength=len(self.lists))
+        probing_queries = np.split(by_list // self.n_probe, np.cumsum(list_sizes)[:-1])
+
+        # search list by list, comparing each with all the queries that probe it at once
+        for members, probing in zip(self.lists, probing_queries):
+            if len(probing) == 0 or len(members) == 0:
+                continue
+            sims = queries[probing] @ self.data[members].T
+            indices[probing], similarities[probing] = _merge_top_k(
+                indices[probing], similarities[probing], np.broadcast_to(members, sims.shape), sims, k
+                )
+        return _sort_top_k(indices, similarities)
+
+
+def knn(embeddings: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Finds the k nearest neighbors by cosine similarity of each embedding
+    among the others (excluding itself): exactly for up to EXACT_MAX_POINTS
+    embeddings, and approximately (see IVFIndex) for more.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The (n, k) neighbor indices, and their
+            similarities, most similar first.
+    """
+    if len(embeddings) <= EXACT_MAX_POINTS:
+        indices, similarities = exact_top_k(embeddings, embeddings, k + 1)
+    else:
+        indices, similarities = IVFIndex.build(embeddings).search(embeddings, k + 1)
+    # drop each point from its own neighbors (usually, but with duplicates not
+    # necessarily, the first column)
+    is_self = indices == np.arange(len(embeddings))[:, np.newaxis]
+    is_self[~is_self.any(axis=1), -1] = True
+    keep = ~is_self
+    return indices[keep].reshape(len(embeddings), -1), similarities[keep].reshape(len(embeddings), -1)
+
+
+class NeighborIndex:
+    """
+    Cosine nearest-neighbor search over a fixed set of embeddings, built once
+    and queried many times: exact for up to EXACT_MAX_POINTS embeddings, and
+    approximate (see IVFIndex) for more.
+
+    Saved indexes are memory-mapped when loaded, so opening one is cheap
+    whatever its size.
+
+    Attributes:
+        data (np.ndarray): The L2-normalized indexed embeddings.
+        ivf (IVFIndex | None): The approximate index, or None for exact search.
+    """
+    DATA_FILE = 'vectors.npy'
+    CENTERS_FILE = 'centers.npy'
+    LISTS_FILE = 'lists.npz'
+
+    def __init__(self, data: np.ndarray, ivf: IVFIndex | None = None):
+        self.data = data
+        self.ivf = ivf
+
+    @classmethod
+    def build(cls, embeddings: np.ndarray, approximate: bool | None = None) -> 'NeighborIndex':
+        """
+        Indexes embeddings; approximately if there are more than
+        EXACT_MAX_POINTS of them, unless approximate says otherwise.
+        """
+        if approximate is None:
+            approximate = len(embeddings) > EXACT_MAX_POINTS
+        if approximate:
+            ivf = IVFIndex.build(embeddings)
+            return cls(ivf.data, ivf)
+        return cls(l2_normalize(embeddings))
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def query(self, queries: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the k indexed embeddings most cosine-similar to each query.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The (n_queries, k) indices of the
+                neighbors, and their similarities, most similar first.
+        """
+        queries = np.atleast_2d(queries)
+        if self.ivf is not None:
+            return self.ivf.search(queries, k)
+        return exact_top_k(queries, self.data, k)
+
+    def similar(self, i: int, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the k indexed embeddings most similar to the i-th, other than itself.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The (k,) indices of the neighbors,
+                and their similarities, most similar first.
+        """
+        indices, similarities = self.query(self.data[i], k + 1)
+        indices, similarities = indices[0], similarities[0]
+        keep = (indices != i) & (indices >= 0)
+        return indices[keep][:k], similarities[keep][:k]
+
+    def save(self, path: Path) -> None:
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        # write alongside and rename, since the index being saved over may
+        # have its vectors memory-mapped from the same file
+        tmp_file = path / ('tmp_' + self.DATA_FILE)
+        np.save(tmp_file, np.asarray(self.data, dtype=np.float32))
+        os.replace(tmp_file, path / self.DATA_FILE)
+        if self.ivf is not None:
+            np.save(path / self.CENTERS_FILE, self.ivf.centers)
+            np.savez(
+                path / self.LISTS_FILE,
+                members=np.concatenate(self.ivf.lists),
+                sizes=np.array([len(members) for members in self.ivf.lists]),
+                n_probe=self.ivf.n_probe
+                )
+        else:
+            # an index saved over an approximate one mustn't keep its lists
+            (path / self.CENTERS_FILE).unlink(missing_ok=True)
+            (path / self.LISTS_FILE).unlink(missing_ok=True)
+
+    @classmethod
+    def load(cls, path: Path) -> 'NeighborIndex':
+        path = Path(path)
+        data = np.load(path / cls.DATA_FILE, mmap_mode='r')
+        if not (path / cls.LISTS_FILE).exists():
+            return cls(data)
+        lists = np.load(path / cls.LISTS_FILE)
+        ivf = IVFIndex(
+            data,
+            np.load(path / cls.CENTERS_FILE),
+            np.split(lists['members'], np.cumsum(lists['sizes'])[:-1]),
+            int(lists['n_probe'])
+            )
+        return cls(data, ivf)
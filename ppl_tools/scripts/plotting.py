@@ -0,0 +1,481 @@
+import os
+import re
+import uuid
+
+from enum import Enum
+from pathlib import Path
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+import numpy as np
+
+from plotly import graph_objects as go
+from plotly import io as pio
+from plotly.colors import qualitative
+from plotly.io.json import to_json_plotly
+from plotly.offline import get_plotlyjs, get_plotlyjs_version
+
+# above this many findings, plots are drawn with WebGL by default
+WEBGL_MIN_POINTS = 2000
+# cluster colors, reused in order when there are more clusters than colors
+CLUSTER_COLORS = qualitative.Plotly + qualitative.Dark24 + qualitative.Light24
+# findings drawn at first in large plots (see sample_points)
+DEFAULT_POINT_BUDGET = 20_000
+# findings closest to each cluster's mean which are always drawn
+DEFAULT_N_CENTRAL = 10
+
+# where the copy of plotly.js shared by compact plots is kept
+DEFAULT_PLOTLY_JS_DIR = Path.home() / '.ppl_tools' / 'plotly'
+# a compact plot's figure is stored beside it, in a file with this suffix
+DATA_SUFFIX = '.data.js'
+# findings left out of a sampled plot are stored beside it, in a file with this
+# suffix which sets this variable, and only loaded once they are to be drawn
+RESERVE_SUFFIX = '.reserve.js'
+RESERVE_VARIABLE = 'plotReserve'
+# the per-point properties of a reserve trace which go in its file
+RESERVE_PROPERTIES = ['x', 'y', 'customdata', 'text', 'hovertext']
+PLOT_DIV_ID = 'cluster-plot'
+# scripts with this attribute are inlined when a compact plot is exported
+INLINE_SCRIPT_PATTERN = re.compile(r'<script data-inline src="([^"]+)"></script>')
+
+
+class PlotMode(Enum):
+    # one SVG trace per cluster: crisp, but slow beyond a few thousand points
+    SVG = 'svg'
+    # a single WebGL trace colored by cluster, for smooth interaction with 100k points
+    WEBGL = 'webgl'
+
+
+def default_plot_mode(n_points: int) -> PlotMode:
+    return PlotMode.WEBGL if n_points > WEBGL_MIN_POINTS else PlotMode.SVG
+
+
+def cluster_color(i: int) -> str:
+    return CLUSTER_COLORS[i % len(CLUSTER_COLORS)]
+
+
+def _discrete_colorscale(n_clusters: int) -> list[tuple[float, str]]:
+    # a colorscale mapping each integer label in [0, n_clusters) to its cluster's color
+    scale = []
+    for i in range(n_clusters):
+        scale.append((i / n_clusters, cluster_color(i)))
+        scale.append(((i + 1) / n_clusters, cluster_color(i)))
+    return scale
+
+
+# Interaction for the WebGL trace (see add_webgl_trace):
+# - each cluster's legend entry is an empty trace; clicking one hides or shows
+#   that cluster's points in the data trace, and double clicking shows only
+#   that cluster, or every cluster if it was the only one shown
+# - points left out by sampling are kept in a file beside the plot (see
+#   write_plot), which is loaded the first time they're needed. Zooming
+#   draws up to the point budget more of them in view, and the "Show all
+#   points" button draws them all
+# Plotly encodes numeric arrays as base64, so they are decoded here.
+CLUSTER_TRACE_SCRIPT = """
+(function() {
+    var plot = document.getElementById('{plot_id}');
+    function role(trace) {
+        return trace.meta && trace.meta.role;
+    }
+    var main = plot.data.findIndex(function(t) { return role(t) === 'clusters'; });
+    if (main < 0) {
+        return;
+    }
+    var reserve = plot.data.findIndex(function(t) { return role(t) === 'reserve'; });
+    var budget = plot.data[main].meta.point_budget;
+    // trace index of each cluster's legend entry
+    var legend = [];
+    plot.data.forEach(function(t, i) {
+        if (role(t) === 'legend') {
+            legend[t.meta.cluster] = i;
+        }
+    });
+
+    var dtypes = {
+        i1: Int8Array, u1: Uint8Array, i2: Int16Array, u2: Uint16Array,
+        i4: Int32Array, u4: Uint32Array, f4: Float32Array, f8: Float64Array
+    };
+    function decode(array) {
+        if (!array || array.bdata === undefined) {
+            return Array.from(array || []);
+        }
+        var bytes = Uint8Array.from(atob(array.bdata), function(c) { return c.charCodeAt(0); });
+        return Array.from(new dtypes[array.dtype](bytes.buffer));
+    }
+    var x = [], y = [], labels = [], rows = [], text = [], hovertext = [];
+    function append(trace) {
+        x = x.concat(decode(trace.x));
+        y = y.concat(decode(trace.y));
+        // customdata is (cluster, row) pairs
+        var customdata = trace.customdata.bdata === undefined ? [].concat.apply([], trace.customdata) : decode(trace.customdata);
+        for (var i = 0; i < customdata.length; i += 2) {
+            labels.push(customdata[i]);
+            rows.push(customdata[i + 1]);
+        }
+        text = text.concat(trace.text || []);
+        hovertext = hovertext.concat(trace.hovertext || []);
+    }
+    append(plot.data[main]);
+    // whether each point is drawn, unless its cluster is hidden
+    var loaded = new Uint8Array(x.length).fill(1);
+    var hidden = legend.map(function() { return false; });
+
+    // calls callback once the reserve's points have been appended, undrawn
+    var reserveState = 'unloaded', waiting = [];
+    function withReserve(callback) {
+        if (reserveState === 'loaded') {
+            callback();
+            return;
+        }
+        waiting.push(callback);
+        if (reserveState === 'loading') {
+            return;
+        }
+        reserveState = 'loading';
+        function load() {
+            append(window.{reserve_variable});
+            var grown = new Uint8Array(x.length);
+            grown.set(loaded);
+            loaded = grown;
+            reserveState = 'loaded';
+            waiting.splice(0).forEach(function(f) { f(); });
+        }
+        // already there if the plot was exported as a single file
+        if (window.{reserve_variable}) {
+            load();
+            return;
+        }
+        var script = document.createElement('script');
+        script.src = plot.data[reserve].meta.src;
+        script.onload = load;
+        document.body.appendChild(script);
+    }
+
+    function redraw() {
+        var shown = [];
+        for (var i = 0; i < x.length; i++) {
+            if (loaded[i] && !hidden[labels[i]]) {
+                shown.push(i);
+            }
+        }
+        function pick(values) {
+            return [shown.map(function(i) { return values[i]; })];
+        }
+        var update = {
+            x: pick(x), y: pick(y), 'marker.color': pick(labels), text: pick(text),
+            customdata: [shown.map(function(i) { return [labels[i], rows[i]]; })]
+        };
+        if (hovertext.length) {
+            update.hovertext = pick(hovertext);
+        }
+        Plotly.restyle(plot, update, [main]);
+        var visible = legend.map(function(_, cluster) { return hidden[cluster] ? 'legendonly' : true; });
+        Plotly.restyle(plot, {visible: visible}, legend);
+    }
+
+    plot.on('plotly_legendclick', function(event) {
+        var cluster = plot.data[event.curveNumber].meta.cluster;
+        hidden[cluster] = !hidden[cluster];
+        redraw();
+        return false;
+    });
+    plot.on('plotly_legenddoubleclick', function(event) {
+        var cluster = plot.data[event.curveNumber].meta.cluster;
+        var onlyShown = hidden.every(function(h, i) { return h === (i !== cluster); });
+        hidden = hidden.map(function(_, i) { return !onlyShown && i !== cluster; });
+        redraw();
+        return false;
+    });
+
+    if (reserve < 0) {
+        return;
+    }
+    plot.on('plotly_relayout', function(event) {
+        if (!Object.keys(event).some(function(key) { return key.indexOf('axis.range') >= 0; })) {
+            return;
+        }
+        var xRange = plot.layout.xaxis.range.slice(), yRange = plot.layout.yaxis.range.slice();
+        withReserve(function() {
+            var n = 0;
+            for (var i = 0; i < x.length && n < budget; i++) {
+                if (!loaded[i] && x[i] >= xRange[0] && x[i] <= xRange[1] && y[i] >= yRange[0] && y[i] <= yRange[1]) {
+                    loaded[i] = 1;
+                    n++;
+                }
+            }
+            if (n) {
+                redraw();
+            }
+        });
+    });
+    plot.on('plotly_buttonclicked', function(event) {
+        if (event.button.name === 'show_all') {
+            withReserve(function() {
+                loaded.fill(1);
+                redraw();
+            });
+        }
+    });
+})();
+""".replace('{reserve_variable}', RESERVE_VARIABLE)
+
+
+def sample_points(
+    labels: np.ndarray,
+    budget: int,
+    dists: np.ndarray | None = None,
+    n_central: int = DEFAULT_N_CENTRAL,
+    random_state: int = 0
+    ) -> np.ndarray:
+    """
+    Chooses at most about budget points to draw, preserving density: each
+    cluster gets a share of the budget proportional to its size (so at least
+    its n_central points), and its points are sampled uniformly, except
+    that its n_central points closest to its mean are always included.
+
+    Args:
+        labels (np.ndarray): Cluster of each point.
+        budget (int): Number of points to draw.
+        dists (np.ndarray): Optional distance of each point to its cluster's mean.
+        n_central (int): Points closest to each cluster's mean to always include.
+        random_state (int): Seed for the sample.
+
+    Returns:
+        np.ndarray: Sorted indices of the points to draw.
+    """
+    if len(labels) <= budget:
+        return np.arange(len(labels))
+    rng = np.random.default_rng(random_state)
+    chosen = []
+    for cluster in np.unique(labels):
+        members = np.flatnonzero(labels == cluster)
+        quota = min(len(members), max(n_central, round(budget * len(members) / len(labels))))
+        if dists is not None:
+            by_dist = members[np.argsort(dists[members], kind='stable')]
+            central, rest = by_dist[:min(n_central, quota)], by_dist[min(n_central, quota):]
+        else:
+            central, rest = members[:0], members
+        chosen.append(central)
+        chosen.append(rng.choice(rest, quota - len(central), replace=False))
+    return np.sort(np.concatenate(chosen))
+
+
+def add_webgl_trace(
+    fig: go.Figure,
+    x: np.ndarray,
+    y: np.ndarray,
+    labels: np.ndarray,
+    hover_text: list[str],
+    extra_text: list[str] | None = None,
+    shown: np.ndarray | None = None,
+    point_budget: int = DEFAULT_POINT_BUDGET,
+    random_state: int = 0
+    ) -> None:
+    """
+    Adds findings to fig as a single WebGL trace, colored by cluster, with an
+    empty trace per cluster for its legend entry. Draw with
+    CLUSTER_TRACE_SCRIPT as a post script to make the legend entries
+    toggle their clusters.
+
+    Per-point data is kept compact: coordinates as float32, labels and row
+    indices as integers (which plotly writes as binary), and one hover
+    string per point.
+
+    Args:
+        fig (go.Figure): The figure to add to; it should have no traces yet.
+        x, y (np.ndarray): Coordinates of each finding.
+        labels (np.ndarray): Cluster of each finding, numbered from 0.
+        hover_text (list[str]): Hover text of each finding.
+        extra_text (list[str]): Optional text shown beside each finding's hover box.
+        shown (np.ndarray): Indices of the findings to draw at first (see
+            sample_points), or None for all of them. The others are kept in
+            a hidden trace, which write_plot moves to a file of its own, and
+            drawn on zooming in (up to point_budget more at a time) or with
+            the plot's "Show all points" button.
+        point_budget (int): Findings drawn per zoom.
+        random_state (int): Seed for the order hidden findings are drawn in.
+    """
+    labels = np.asarray(labels, dtype=np.int32)
+    x = np.asarray(x, dtype=np.float32)
+    y = np.asarray(y, dtype=np.float32)
+    n_clusters = int(labels.max()) + 1 if len(labels) else 0
+    hover_template = 'Cluster %{customdata[0]} - %{text}'
+    hover_template += '<extra>%{hovertext}</extra>' if extra_text is not None else '<extra></extra>'
+
+    def points(idx: np.ndarray) -> dict:
+        return {
+            'x': x[idx],
+            'y': y[idx],
+            # the row index is last, for click handlers
+            'customdata': np.stack((labels[idx], idx.astype(np.int32)), axis=-1),
+            'text': [hover_text[i] for i in idx],
+            'hovertext': [extra_text[i] for i in idx] if extra_text is not None else None,
+        }
+
+    all_idx = np.arange(len(labels))
+    shown = all_idx if shown is None else np.asarray(shown)
+    fig.add_trace(go.Scattergl(
+        **points(shown),
+        mode='markers',
+        marker={
+            'color': labels[shown],
+            'colorscale': _discrete_colorscale(max(n_clusters, 1)),
+            'cmin': -0.5,
+            'cmax': max(n_clusters, 1) - 0.5,
+        },
+        hovertemplate=hover_template,
+        showlegend=False,
+        # marks the traces for CLUSTER_TRACE_SCRIPT
+        meta={'role': 'clusters', 'point_budget': point_budget},
+    ))
+    if len(shown) < len(labels):
+        # in random order, so those drawn on zooming are a uniform sample of the view
+        reserve = np.random.default_rng(random_state).permutation(np.setdiff1d(all_idx, shown))
+        fig.add_trace(go.Scattergl(**points(reserve), visible=False, showlegend=False, meta={'role': 'reserve'}))
+        fig.update_layout(updatemenus=[{
+            'type': 'buttons',
+            'buttons': [{'label': 'Show all points', 'method': 'skip', 'name': 'show_all'}],
+            'x': 0, 'xanchor': 'left', 'y': 1.08, 'yanchor': 'bottom',
+        }])
+        fig.update_layout(title=f'Showing {len(shown)} of {len(labels)} findings; zoom in for more')
+    for i in range(n_clusters):
+        fig.add_trace(go.Scattergl(
+            x=[None],
+            y=[None],
+            mode='markers',
+            marker_color=cluster_color(i),
+            name=str(i),
+            hoverinfo='skip',
+            meta={'role': 'legend', 'cluster': i},
+        ))
+
+
+def shared_plotly_js(js_dir: Path = DEFAULT_PLOTLY_JS_DIR) -> Path:
+    """
+    Returns the path of a local copy of plotly.js, writing it the first time.
+    """
+    path = Path(js_dir) / f'plotly-{get_plotlyjs_version()}.min.js'
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write to a temporary name and rename, so that a crash never leaves
+        # a half-written copy behind
+        tmp_path = path.parent / (uuid.uuid4().hex + '.tmp')
+        tmp_path.write_text(get_plotlyjs(), encoding='utf-8')
+        os.replace(tmp_path, path)
+    return path
+
+
+def data_file(html_file: Path) -> Path:
+    html_file = Path(html_file)
+    return html_file.with_name(html_file.stem + DATA_SUFFIX)
+
+
+def reserve_file(html_file: Path) -> Path:
+    html_file = Path(html_file)
+    return html_file.with_name(html_file.stem + RESERVE_SUFFIX)
+
+
+def _move_reserve(figure: dict, out_file: Path) -> dict:
+    """
+    Writes the per-point data of figure's reserve trace (see add_webgl_trace)
+    to reserve_file(out_file), leaving the trace empty, so that a plot's size
+    is bounded by its point budget rather than by the number of findings.
+    """
+    data = []
+    for trace in figure['data']:
+        if (trace.get('meta') or {}).get('role') == 'reserve':
+            points = {key: trace.pop(key) for key in RESERVE_PROPERTIES if key in trace}
+            reserve_file(out_file).write_text(
+                f'var {RESERVE_VARIABLE} = {to_json_plotly(points)};', encoding='utf-8'
+                )
+            trace['meta'] = {**trace['meta'], 'src': reserve_file(out_file).name}
+        data.append(trace)
+    return {**figure, 'data': data}
+
+
+def write_plot(
+    fig: go.Figure,
+    out_file: Path,
+    post_script: str | list[str] | None = None,
+    self_contained: bool = True,
+    js_dir: Path = DEFAULT_PLOTLY_JS_DIR
+    ) -> None:
+    """
+    Writes fig to an HTML file.
+
+    A self-contained file includes plotly.js (several MB) and the figure. A
+    compact one instead loads a shared local copy of plotly.js (see
+    shared_plotly_js), and the figure from a sidecar file beside it (see
+    data_file), so it is quick to write and load. It only works on this
+    machine; export_plot makes it self-contained.
+
+    Either way, the findings a sampled plot leaves out are written to a file
+    beside it (see reserve_file), which the plot loads once they're drawn.
+
+    Args:
+        fig (go.Figure): The figure.
+        out_file (Path): The HTML file to write.
+        post_script: JavaScript to run once the plot is drawn, in which
+            {plot_id} is replaced by the id of the plot's div.
+        self_contained (bool): Whether to write a self-contained file.
+        js_dir (Path): Directory of the shared plotly.js, for compact files.
+    """
+    out_file = Path(out_file)
+    figure = _move_reserve(fig.to_dict(), out_file)
+    if self_contained:
+        pio.write_html(figure, out_file, post_script=post_script, validate=False)
+        return
+
+    # plotly's JSON escapes '<', so the figure can't close the script tag it's inlined into
+    figure_json = to_json_plotly({'data': figure['data'], 'layout': figure['layout']})
+    data_file(out_file).write_text(f'var figure = {figure_json};', encoding='utf-8')
+
+    if isinstance(post_script, str):
+        post_script = [post_script]
+    then_post_script = ''.join(
+        '.then(function() {\n' + script.replace('{plot_id}', PLOT_DIV_ID) + '\n})'
+        for script in post_script or []
+    )
+    plotly_js_src = shared_plotly_js(js_dir).as_uri()
+    out_file.write_text(
+        '<html>\n<head><meta charset="utf-8" /></head>\n'
+        '<body style="margin: 0;">\n'
+        f'<script data-inline src="{plotly_js_src}"></script>\n'
+        f'<script data-inline src="{data_file(out_file).name}"></script>\n'
+        f'<div id="{PLOT_DIV_ID}" style="height: 100vh; width: 100%;"></div>\n'
+        '<script type="text/javascript">\n'
+        f'Plotly.newPlot("{PLOT_DIV_ID}", figure.data, figure.layout, {{"responsive": true}})'
+        f'{then_post_script};\n'
+        '</script>\n'
+        '</body>\n</html>\n',
+        encoding='utf-8'
+    )
+
+
+def export_plot(html_file: Path, out_file: Path) -> None:
+    """
+    Copies a plot written by write_plot to out_file as a single
+    self-contained HTML file, inlining plotly.js and the figure if it is
+    compact, and the findings it left out, if any.
+    """
+    html_file = Path(html_file)
+    html = html_file.read_text(encoding='utf-8')
+
+    def inline(match: re.Match) -> str:
+        src = match.group(1)
+        if src.startswith('file:'):
+            path = Path(url2pathname(urlparse(src).path))
+        else:
+            path = html_file.parent / src
+        return '<script type="text/javascript">' + path.read_text(encoding='utf-8') + '</script>'
+
+    html = INLINE_SCRIPT_PATTERN.sub(inline, html)
+    reserve = reserve_file(html_file)
+    if reserve.name in html and reserve.exists():
+        html = html.replace(
+            '</body>',
+            '<script type="text/javascript">' + reserve.read_text(encoding='utf-8') + '</script>\n</body>',
+            1
+            )
+    Path(out_file).write_text(html, encoding='utf-8')
@@ -0,0 +1,190 @@
+import hashlib
+import os
+import uuid
+
+from enum import Enum
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+from sklearn.decomposition import PCA
+from sklearn.manifold import TSNE
+
+from ppl_tools.scripts.embedding_cache import CacheStats, array_fingerprint
+
+DEFAULT_PROJECTION_CACHE_DIR = Path.home() / '.ppl_tools' / 'projection_cache'
+# embeddings are reduced to this many dimensions with PCA before t-SNE, which
+# barely changes the layout but makes its neighbor search much cheaper
+TSNE_PCA_COMPONENTS = 50
+# bump when a method's settings change, so layouts cached with the old ones aren't reused
+PROJECTION_VERSION = 1
+# openTSNE's optimization phases (early exaggeration, then the rest), and how
+# often, in iterations, it reports progress and checks for cancellation
+OPENTSNE_N_ITER = (250, 500)
+OPENTSNE_CALLBACK_EVERY = 25
+
+
+class ProjectionCancelled(Exception):
+    pass
+
+
+class ProjectionMethod(Enum):
+    # sklearn's Barnes-Hut t-SNE, initialized with PCA
+    TSNE = 'tsne'
+    # FFT-accelerated t-SNE, much faster on large sets; requires the optional openTSNE package
+    OPENTSNE = 'opentsne'
+    # the first two principal components: near instant, but clusters overlap more
+    PCA = 'pca'
+
+
+AXIS_TITLES = {
+    ProjectionMethod.TSNE: 't-SNE Dimension',
+    ProjectionMethod.OPENTSNE: 't-SNE Dimension',
+    ProjectionMethod.PCA: 'Principal Component',
+}
+
+
+def _pca_reduce(embeddings: np.ndarray, n_components: int, random_state: int) -> np.ndarray:
+    n_components = min(n_components, *embeddings.shape)
+    if embeddings.shape[1] <= n_components:
+        return np.asarray(embeddings, dtype=np.float32)
+    return PCA(n_components, random_state=random_state).fit_transform(embeddings).astype(np.float32)
+
+
+def project_2d(
+    embeddings: np.ndarray,
+    method: ProjectionMethod = ProjectionMethod.TSNE,
+    random_state: int = 0,
+    progress_callback: Callable[[int], None] | None = None,
+    cancellation_check: Callable[[], bool] | None = None
+    ) -> np.ndarray:
+    """
+    Lays embeddings out in 2 dimensions for plotting.
+
+    Args:
+        embeddings (np.ndarray): The (n, d) embeddings.
+        method (ProjectionMethod): How to lay them out.
+        random_state (int): Seed, so the same embeddings get the same layout.
+        progress_callback (Callable): Called with the percentage of the
+            projection done so far; after each step, and during openTSNE's
+            optimization.
+        cancellation_check (Callable): Returns True if projecting should stop.
+
+    Returns:
+        np.ndarray: The (n, 2) layout.
+
+    Raises:
+        ProjectionCancelled: If cancellation_check returns True. sklearn's
+            t-SNE can't be interrupted, so it's only checked before and after.
+    """
+    def check_cancelled():
+        if cancellation_check is not None and cancellation_check():
+            raise ProjectionCancelled()
+
+    def report(progress: int):
+        if progress_callback is not None:
+            progress_callback(progress)
+
+    if method == ProjectionMethod.PCA:
+        return _pca_reduce(embeddings, 2, random_state)
+
+    reduced = _pca_reduce(embeddings, TSNE_PCA_COMPONENTS, random_state)
+    check_cancelled()
+    report(10)
+    # t-SNE's perplexity must be below the number of points
+    perplexity = min(30.0, max(1.0, (len(reduced) - 1) / 3))
+    if method == ProjectionMethod.OPENTSNE:
+        # optional dependency, only needed for this method
+        try:
+            from openTSNE import TSNE as OpenTSNE
+        except ImportError as e:
+            raise ImportError(
+                'FFT-accelerated t-SNE requires the openTSNE package '
+                '(pip install openTSNE); use t-SNE instead.'
+                ) from e
+        n_callbacks = 0
+
+        def callback(iteration, error, embedding) -> bool:
+            nonlocal n_callbacks
+            n_callbacks += 1
+            report(10 + round(90 * n_callbacks * OPENTSNE_CALLBACK_EVERY / sum(OPENTSNE_N_ITER)))
+            # returning True interrupts the optimization
+            return cancellation_check is not None and cancellation_check()
+
+        early_exaggeration_iter, n_iter = OPENTSNE_N_ITER
+        layout = OpenTSNE(
+            n_components=2, perplexity=perplexity, initialization='pca',
+            negative_gradient_method='fft', n_jobs=-1, random_state=random_state,
+            early_exaggeration_iter=early_exaggeration_iter, n_iter=n_iter,
+            callbacks=callback, callbacks_every_iters=OPENTSNE_CALLBACK_EVERY
+            ).fit(reduced)
+        check_cancelled()
+        return np.asarray(layout, dtype=np.float32)
+
+    layout = TSNE(
+        n_components=2, perplexity=perplexity, init='pca', learning_rate='auto',
+        method='barnes_hut', n_jobs=-1, random_state=random_state
+        ).fit_transform(reduced).astype(np.float32)
+    check_cancelled()
+    return layout
+
+
+class ProjectionCache:
+    """
+    On-disk cache of 2-D layouts, by embeddings and projection method.
+
+    A layout depends only on the embeddings, not on how they are clustered,
+    so reclustering the same findings reuses it instead of projecting again.
+    Each layout is saved to its own .npy file, named by a hash of the
+    embeddings and the method.
+
+    Attributes:
+        cache_dir (Path): Directory of the cache.
+        stats (CacheStats): Running hit/miss counts for this instance.
+    """
+    def __init__(self, cache_dir: Path = DEFAULT_PROJECTION_CACHE_DIR):
+        self.cache_dir = Path(cache_dir)
+        self.stats = CacheStats()
+
+    def _path(self, embeddings: np.ndarray, method: ProjectionMethod, random_state: int) -> Path:
+        digest = hashlib.sha1(array_fingerprint(embeddings).encode('utf-8'))
+        digest.update(f'{method.value}:{random_state}:{PROJECTION_VERSION}'.encode('utf-8'))
+        return self.cache_dir / (digest.hexdigest() + '.npy')
+
+    def get_or_project(
+        self,
+        embeddings: np.ndarray,
+        method: ProjectionMethod = ProjectionMethod.TSNE,
+        random_state: int = 0,
+        progress_callback: Callable[[int], None] | None = None,
+        cancellation_check: Callable[[], bool] | None = None
+        ) -> np.ndarray:
+        """
+        Returns the cached layout of embeddings, projecting and caching it if
+        there isn't one. See project_2d for the arguments.
+        """
+        path = self._path(embeddings, method, random_state)
+        try:
+            layout = np.load(path)
+            self.stats.hits += 1
+            return layout
+        except FileNotFoundError:
+            self.stats.misses += 1
+        except Exception:
+            # unreadable; project again
+            path.unlink(missing_ok=True)
+            self.stats.misses += 1
+
+        layout = project_2d(embeddings, method, random_state, progress_callback, cancellation_check)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # write to a temporary name and rename, so that a crash never leaves
+        # a half-written layout behind
+        tmp_path = self.cache_dir / (uuid.uuid4().hex + '.tmp.npy')
+        np.save(tmp_path, layout)
+        os.replace(tmp_path, path)
+        return layout
+
+    def clear(self) -> None:
+        for path in self.cache_dir.glob('*.npy'):
+            path.unlink(missing_ok=True)
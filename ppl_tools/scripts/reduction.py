@@ -0,0 +1,114 @@
+import time
+
+from collections import OrderedDict
+
+import numpy as np
+
+from sklearn.decomposition import PCA
+
+from ppl_tools.scripts.embedding_cache import array_fingerprint
+
+# fixed dimensions below this fraction of the input's use randomized SVD
+RANDOMIZED_SVD_MAX_FRACTION = 0.8
+# projections kept in memory, one per embedding set and reduction setting
+MAX_CACHED_PROJECTIONS = 8
+
+_projection_cache: OrderedDict[tuple, PCA] = OrderedDict()
+
+
+def fit_projection(
+    embeddings: np.ndarray,
+    n_components: int | None = None,
+    explained_variance: float | None = None,
+    whiten: bool = False
+    ) -> PCA:
+    """
+    Fits a PCA projection of embeddings, to either a fixed number of
+    components or the fewest components that retain explained_variance.
+
+    Projections are cached in memory by a fingerprint of the embeddings and
+    the settings, so refitting the mixture in this process (e.g. with a
+    different number of clusters) on the same embeddings doesn't recompute
+    the SVD. Sweeps and restarts fit in worker processes, so they project
+    once before starting them instead.
+    """
+    if (n_components is None) == (explained_variance is None):
+        raise ValueError("Exactly one of n_components and explained_variance must be set.")
+
+    key = (array_fingerprint(embeddings), n_components, explained_variance, whiten)
+    if key in _projection_cache:
+        _projection_cache.move_to_end(key)
+        return _projection_cache[key]
+
+    if n_components is not None:
+        n_components = min(n_components, *embeddings.shape)
+        randomized = n_components < RANDOMIZED_SVD_MAX_FRACTION * embeddings.shape[1]
+        pca = PCA(n_components=n_components, whiten=whiten,
+                  svd_solver='randomized' if randomized else 'full', random_state=0)
+    else:
+        pca = PCA(n_components=explained_variance, whiten=whiten, svd_solver='full')
+
+    start = time.perf_counter()
+    pca.fit(embeddings)
+    # no percent sign, since the GUI reads percentages in output as progress
+    print(
+        f'Reduced {embeddings.shape[1]} to {pca.n_components_} dimensions, '
+        f'retaining a fraction {pca.explained_variance_ratio_.sum():.3f} of the variance '
+        f'({time.perf_counter() - start:.1f}s)'
+        )
+
+    _projection_cache[key] = pca
+    while len(_projection_cache) > MAX_CACHED_PROJECTIONS:
+        _projection_cache.popitem(last=False)
+    return pca
+
+
+def estimated_speedup(n_features: int, n_components: int, covariance_type: str) -> float:
+    """
+    Estimated per-iteration EM speedup from fitting on n_components instead of
+    n_features dimensions: quadratic in the dimension for full and tied
+    covariances, linear for diagonal and spherical ones.
+    """
+    ratio = n_features / n_components
+    return ratio ** 2 if covariance_type in ('full', 'tied') else ratio
+
+
+class ReducedMixture:
+    """
+    A mixture model fit on projected embeddings, which takes embeddings in
+    the original space and projects them before delegating to the mixture.
+
+    means_ are mapped back to the original space, so distances to cluster
+    means are comparable with those of a mixture fit without reduction.
+    Other attributes (converged_, n_iter_, ...) are the mixture's.
+
+    Attributes:
+        projection (PCA): The fitted projection.
+        mixture: The mixture model, fit on projected embeddings.
+    """
+    def __init__(self, projection: PCA, mixture):
+        self.projection = projection
+        self.mixture = mixture
+
+    def __getattr__(self, name):
+        # only called for attributes not found on the wrapper itself
+        if name in ('projection', 'mixture'):
+            raise AttributeError(name)
+        return getattr(self.mixture, name)
+
+    @property
+    def means_(self) -> np.ndarray:
+        return self.projection.inverse_transform(self.mixture.means_)
+
+    def fit(self, X: np.ndarray) -> 'ReducedMixture':
+        self.mixture.fit(self.projection.transform(X))
+        return self
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        return self.mixture.predict(self.projection.transform(X))
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        return self.mixture.predict_proba(self.projection.transform(X))
+
+    def score_samples(self, X: np.ndarray) -> np.ndarray:
+        return self.mixture.score_samples(self.projection.transform(X))
@@ -0,0 +1,179 @@
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import warnings
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from sklearn.exceptions import ConvergenceWarning
+from threadpoolctl import threadpool_limits
+
+from ppl_tools.scripts.cluster import ClusteringConfig, build_model, reduce_embeddings, size_order
+from ppl_tools.scripts.reduction import ReducedMixture
+
+# EM iterations each restart runs between comparisons with the others
+CHECK_INTERVAL = 10
+# restarts aren't abandoned before this many iterations, since early lower
+# bounds say little about where a fit ends up
+MIN_ITER_BEFORE_ABANDON = 20
+# a restart is abandoned if, improving at its latest rate, it would still
+# trail the best restart's lower bound after this many more checks
+PATIENCE = 3
+
+
+def _fit_restart(
+    embeddings: np.ndarray | Path,
+    config: ClusteringConfig,
+    sample_weight: np.ndarray | None,
+    seed: int,
+    n_threads: int | None,
+    lower_bounds: dict,
+    stop: threading.Event
+    ) -> tuple[object, dict]:
+    """
+    Fits one restart of config's mixture in chunks of CHECK_INTERVAL
+    iterations, publishing its lower bound to lower_bounds after each chunk
+    and giving up early if it clearly trails the best one there.
+    """
+    if isinstance(embeddings, Path):
+        # worker processes get the embeddings as a file, to memory-map rather than copy
+        embeddings = np.load(embeddings, mmap_mode='r')
+    model = build_model(config, random_state=seed, warm_start=True)
+    # restarts run side by side, so per-iteration output would be interleaved
+    model.verbose = 0
+    model.sample_weight = sample_weight
+
+    start = time.perf_counter()
+    n_iter = 0
+    status = 'max_iter'
+    # warm starting continues from the previous chunk, so this is the same as one long fit
+    with threadpool_limits(n_threads), warnings.catch_warnings():
+        warnings.simplefilter('ignore', ConvergenceWarning)
+        while n_iter < config.max_iter:
+            previous_lower_bound = getattr(model, 'lower_bound_', -np.inf)
+            model.max_iter = min(CHECK_INTERVAL, config.max_iter - n_iter)
+            model.fit(embeddings)
+            n_iter += model.n_iter_
+            lower_bounds[seed] = model.lower_bound_
+
+            if model.converged_:
+                status = 'converged'
+                break
+            if stop.is_set():
+                status = 'cancelled'
+                break
+            gap = max(lower_bounds.values()) - model.lower_bound_
+            improvement = model.lower_bound_ - previous_lower_bound
+            if n_iter >= MIN_ITER_BEFORE_ABANDON and gap > PATIENCE * improvement:
+                status = 'abandoned'
+                break
+
+    model.sample_weight = None
+    model.max_iter = config.max_iter
+    model.n_iter_ = n_iter
+    row = {
+        'seed': seed,
+        'lower_bound': model.lower_bound_,
+        'n_iter': n_iter,
+        'status': status,
+        'fit_s': time.perf_counter() - start,
+    }
+    return model, row
+
+
+def fit_restarts(
+    embeddings: np.ndarray,
+    config: ClusteringConfig,
+    sample_weight: np.ndarray | None = None,
+    n_workers: int | None = None,
+    progress_callback: Callable[[int], None] | None = None,
+    cancellation_check: Callable[[], bool] | None = None,
+    ) -> tuple[tuple[object, np.ndarray], pd.DataFrame] | None:
+    """
+    Fits config.n_init independently seeded restarts of config's mixture
+    model, in parallel worker processes, and keeps the one with the highest
+    lower bound.
+
+    Restarts share their lower bounds as they fit. One which trails the best
+    and isn't improving fast enough to catch up is stopped early (see
+    PATIENCE), so time isn't spent finishing fits which won't be kept.
+
+    Args:
+        embeddings (np.ndarray): The (n, d) embeddings to cluster.
+        config (ClusteringConfig): The clustering configuration.
+        sample_weight (np.ndarray): Optional weight of each embedding.
+        n_workers (int): Number of worker processes; defaults to one per restart,
+            up to the core count. With 1, restarts are fit one after another
+            in this process.
+        progress_callback (Callable): Called with the percentage of restarts finished so far.
+        cancellation_check (Callable): Returns True if fitting should stop.
+
+    Returns:
+        tuple: The best restart's (fitted model, cluster order), and a table with
+            one row of lower bound, iterations, status and timing per restart;
+            or None if cancelled.
+    """
+    n_cpus = os.cpu_count() or 1
+    n_workers = n_workers or min(config.n_init, n_cpus)
+    n_threads = max(1, n_cpus // n_workers)
+    seeds = list(range(config.n_init))
+
+    # project once here rather than in every restart
+    projection, embeddings = reduce_embeddings(embeddings, config)
+
+    results = {}
+
+    def finished(seed, result):
+        results[seed] = result
+        if progress_callback is not None:
+            progress_callback(round(100 * len(results) / len(seeds)))
+
+    if n_workers == 1:
+        lower_bounds, stop = {}, threading.Event()
+        for seed in seeds:
+            if cancellation_check is not None and cancellation_check():
+                return None
+            # no thread limit in-process, so that any limit set by the caller (e.g. a sweep worker) holds
+            finished(seed, _fit_restart(embeddings, config, sample_weight, seed, None, lower_bounds, stop))
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            embeddings_file = Path(tmp_dir) / 'embeddings.npy'
+            np.save(embeddings_file, np.asarray(embeddings, dtype=np.float32))
+
+            # spawn rather than fork, since forking a process which has Qt threads running is unsafe
+            context = multiprocessing.get_context('spawn')
+            with context.Manager() as manager, ProcessPoolExecutor(n_workers, mp_context=context) as executor:
+                lower_bounds, stop = manager.dict(), manager.Event()
+                pending = {
+                    executor.submit(
+                        _fit_restart, embeddings_file, config, sample_weight, seed, n_threads, lower_bounds, stop
+                        ): seed
+                    for seed in seeds
+                }
+                while pending:
+                    done, _ = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                    if cancellation_check is not None and cancellation_check():
+                        stop.set()
+                        for future in pending:
+                            future.cancel()
+                        return None
+                    for future in done:
+                        finished(pending.pop(future), future.result())
+
+    table = pd.DataFrame([results[seed][1] for seed in seeds])
+    best_seed = int(table['seed'].iloc[table['lower_bound'].idxmax()])
+    table['best'] = table['seed'] == best_seed
+
+    model = results[best_seed][0]
+    # len(means_) rather than config.n_clusters, since graph clustering picks its own
+    order = size_order(model.predict(embeddings), len(model.means_), sample_weight)
+    if projection is not None:
+        model = ReducedMixture(projection, model)
+    return (model, order), table
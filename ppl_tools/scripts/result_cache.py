@@ -0,0 +1,178 @@
+import hashlib
+import io
+import json
+import os
+import time
+import uuid
+
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from ppl_tools.scripts.cluster import ClusteringConfig, config_from_dict, config_to_dict
+from ppl_tools.scripts.embedding_cache import CacheStats, array_fingerprint
+
+DEFAULT_RESULT_CACHE_DIR = Path.home() / '.ppl_tools' / 'result_cache'
+# fitted mixtures aren't cached (with full covariances they take 3·k·d²
+# float64s), so results are dominated by the (n, k) probabilities: with 100k
+# findings and 20 clusters, about 9 MB each, so this holds dozens of them
+DEFAULT_MAX_BYTES = 512 * 1024 ** 2
+
+RESULT_SUFFIX = '.npz'
+# arrays saved with each result; everything else is JSON, in the INFO_KEY entry
+RESULT_ARRAYS = ['probs', 'dists', 'labels', 'order']
+INFO_KEY = 'info'
+TABLES = ['sweep_table', 'restart_table']
+
+
+@dataclass
+class ClusteringResult:
+    """
+    The outcome of clustering a set of embeddings.
+
+    Attributes:
+        probs (np.ndarray): Cluster probabilities (n, k).
+        dists (np.ndarray): Distance to the assigned cluster's mean (n,).
+        labels (np.ndarray): Cluster labels (n,).
+        mixture: The fitted mixture model; None for results from a ResultCache.
+        order (np.ndarray): The mixture's cluster indices, in the order they are numbered.
+        config (ClusteringConfig): The fitted configuration (after a sweep,
+            with the chosen number of clusters).
+        sweep_table (pd.DataFrame | None): Scores of each candidate, when sweeping.
+        restart_table (pd.DataFrame | None): Lower bounds of each restart, when restarting.
+    """
+    probs: np.ndarray
+    dists: np.ndarray
+    labels: np.ndarray
+    mixture: object
+    order: np.ndarray
+    config: ClusteringConfig
+    sweep_table: pd.DataFrame | None = None
+    restart_table: pd.DataFrame | None = None
+
+
+def result_key(
+    embeddings: np.ndarray,
+    config: ClusteringConfig,
+    sample_weight: np.ndarray | None = None,
+    sweep_range: tuple[int, int] | None = None
+    ) -> str:
+    """
+    Returns a cache key for clustering embeddings with config: a hash of the
+    embeddings, the sample weights, every config field and the sweep range.
+    """
+    digest = hashlib.sha1(array_fingerprint(embeddings).encode('utf-8'))
+    if sample_weight is not None:
+        digest.update(array_fingerprint(sample_weight).encode('utf-8'))
+    settings = {'config': config_to_dict(config), 'sweep_range': sweep_range}
+    digest.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    On-disk cache of clustering results, so that rerunning a configuration
+    already tried on the same embeddings returns immediately.
+
+    Each result is saved to its own .npz file, named by its key (see
+    result_key): its arrays, and its config and tables as JSON, without its
+    fitted mixture, which can be far larger than the rest of it. Nothing is
+    pickled, so loading a result runs no code from the cache directory. When the cache grows beyond max_bytes, the least
+    recently used results are deleted; results larger than max_bytes on
+    their own aren't cached.
+
+    Attributes:
+        cache_dir (Path): Directory of the cache.
+        max_bytes (int | None): Size bound for the cache, or None for unbounded.
+        stats (CacheStats): Running hit/miss counts for this instance.
+    """
+    def __init__(self, cache_dir: Path = DEFAULT_RESULT_CACHE_DIR, max_bytes: int | None = DEFAULT_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / (key + RESULT_SUFFIX)
+
+    def get(self, key: str) -> ClusteringResult | None:
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as npz:
+                arrays = {name: npz[name] for name in RESULT_ARRAYS}
+                info = json.loads(str(npz[INFO_KEY]))
+            tables = {
+                name: pd.DataFrame(info[name]) if info[name] is not None else None for name in TABLES
+            }
+            result = ClusteringResult(
+                mixture=None, config=config_from_dict(info['config']), **arrays, **tables
+                )
+        except FileNotFoundError:
+            self.stats.misses += 1
+            return None
+        except Exception:
+            # e.g. written by an incompatible version; refit instead
+            path.unlink(missing_ok=True)
+            self.stats.misses += 1
+            return None
+
+        # mark as recently used, for eviction
+        now = time.time()
+        os.utime(path, (now, now))
+        self.stats.hits += 1
+        return result
+
+    def put(self, key: str, result: ClusteringResult) -> None:
+        info = {'config': config_to_dict(result.config)}
+        for name in TABLES:
+            table = getattr(result, name)
+            info[name] = table.to_dict(orient='list') if table is not None else None
+        buffer = io.BytesIO()
+        np.savez(
+            buffer, **{name: np.asarray(getattr(result, name)) for name in RESULT_ARRAYS},
+            **{INFO_KEY: np.array(json.dumps(info))}
+            )
+        data = buffer.getvalue()
+        if self.max_bytes is not None and len(data) > self.max_bytes:
+            # would be evicted straight away
+            return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # write to a temporary name and rename, so that a crash never leaves
+        # a half-written result behind
+        tmp_path = self.cache_dir / (uuid.uuid4().hex + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(key))
+
+        if self.max_bytes is not None:
+            self.evict(self.max_bytes)
+
+    def delete(self, key: str) -> None:
+        self._path(key).unlink(missing_ok=True)
+
+    def size_bytes(self) -> int:
+        return sum(p.stat().st_size for p in self.cache_dir.glob('*' + RESULT_SUFFIX))
+
+    def evict(self, max_bytes: int) -> int:
+        """
+        Deletes least recently used results until the cache fits in max_bytes.
+
+        Returns:
+            int: The number of results deleted.
+        """
+        paths = list(self.cache_dir.glob('*' + RESULT_SUFFIX))
+        sizes = {p: p.stat().st_size for p in paths}
+
+        total = sum(sizes.values())
+        n_deleted = 0
+        for path in sorted(paths, key=lambda p: p.stat().st_mtime):
+            if total <= max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= sizes[path]
+            n_deleted += 1
+        return n_deleted
+
+    def clear(self) -> None:
+        self.evict(0)
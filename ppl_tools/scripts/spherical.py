@@ -0,0 +1,205 @@
+import numpy as np
+
+from scipy.special import logsumexp, softmax
+from sklearn.base import BaseEstimator
+from sklearn.cluster import kmeans_plusplus
+from sklearn.utils.validation import check_is_fitted
+
+# rows per block when computing similarities, bounding temporaries to
+# BLOCK_SIZE * (d + k) floats
+BLOCK_SIZE = 4096
+# k-means++ initialization runs on a sample of at most this many points
+INIT_SAMPLE_SIZE = 10_000
+
+
+def l2_normalize(X: np.ndarray) -> np.ndarray:
+    X = np.asarray(X, dtype=np.float32)
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    return X / np.maximum(norms, np.finfo(np.float32).tiny)
+
+
+class SphericalKMeans(BaseEstimator):
+    """
+    K-means on the unit sphere: points and cluster centers are L2-normalized,
+    and points are assigned by cosine similarity, which is how sentence
+    embeddings are meant to be compared.
+
+    Each iteration is one matrix product of the points with the centers per
+    block of rows, so it runs multi-threaded through BLAS. With a
+    concentration, points are assigned softly, with the responsibilities of
+    a von Mises-Fisher mixture whose components share that concentration;
+    otherwise assignments are hard and predict_proba is one-hot.
+
+    It has the parts of sklearn's mixture interface that the rest of the
+    pipeline uses (fit, predict, predict_proba, means_, converged_, n_iter_,
+    lower_bound_, warm_start, and the sample_weight attribute), so it can be
+    used wherever a Gaussian mixture is.
+
+    Attributes:
+        cluster_centers_ (np.ndarray): Unit-norm cluster directions (k, d).
+        means_ (np.ndarray): Mean of each cluster's (unnormalized) points, so
+            distances to cluster means are comparable with the Gaussian mixtures'.
+        weights_ (np.ndarray): Fraction of the (weighted) points in each cluster.
+        lower_bound_ (float): Mean cosine similarity of points to their centers
+            (hard), or mean log normalizer of the responsibilities (soft).
+        sample_weight (np.ndarray): Optional weight of each point, used while fitting.
+    """
+    sample_weight: np.ndarray | None = None
+
+    def __init__(
+        self,
+        n_clusters: int = 8,
+        *,
+        concentration: float | None = None,
+        max_iter: int = 300,
+        tol: float = 1e-6,
+        random_state: int | None = None,
+        warm_start: bool = False,
+        verbose: int = 0,
+        verbose_interval: int = 10,
+    ):
+        self.n_clusters = n_clusters
+        self.concentration = concentration
+        self.max_iter = max_iter
+        self.tol = tol
+        self.random_state = random_state
+        self.warm_start = warm_start
+        self.verbose = verbose
+        self.verbose_interval = verbose_interval
+
+    def _weights(self, start: int, stop: int) -> np.ndarray:
+        if self.sample_weight is None:
+            return np.ones(stop - start)
+        return np.asarray(self.sample_weight, dtype=np.float64)[start:stop]
+
+    def _responsibilities(self, similarities: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns each point's responsibilities (n, k), and its contribution to
+        the objective (n,).
+        """
+        if self.concentration is None:
+            labels = similarities.argmax(axis=1)
+            resp = np.zeros_like(similarities)
+            resp[np.arange(len(labels)), labels] = 1
+            return resp, similarities[np.arange(len(labels)), labels]
+        with np.errstate(divide='ignore'):
+            log_weights = np.log(self.weights_)
+        logits = self.concentration * similarities + log_weights
+        log_norm = logsumexp(logits, axis=1)
+        return np.exp(logits - log_norm[:, np.newaxis]), log_norm
+
+    def _pass(self, X: np.ndarray, raw_sums: bool = False):
+        """
+        One pass over X in blocks: assigns points to the current centers and
+        accumulates the weighted sums of (normalized, or with raw_sums,
+        unnormalized) points per cluster.
+
+        Also returns the n_clusters worst fit (normalized) points, worst
+        first, to reseed empty clusters with.
+        """
+        sums = np.zeros((self.n_clusters, X.shape[1]), dtype=np.float64)
+        counts = np.zeros(self.n_clusters)
+        objective = total = 0.0
+        worst_fit = np.empty(0, dtype=np.float32)
+        worst = np.empty((0, X.shape[1]), dtype=np.float32)
+        for start in range(0, len(X), BLOCK_SIZE):
+            x = np.asarray(X[start:start + BLOCK_SIZE], dtype=np.float32)
+            x_unit = l2_normalize(x)
+            weights = self._weights(start, start + len(x))
+            similarities = x_unit @ self.cluster_centers_.T
+            resp, contribution = self._responsibilities(similarities)
+            resp *= weights[:, np.newaxis]
+
+            sums += resp.T @ (x if raw_sums else x_unit)
+            counts += resp.sum(axis=0)
+            objective += weights @ contribution
+            total += weights.sum()
+
+            # merge the block's worst fit points into the worst seen so far
+            fit = similarities.max(axis=1)
+            idx = np.argsort(fit, kind='stable')[:self.n_clusters]
+            worst_fit = np.concatenate([worst_fit, fit[idx]])
+            worst = np.concatenate([worst, x_unit[idx]])
+            keep = np.argsort(worst_fit, kind='stable')[:self.n_clusters]
+            worst_fit, worst = worst_fit[keep], worst[keep]
+        return sums, counts, objective / total, worst
+
+    def _initialize(self, X: np.ndarray, rng: np.random.RandomState) -> None:
+        idx = np.arange(len(X))
+        if len(X) > INIT_SAMPLE_SIZE:
+            idx = np.sort(rng.choice(len(X), INIT_SAMPLE_SIZE, replace=False))
+        sample = l2_normalize(X[idx])
+        sample_weight = None if self.sample_weight is None else np.asarray(self.sample_weight)[idx]
+        centers, _ = kmeans_plusplus(
+            sample, self.n_clusters, sample_weight=sample_weight, random_state=rng
+            )
+        self.cluster_centers_ = l2_normalize(centers)
+        self.weights_ = np.full(self.n_clusters, 1 / self.n_clusters)
+
+    def fit(self, X: np.ndarray, y=None) -> 'SphericalKMeans':
+        if len(X) < self.n_clusters:
+            raise ValueError(f"Expected at least n_clusters={self.n_clusters} samples, got {len(X)}.")
+        rng = np.random.RandomState(self.random_state)
+
+        # a warm start continues from the previous fit's centers
+        if self.warm_start and hasattr(self, 'converged_'):
+            objective = self.lower_bound_
+        else:
+            self._initialize(X, rng)
+            objective = -np.inf
+        self.n_features_in_ = X.shape[1]
+
+        self.converged_ = False
+        n_iter = 0
+        for n_iter in range(1, self.max_iter + 1):
+            previous_objective = objective
+            sums, counts, objective, worst = self._pass(X)
+
+            empty = counts <= 0
+            if empty.any():
+                # reseed each empty cluster at a different one of the worst fit points
+                sums[empty] = worst[:empty.sum()]
+                counts[empty] = 1
+            self.cluster_centers_ = l2_normalize(sums)
+            self.weights_ = counts / counts.sum()
+
+            if self.verbose >= 2 and n_iter % self.verbose_interval == 0:
+                print(f"  Iteration {n_iter}\t objective {objective:.6f}")
+            if abs(objective - previous_objective) < self.tol:
+                self.converged_ = True
+                break
+
+        # a final pass for the cluster means in the original (unnormalized) space
+        sums, counts, objective, _ = self._pass(X, raw_sums=True)
+        self.means_ = (sums / np.maximum(counts, np.finfo(np.float64).tiny)[:, np.newaxis]).astype(np.float32)
+        self.n_iter_ = n_iter
+        self.lower_bound_ = objective
+        if self.verbose >= 1:
+            print(f"Spherical k-means {'converged' if self.converged_ else 'did not converge'}.")
+        return self
+
+    def fit_predict(self, X: np.ndarray, y=None) -> np.ndarray:
+        return self.fit(X).predict(X)
+
+    def cosine_similarities(self, X: np.ndarray) -> np.ndarray:
+        """
+        Returns the (n, k) cosine similarities of X to the cluster centers.
+        """
+        check_is_fitted(self, 'cluster_centers_')
+        similarities = np.empty((len(X), self.n_clusters), dtype=np.float32)
+        for start in range(0, len(X), BLOCK_SIZE):
+            x = l2_normalize(X[start:start + BLOCK_SIZE])
+            similarities[start:start + BLOCK_SIZE] = x @ self.cluster_centers_.T
+        return similarities
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        return self.cosine_similarities(X).argmax(axis=1)
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        similarities = self.cosine_similarities(X)
+        if self.concentration is None:
+            probs = np.zeros_like(similarities)
+            probs[np.arange(len(X)), similarities.argmax(axis=1)] = 1
+            return probs
+        with np.errstate(divide='ignore'):
+            return softmax(self.concentration * similarities + np.log(self.weights_), axis=1)
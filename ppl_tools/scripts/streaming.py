@@ -0,0 +1,107 @@
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_CHUNK_SIZE = 10_000
+METADATA_COLUMNS = ['Participant Code', 'Project']
+
+
+def _require_pyarrow() -> None:
+    # optional dependency, only needed for streaming
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError as e:
+        raise ImportError('Streaming requires the pyarrow package (pip install pyarrow).') from e
+
+
+def count_text_rows(path: Path, text_column: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    """
+    Counts the rows of path with non-empty text, reading one column at a time.
+    """
+    n_rows = 0
+    for chunk in pd.read_csv(path, usecols=[text_column], chunksize=chunk_size):
+        n_rows += int(chunk[text_column].notna().sum())
+    return n_rows
+
+
+def stream_embeddings(
+    path: Path,
+    text_column: str,
+    embed_fn: Callable[[list[str]], np.ndarray],
+    out_file: Path,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    metadata_columns: list[str] = METADATA_COLUMNS,
+    table_file: Path | None = None,
+    ) -> tuple[pd.DataFrame, np.ndarray]:
+    """
+    Embeds the text column of a CSV chunk by chunk, writing vectors straight
+    into a .npy file on disk, and the text and metadata into an Arrow file.
+
+    Only text_column and whichever of metadata_columns exist are read (as
+    strings), and rows with empty text are dropped. Only one chunk is held in
+    memory at a time, so memory while reading and embedding is proportional
+    to chunk_size rather than to the size of the file: the file is read once
+    to count rows so the output can be preallocated, and a second time to
+    embed. Both outputs are returned memory-mapped, so they are only paged
+    in as they are used.
+
+    Args:
+        path (Path): The CSV file to read.
+        text_column (str): Column containing the text to embed.
+        embed_fn (Callable): Embeds a list of strings, returning an (n, d) array.
+        out_file (Path): Where to write the (n_rows, d) float32 .npy file.
+        chunk_size (int): Number of CSV rows to read and embed at a time.
+        metadata_columns (list[str]): Columns to keep alongside the text, if present.
+        table_file (Path): Where to write the text and metadata columns, as
+            an uncompressed Arrow (Feather) file; by default beside out_file.
+
+    Returns:
+        tuple[pd.DataFrame, np.ndarray]: The text and metadata columns, backed
+            by the memory-mapped Arrow file, and the embeddings as a read-only
+            memory-mapped array in the same row order.
+
+    Raises:
+        ImportError: If pyarrow isn't installed.
+    """
+    _require_pyarrow()
+    import pyarrow as pa
+    from pyarrow import feather
+
+    table_file = Path(table_file) if table_file is not None else Path(out_file).with_suffix('.arrow')
+    header = pd.read_csv(path, nrows=0).columns
+    if text_column not in header:
+        raise KeyError(f"Column '{text_column}' not found in {path}.")
+    columns = [text_column] + [c for c in metadata_columns if c in header and c != text_column]
+
+    n_rows = count_text_rows(path, text_column, chunk_size)
+
+    # strings throughout, so that every chunk has the same schema
+    schema = pa.schema([(c, pa.string()) for c in columns])
+    store: np.ndarray | None = None
+    offset = 0
+    with pa.ipc.new_file(table_file, schema) as writer:
+        for chunk in pd.read_csv(path, usecols=columns, dtype=str, chunksize=chunk_size):
+            chunk = chunk[chunk[text_column].notna()]
+            if len(chunk) == 0:
+                continue
+            embeddings = np.asarray(embed_fn(chunk[text_column].tolist()), dtype=np.float32)
+            if store is None:
+                # the embedding dimension is only known once the first chunk is embedded
+                store = np.lib.format.open_memmap(
+                    out_file, mode='w+', dtype=np.float32, shape=(n_rows, embeddings.shape[1])
+                    )
+            store[offset:offset + len(chunk)] = embeddings
+            offset += len(chunk)
+            writer.write_batch(pa.RecordBatch.from_pandas(chunk[columns], schema=schema, preserve_index=False))
+            print(f'Embedded {offset}/{n_rows} rows')
+
+    if store is None:
+        raise ValueError(f"No text found in column '{text_column}' of {path}.")
+    store.flush()
+    del store
+
+    # Arrow-backed columns, so the strings stay in the mapped file
+    df = feather.read_table(table_file, memory_map=True).to_pandas(types_mapper=pd.ArrowDtype)
+    return df, np.load(out_file, mmap_mode='r')
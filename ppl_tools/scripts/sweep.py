@@ -0,0 +1,201 @@
+import dataclasses
+import multiprocessing
+import os
+import signal
+import tempfile
+import time
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from sklearn.metrics import silhouette_score
+from threadpoolctl import threadpool_limits
+
+from ppl_tools.scripts.cluster import ClusteringConfig, ClusteringModelType, fit, reduce_embeddings
+from ppl_tools.scripts.reduction import ReducedMixture
+
+# silhouette is quadratic in the number of points, so it's estimated on a sample
+SILHOUETTE_SAMPLE_SIZE = 5000
+
+
+def _silhouette(embeddings: np.ndarray, labels: np.ndarray, sample_weight: np.ndarray | None) -> float:
+    if sample_weight is None:
+        if len(np.unique(labels)) < 2:
+            return np.nan
+        return silhouette_score(
+            embeddings, labels, sample_size=min(SILHOUETTE_SAMPLE_SIZE, len(embeddings)), random_state=0
+            )
+    # drawn in proportion to weight, with replacement, like a sample of the
+    # dataset with each point repeated weight times would be
+    sample = np.sort(np.random.default_rng(0).choice(
+        len(embeddings), min(SILHOUETTE_SAMPLE_SIZE, len(embeddings)), p=sample_weight / sample_weight.sum()
+        ))
+    # silhouette needs 2 to n - 1 clusters
+    if not 1 < len(np.unique(labels[sample])) < len(sample):
+        return np.nan
+    return silhouette_score(embeddings[sample], labels[sample])
+
+
+def _score(model, embeddings: np.ndarray, sample_weight: np.ndarray | None) -> dict:
+    labels = model.predict(embeddings)
+    silhouette = _silhouette(embeddings, labels, sample_weight)
+
+    bic = aic = np.nan
+    # the Bayesian mixture has no parameter count in sklearn, and spherical k-means
+    # no likelihood, so they're scored by silhouette only
+    if hasattr(model, '_n_parameters'):
+        weights = np.ones(len(embeddings)) if sample_weight is None else sample_weight
+        log_likelihood = np.sum(weights * model.score_samples(embeddings))
+        n_parameters = model._n_parameters()
+        bic = -2 * log_likelihood + n_parameters * np.log(weights.sum())
+        aic = -2 * log_likelihood + 2 * n_parameters
+
+    return {'bic': bic, 'aic': aic, 'silhouette': silhouette}
+
+
+def _fit_candidate(
+    embeddings_file: Path,
+    config: ClusteringConfig,
+    sample_weight: np.ndarray | None,
+    n_threads: int
+    ) -> tuple[object, np.ndarray, dict]:
+    embeddings = np.load(embeddings_file, mmap_mode='r')
+    start = time.perf_counter()
+    # split the machine's cores between workers instead of oversubscribing
+    with threadpool_limits(n_threads):
+        # any restarts run one after another within this worker
+        model, order = fit(embeddings, config, sample_weight, n_workers=1)
+        fit_seconds = time.perf_counter() - start
+        scores = _score(model, embeddings, sample_weight)
+    row = {
+        'n_clusters': config.n_clusters,
+        **scores,
+        'converged': model.converged_,
+        'n_iter': model.n_iter_,
+        'fit_s': fit_seconds,
+        'total_s': time.perf_counter() - start,
+    }
+    return model, order, row
+
+
+def _init_worker(pids) -> None:
+    # reports the worker's pid, so that a cancelled sweep can terminate it
+    pids.put(os.getpid())
+
+
+def _stop_workers(executor: ProcessPoolExecutor, pids) -> None:
+    # candidates can't be interrupted mid-fit, and leaving the executor
+    # waits for running ones to finish, which can take minutes; so the
+    # candidates not started are dropped, and the workers are terminated
+    executor.shutdown(wait=False, cancel_futures=True)
+    while not pids.empty():
+        try:
+            os.kill(pids.get(), signal.SIGTERM)
+        except OSError:
+            # already exited
+            pass
+
+
+def default_criterion(config: ClusteringConfig) -> str:
+    # models without a parameter count can't be scored by BIC
+    if config.model_type in (ClusteringModelType.DPGMM, ClusteringModelType.SPHERICAL):
+        return 'silhouette'
+    return 'bic'
+
+
+def sweep(
+    embeddings: np.ndarray,
+    config: ClusteringConfig,
+    cluster_counts: list[int],
+    sample_weight: np.ndarray | None = None,
+    n_workers: int | None = None,
+    criterion: str | None = None,
+    progress_callback: Callable[[int], None] | None = None,
+    cancellation_check: Callable[[], bool] | None = None,
+    ) -> tuple[tuple[object, np.ndarray, ClusteringConfig], pd.DataFrame] | None:
+    """
+    Fits config's mixture model for each number of clusters in cluster_counts,
+    in parallel worker processes, and picks the best.
+
+    Each candidate is scored by BIC and AIC (lower is better; Gaussian
+    mixtures only) and silhouette (higher is better), which is estimated on
+    a sample drawn in proportion to sample_weight. The embeddings are
+    shared with the workers through a memory-mapped file rather than
+    copied into each of them.
+
+    Args:
+        embeddings (np.ndarray): The (n, d) embeddings to cluster.
+        config (ClusteringConfig): Settings shared by all candidates; n_clusters is ignored.
+        cluster_counts (list[int]): Numbers of clusters to try.
+        sample_weight (np.ndarray): Optional weight of each embedding.
+        n_workers (int): Number of worker processes; defaults to one per candidate, up to the core count.
+        criterion (str): 'bic', 'aic' or 'silhouette'; defaults to BIC for Gaussian
+            mixtures and silhouette for Bayesian ones.
+        progress_callback (Callable): Called with the percentage of candidates fit so far.
+        cancellation_check (Callable): Returns True if the sweep should stop.
+
+    Returns:
+        tuple: The best candidate's (fitted model, cluster order, config), and a
+            table with one row of scores and timings per candidate; or None if
+            cancelled.
+
+    Raises:
+        ValueError: For graph clustering, which ignores n_clusters.
+    """
+    if config.model_type == ClusteringModelType.GRAPH:
+        raise ValueError('Graph clustering finds the number of clusters itself, so it cannot be swept.')
+    criterion = criterion or default_criterion(config)
+    n_cpus = os.cpu_count() or 1
+    n_workers = n_workers or min(len(cluster_counts), n_cpus)
+    n_threads = max(1, n_cpus // n_workers)
+
+    configs = {k: dataclasses.replace(config, n_clusters=k) for k in cluster_counts}
+    # project once here rather than in every candidate's process; candidates
+    # fit on the projected embeddings, without reduction of their own
+    projection, embeddings = reduce_embeddings(embeddings, config)
+    fit_configs = {
+        k: dataclasses.replace(c, reduction_components=None, reduction_variance=None, whiten=False)
+        for k, c in configs.items()
+    }
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        embeddings_file = Path(tmp_dir) / 'embeddings.npy'
+        np.save(embeddings_file, np.asarray(embeddings, dtype=np.float32))
+
+        # spawn rather than fork, since forking a process which has Qt threads running is unsafe
+        mp_context = multiprocessing.get_context('spawn')
+        pids = mp_context.SimpleQueue()
+        with ProcessPoolExecutor(
+                n_workers, mp_context=mp_context, initializer=_init_worker, initargs=(pids,)
+                ) as executor:
+            pending = {
+                executor.submit(_fit_candidate, embeddings_file, fit_configs[k], sample_weight, n_threads): k
+                for k in cluster_counts
+            }
+            while pending:
+                done, _ = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                if cancellation_check is not None and cancellation_check():
+                    _stop_workers(executor, pids)
+                    return None
+                for future in done:
+                    k = pending.pop(future)
+                    results[k] = future.result()
+                    if progress_callback is not None:
+                        progress_callback(round(100 * len(results) / len(cluster_counts)))
+
+    table = pd.DataFrame([results[k][2] for k in sorted(results)])
+    scores = table[criterion].to_numpy()
+    if np.all(np.isnan(scores)):
+        raise ValueError(f"No candidate could be scored by {criterion}.")
+    best_idx = np.nanargmax(scores) if criterion == 'silhouette' else np.nanargmin(scores)
+    best_k = int(table['n_clusters'].iloc[best_idx])
+    table['best'] = table['n_clusters'] == best_k
+
+    model, order, _ = results[best_k]
+    if projection is not None:
+        model = ReducedMixture(projection, model)
+    return (model, order, configs[best_k]), table
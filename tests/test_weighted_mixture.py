@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from ppl_tools.scripts.cluster import WeightedBayesianGaussianMixture, WeightedGaussianMixture
+
+COVARIANCE_TYPES = ['full', 'tied', 'diag', 'spherical']
+
+
+def _data(seed: int) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    X = np.vstack([rng.normal(center, 0.5, (30, 3)) for center in [0, 3, 6]])
+    return X, rng.integers(1, 4, len(X))
+
+
+def _fit(cls, covariance_type: str, X: np.ndarray, sample_weight: np.ndarray | None = None):
+    mixture = cls(n_components=3, covariance_type=covariance_type, random_state=0, tol=1e-10, max_iter=1000)
+    mixture.sample_weight = sample_weight
+    return mixture.fit(X)
+
+
+@pytest.mark.parametrize('cls', [WeightedGaussianMixture, WeightedBayesianGaussianMixture])
+@pytest.mark.parametrize('covariance_type', COVARIANCE_TYPES)
+def test_weighted_fit_matches_repeated_data(cls, covariance_type):
+    X, weight = _data(0)
+    weighted = _fit(cls, covariance_type, X, weight)
+    repeated = _fit(cls, covariance_type, np.repeat(X, weight, axis=0))
+
+    weighted_order = np.argsort(weighted.means_[:, 0])
+    repeated_order = np.argsort(repeated.means_[:, 0])
+    np.testing.assert_allclose(weighted.means_[weighted_order], repeated.means_[repeated_order], atol=1e-6)
+    np.testing.assert_allclose(weighted.weights_[weighted_order], repeated.weights_[repeated_order], atol=1e-6)
+    np.testing.assert_allclose(weighted.lower_bound_, repeated.lower_bound_, rtol=1e-6)
+
+
+@pytest.mark.parametrize('cls', [WeightedGaussianMixture, WeightedBayesianGaussianMixture])
+@pytest.mark.parametrize('covariance_type', COVARIANCE_TYPES)
+def test_weighted_fit_succeeds(cls, covariance_type):
+    for seed in range(20):
+        X, weight = _data(seed)
+        mixture = _fit(cls, covariance_type, X, weight)
+        assert np.isclose(mixture.weights_.sum(), 1)